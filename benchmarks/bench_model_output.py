@@ -0,0 +1,84 @@
+"""Micro-benchmark of model output parsing.
+
+Compares the per-Lambda parsing that parseandstoreresults (Claude 3) and
+cleanandsaveparquet (Claude v2) used to do, with regexes compiled on every
+search, against the shared ModelOutputParser, on synthetic Bedrock output
+with a fraction of truncated completions.
+
+    python benchmarks/bench_model_output.py --records 100000 --truncated 0.02
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import synthetic
+
+sys.path.insert(0, os.path.join(synthetic.ROOT, "functions", "lambda_layers", "common", "python"))
+
+from common.model_output import ModelOutputParser  # noqa: E402
+
+
+def legacy_claude3(lines):
+    parsed = 0
+    for item in lines:
+        json_item = json.loads(item)
+        match = re.search(r"<result>(.*?)</result>", json_item["modelOutput"]["content"][0]["text"])
+        if match:
+            result = json.loads(match.group(1))
+            re.search(r"Game Review:\s*(.*)", json_item["modelInput"]["messages"][0]["content"][0]["text"], re.DOTALL)
+            parsed += result is not None
+    return parsed
+
+
+def legacy_claude_v2(lines):
+    parsed = 0
+    for item in lines:
+        json_item = json.loads(item)
+        match = re.search(r"<result>(.*?)</result>", json_item["modelOutput"]["completion"])
+        re.search(r"Game Review:(.*?)Assistant", json_item["modelInput"]["prompt"], re.DOTALL)
+        if match:
+            try:
+                json.loads(match.group(1).replace('\\"', '"'))
+                parsed += 1
+            except json.JSONDecodeError:
+                pass
+    return parsed
+
+
+LEGACY = {"claude-3": legacy_claude3, "claude-v2": legacy_claude_v2}
+
+
+def shared(lines):
+    parser = ModelOutputParser()
+    parsed = sum(1 for line in lines if (record := parser.parse_line(line)) is not None and record.result is not None)
+    return parsed, parser.stats
+
+
+def run(name, parse, lines):
+    start = time.perf_counter()
+    result = parse(lines)
+    elapsed = time.perf_counter() - start
+    parsed = result[0] if isinstance(result, tuple) else result
+    print(f"  {name:<8} {len(lines) / elapsed:>12,.0f} records/s  {parsed:>9} parsed")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model output parsing.")
+    parser.add_argument("--records", type=int, default=100000, help="number of synthetic records")
+    parser.add_argument("--truncated", type=float, default=0.02, help="fraction of truncated completions")
+    args = parser.parse_args()
+
+    for shape in sorted(synthetic.SHAPES):
+        lines = list(synthetic.output_lines(args.records, shape, truncated=args.truncated))
+        print(shape)
+        baseline, _ = run("legacy", LEGACY[shape], lines)
+        elapsed, (_, stats) = run("shared", shared, lines)
+        print(f"  speedup  {baseline / elapsed:>12.2f}x  {dict(stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Benchmark of the Parquet output written by cleanandsaveparquet.
+
+Compares the pandas conversion cleanandsaveparquet used to do (a list of
+dicts, a DataFrame, explode, apply(pd.Series), concat, then to_parquet into
+a BytesIO) with the streaming Arrow writer, on synthetic Bedrock output.
+Both parse with the shared ModelOutputParser; the streaming writer's output
+is counted and discarded, as the Lambda streams it to S3. "hive" is the
+streaming writer with topic/sentiment partitioning.
+
+    python benchmarks/bench_parquet.py --sizes 10000,100000
+
+Every case runs in its own process so that peak RSS is not inflated by the
+previous case.
+"""
+import argparse
+import gc
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import synthetic
+from bench_pipeline import COMMON_LAYER, peak_rss_bytes, reset_peak_rss
+
+CLEAN_DIR = os.path.join(synthetic.ROOT, "functions", "cleanandsaveparquet")
+
+
+class CountingSink:
+    """Write-only file object that keeps only the number of bytes."""
+
+    def __init__(self):
+        self.bytes_written = 0
+        self.closed = False
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.closed = True
+
+
+def load_clean():
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path[:0] = [CLEAN_DIR, COMMON_LAYER]
+    spec = importlib.util.spec_from_file_location("clean_index", os.path.join(CLEAN_DIR, "index.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def pandas_writer(lines, parser):
+    import pandas as pd
+
+    records = []
+    for line in lines:
+        record = parser.parse_line(line)
+        if record is None:
+            continue
+        result = record.result or {"overall_sentiment": "null", "classifications": []}
+        records.append({
+            "recordId": record.record_id,
+            "prompt": record.prompt,
+            "gamereview": record.review if record.review is not None else "not found",
+            "overall_sentiment": result["overall_sentiment"],
+            "classifications": result.get("classifications", []),
+        })
+
+    df = pd.DataFrame(records)
+    exploded = df.explode('classifications').reset_index(drop=True)
+    new_df = exploded['classifications'].apply(pd.Series)
+    new_df = pd.concat([exploded['recordId'], exploded['overall_sentiment'], exploded['prompt'], exploded['gamereview'], new_df], axis=1)
+    new_df = new_df.drop(0, axis=1)
+    parquet_buffer = io.BytesIO()
+    new_df.to_parquet(parquet_buffer, engine='pyarrow')
+    return len(new_df), len(parquet_buffer.getvalue())
+
+
+def arrow_writer(lines, parser, partitioning="none"):
+    clean = load_clean()
+    sinks = []
+
+    def open_sink(path):
+        sinks.append(CountingSink())
+        return sinks[-1]
+
+    writer = clean.write_parquet(lines, parser, open_sink, partitioning)
+    return writer.rows, sum(sink.bytes_written for sink in sinks)
+
+
+WRITERS = {
+    "pandas": pandas_writer,
+    "arrow": arrow_writer,
+    "hive": lambda lines, parser: arrow_writer(lines, parser, "topic_sentiment"),
+}
+
+
+def run_case(writer, size, shape):
+    sys.path.insert(0, COMMON_LAYER)
+    from common.model_output import ModelOutputParser
+
+    if writer != "pandas":
+        # import outside the timed section, as pandas is below
+        load_clean()
+    else:
+        import pandas  # noqa: F401
+
+    lines = synthetic.output_lines(size, shape)
+    gc.collect()
+    watermark_reset = reset_peak_rss()
+    start = time.perf_counter()
+    rows, output_bytes = WRITERS[writer](lines, ModelOutputParser())
+    elapsed = time.perf_counter() - start
+    return {
+        "writer": writer,
+        "shape": shape,
+        "records": size,
+        "rows": rows,
+        "seconds": elapsed,
+        "records_per_second": size / elapsed,
+        "peak_rss_bytes": peak_rss_bytes(watermark_reset),
+        "output_bytes": output_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Parquet output of cleanandsaveparquet.")
+    parser.add_argument("--sizes", default="10000,100000", help="comma separated review counts")
+    parser.add_argument("--shape", choices=sorted(synthetic.SHAPES), default="claude-3", help="Bedrock output shape")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        writer, size = args.run_one.split(":")
+        print(json.dumps(run_case(writer, int(size), args.shape)))
+        return
+
+    results = []
+    print(f"{'writer':<8} {'records':>9} {'rows':>9} {'records/s':>11} {'peak RSS':>10} {'output':>10}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        for writer in WRITERS:
+            completed = subprocess.run(
+                [sys.executable, __file__, "--shape", args.shape, "--run-one", f"{writer}:{size}"],
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode != 0:
+                print(completed.stderr[-2000:], file=sys.stderr)
+                print(f"{writer:<8} {size:>9} failed")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(
+                f"{writer:<8} {size:>9} {result['rows']:>9} {result['records_per_second']:>11,.0f}"
+                f" {result['peak_rss_bytes'] / 2**20:>8.1f}Mi {result['output_bytes'] / 2**20:>8.1f}Mi"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Micro-benchmark of JSONL request encoding in prepareforinference.
+
+Compares the per-row path (build the model input dict, then json.dumps the
+whole request) with the pre-encoded PayloadTemplate path.
+
+    python benchmarks/bench_payload_templates.py --records 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "functions", "prepareforinference"))
+
+from utils.ModelFactory import ModelPayloadGeneratorFactory  # noqa: E402
+
+MODEL_IDS = [
+    "anthropic.claude-v2:1",
+    "anthropic.claude-3-sonnet-20240229-v1:0",
+    "meta.llama3-70b-instruct-v1:0",
+    "amazon.titan-text-express-v1",
+]
+
+PROPERTIES = {"temperature": 0.0, "top_k": 1, "top_p": 1.0, "max_tokens_to_sample": 2000}
+
+WORDS = "the game is fun but crashes often great story bad controls price too high love the graphics".split()
+
+
+def load_prompt():
+    path = os.path.join(ROOT, "cdk", "lib", "variables.yml")
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    return text.split("PROMPT: |\n", 1)[1].replace("\n  ", "\n")
+
+
+def dict_path(generator, prompt, reviews):
+    for record_id, review in reviews:
+        model_input = generator.generate({**PROPERTIES, "prompt": prompt + review})
+        yield f"{json.dumps({'recordId': record_id, 'modelInput': model_input})}\n".encode("utf-8")
+
+
+def template_path(generator, prompt, reviews):
+    template = generator.compile(PROPERTIES, prompt)
+    for record_id, review in reviews:
+        yield b'{"recordId":' + json.dumps(record_id).encode("utf-8") + b',"modelInput":' + template.render(review) + b"}\n"
+
+
+def run(name, encode, generator, prompt, reviews):
+    start = time.perf_counter()
+    total_bytes = sum(len(line) for line in encode(generator, prompt, reviews))
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<10} {len(reviews) / elapsed:>12,.0f} records/s  {total_bytes / elapsed / 2**20:>8.1f} MiB/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSONL request encoding.")
+    parser.add_argument("--records", type=int, default=100000, help="number of synthetic reviews")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    prompt = load_prompt()
+    reviews = [
+        (str(76561197960265728 + i), " ".join(rng.choices(WORDS, k=rng.randint(5, 120))))
+        for i in range(args.records)
+    ]
+
+    for model_id in MODEL_IDS:
+        generator = ModelPayloadGeneratorFactory().create_payload_generator(model_id)
+        sample = reviews[:100]
+        assert [json.loads(line) for line in dict_path(generator, prompt, sample)] == [
+            json.loads(line) for line in template_path(generator, prompt, sample)
+        ]
+        print(model_id)
+        baseline = run("dict", dict_path, generator, prompt, reviews)
+        template = run("template", template_path, generator, prompt, reviews)
+        print(f"  speedup    {baseline / template:>12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
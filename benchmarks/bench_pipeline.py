@@ -0,0 +1,273 @@
+"""Throughput benchmark of the inference pipeline Lambdas.
+
+Runs prepareforinference, parseandstoreresults and cleanandsaveparquet
+against moto's in-memory S3, DynamoDB and SSM (or, with --backend endpoint,
+against whatever AWS_ENDPOINT_URL points at, e.g. LocalStack) on synthetic
+reviews and canned Bedrock output, and reports records/s, peak RSS and the
+bytes sent to and received from AWS for every stage and size.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_pipeline.py --sizes 1000,100000 --stages prepare,parse
+
+Every case runs in its own process so that peak RSS is not inflated by the
+previous case. moto keeps stored objects and items in the same process, so
+the reported peak includes what the stage wrote.
+"""
+import argparse
+import gc
+import importlib.util
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import synthetic
+
+ROOT = synthetic.ROOT
+COMMON_LAYER = os.path.join(ROOT, "functions", "lambda_layers", "common", "python")
+
+STAGES = {
+    "prepare": "prepareforinference",
+    "parse": "parseandstoreresults",
+    "clean": "cleanandsaveparquet",
+}
+
+# Bedrock output shapes each stage can read
+STAGE_SHAPES = {stage: set(synthetic.SHAPES) for stage in STAGES}
+
+BUCKET = "bench-game-reviews"
+TABLE = "bench-game-reviews"
+STACK = "bench"
+GAME_ID = "bench-game"
+JOB_ID = "bench-job"
+CHILD_JOB_ID = "benchchild0001"
+JOB_ARN = f"arn:aws:bedrock:us-east-1:123456789012:model-invocation-job/{CHILD_JOB_ID}"
+
+
+class ByteCounter:
+    """Counts request and response body bytes of every AWS call made through
+    clients of the default boto3 session."""
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+
+    def install(self, session):
+        session.events.register("request-created", self._on_request)
+        session.events.register("after-call", self._on_response)
+
+    def reset(self):
+        self.sent = 0
+        self.received = 0
+
+    def _on_request(self, request, **kwargs):
+        body = request.body
+        if isinstance(body, (bytes, bytearray, str)):
+            self.sent += len(body)
+            return
+        # streamed uploads are wrapped and announce their length instead
+        length = request.headers.get("X-Amz-Decoded-Content-Length") or request.headers.get("Content-Length")
+        self.sent += int(length or 0)
+
+    def _on_response(self, http_response, parsed, **kwargs):
+        if "ContentLength" in parsed and hasattr(parsed.get("Body"), "read"):
+            self.received += parsed["ContentLength"]
+        else:
+            self.received += len(http_response.content or b"")
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS watermark, if the kernel allows it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes(watermark_reset):
+    if watermark_reset:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_handler(stage):
+    function_dir = os.path.join(ROOT, "functions", STAGES[stage])
+    sys.path[:0] = [function_dir, COMMON_LAYER]
+    spec = importlib.util.spec_from_file_location(f"{stage}_index", os.path.join(function_dir, "index.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.lambda_handler
+
+
+def create_resources(boto3, model_id):
+    import yaml
+
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket=BUCKET)
+    boto3.client("dynamodb").create_table(
+        TableName=TABLE,
+        KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": name, "AttributeType": "S"} for name in ("PK", "SK", "GSI1PK", "GSI1SK")
+        ],
+        GlobalSecondaryIndexes=[{
+            "IndexName": "ReviewFilterIndex",
+            "KeySchema": [{"AttributeName": "GSI1PK", "KeyType": "HASH"}, {"AttributeName": "GSI1SK", "KeyType": "RANGE"}],
+            "Projection": {
+                "ProjectionType": "INCLUDE",
+                "NonKeyAttributes": ["reviewId", "overall_sentiment", "classifications", "original_review"],
+            },
+        }],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    with open(os.path.join(ROOT, "cdk", "lib", "variables.yml"), encoding="utf-8") as f:
+        parameters = yaml.safe_load(f)
+    parameters["MODEL_ID"] = model_id
+    ssm = boto3.client("ssm")
+    for name, value in parameters.items():
+        ssm.put_parameter(Name=f"/{STACK}/default/{name}", Value=str(value), Type="String", Overwrite=True)
+    return s3, boto3.resource("dynamodb").Table(TABLE)
+
+
+def stage_prepare(s3, table, size, shape):
+    key = f"{GAME_ID}/jobs/{JOB_ID}/raw-data/reviews.csv"
+    buffer = io.StringIO()
+    synthetic.write_reviews_csv(buffer, size)
+    s3.put_object(Bucket=BUCKET, Key=key, Body=buffer.getvalue().encode("utf-8"))
+    table.put_item(Item={"PK": f"GAME#{GAME_ID}", "SK": f"JOB#{JOB_ID}", "jobStatus": "Not Submitted"})
+    return {
+        "game_id": GAME_ID,
+        "job_id": JOB_ID,
+        "job_name": JOB_ID,
+        "s3_raw_data_source_key": f"s3://{BUCKET}/{key}",
+    }
+
+
+def stage_parse(s3, table, size, shape):
+    output_prefix = f"{GAME_ID}/jobs/{JOB_ID}/output/"
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=f"{output_prefix}{CHILD_JOB_ID}/reviews.jsonl.out",
+        Body=b"".join(synthetic.output_lines(size, shape)),
+    )
+    table.put_item(Item={
+        "PK": f"GAME#{GAME_ID}",
+        "SK": f"JOB#{JOB_ID}",
+        "jobStatus": "Completed",
+        "jobARN": JOB_ARN,
+        "jobARNs": [JOB_ARN],
+        "modelId": synthetic.SHAPES[shape],
+        "s3OutputURI": f"s3://{BUCKET}/{output_prefix}",
+        "inferenceCacheEnabled": True,
+    })
+    return {"game_id": GAME_ID, "job_id": JOB_ID}
+
+
+def stage_clean(s3, table, size, shape):
+    # clean reads the same job item and output files as parse
+    return stage_parse(s3, table, size, shape)
+
+
+SETUP = {"prepare": stage_prepare, "parse": stage_parse, "clean": stage_clean}
+
+
+def run_case(stage, size, shape, backend):
+    """Set up one case, run the stage's handler once and return its metrics."""
+    os.environ.update({
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "stackName": STACK,
+        "s3SourceBucketName": BUCKET,
+        "s3DestinationBucketName": BUCKET,
+        "gameDataBucketName": BUCKET,
+        "ddbTableName": TABLE,
+    })
+    if backend == "moto":
+        os.environ.update({"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing"})
+        from moto import mock_aws
+        mock = mock_aws()
+        mock.start()
+
+    import boto3
+
+    boto3.setup_default_session()
+    counter = ByteCounter()
+    counter.install(boto3.DEFAULT_SESSION)
+
+    s3, table = create_resources(boto3, synthetic.SHAPES[shape])
+    event = SETUP[stage](s3, table, size, shape)
+    handler = load_handler(stage)
+
+    gc.collect()
+    watermark_reset = reset_peak_rss()
+    counter.reset()
+    start = time.perf_counter()
+    handler(event, None)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "stage": stage,
+        "shape": shape,
+        "records": size,
+        "seconds": elapsed,
+        "records_per_second": size / elapsed,
+        "peak_rss_bytes": peak_rss_bytes(watermark_reset),
+        "bytes_sent": counter.sent,
+        "bytes_received": counter.received,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference pipeline Lambdas.")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma separated review counts")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated stages")
+    parser.add_argument("--shapes", default=",".join(sorted(synthetic.SHAPES)), help="comma separated output shapes")
+    parser.add_argument("--backend", choices=["moto", "endpoint"], default="moto",
+                        help="moto, or real clients for an endpoint set through AWS_ENDPOINT_URL")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        stage, size, shape = args.run_one.split(":")
+        print(json.dumps(run_case(stage, int(size), shape, args.backend)))
+        return
+
+    results = []
+    print(f"{'stage':<8} {'shape':<10} {'records':>9} {'records/s':>11} {'peak RSS':>10} {'sent':>10} {'received':>10}")
+    for stage in args.stages.split(","):
+        for shape in args.shapes.split(","):
+            if shape not in STAGE_SHAPES[stage]:
+                continue
+            for size in (int(size) for size in args.sizes.split(",")):
+                completed = subprocess.run(
+                    [sys.executable, __file__, "--backend", args.backend, "--run-one", f"{stage}:{size}:{shape}"],
+                    capture_output=True,
+                    text=True,
+                )
+                if completed.returncode != 0:
+                    print(completed.stderr[-2000:], file=sys.stderr)
+                    print(f"{stage:<8} {shape:<10} {size:>9} failed")
+                    continue
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                results.append(result)
+                print(
+                    f"{stage:<8} {shape:<10} {size:>9} {result['records_per_second']:>11,.0f}"
+                    f" {result['peak_rss_bytes'] / 2**20:>8.1f}Mi"
+                    f" {result['bytes_sent'] / 2**20:>8.1f}Mi {result['bytes_received'] / 2**20:>8.1f}Mi"
+                )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Synthetic Steam reviews and canned Bedrock batch inference output.
+
+Writes a review CSV in the shape generateCSVSteam produces, or the
+`.jsonl.out` file Bedrock would write for it, in either the Claude v2
+(text completions) or Claude 3 (messages) output shape.
+
+    python benchmarks/synthetic.py reviews 100000 reviews.csv
+    python benchmarks/synthetic.py output 100000 data.jsonl.out --shape claude-3
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHAPES = {
+    "claude-v2": "anthropic.claude-v2:1",
+    "claude-3": "anthropic.claude-3-sonnet-20240229-v1:0",
+}
+
+TOPICS = ["Price", "Sound", "Story", "Support", "Controls", "Gameplay", "Graphics", "Multiplayer", "Performance"]
+SENTIMENTS = ["Positive", "Negative", "Neutral"]
+
+PHRASES = [
+    "the graphics are stunning",
+    "the controls feel clunky",
+    "crashes every time I load a save",
+    "the story kept me hooked for hours",
+    "way too expensive for what you get",
+    "the soundtrack is amazing",
+    "matchmaking takes forever",
+    "support never answered my ticket",
+    "runs smooth on my old laptop",
+    "gameplay loop is addictive",
+    "10/10 would play again",
+    "not worth it",
+    "great with friends",
+    "the devs keep adding content",
+    "refunded after two hours",
+]
+
+# Steam ids of recommendations are large sequential-looking integers
+FIRST_RECORD_ID = 150000000
+
+PROPERTIES = {"temperature": 0.0, "top_k": 1, "top_p": 1.0, "max_tokens_to_sample": 2000}
+
+
+def load_prompt():
+    path = os.path.join(ROOT, "cdk", "lib", "variables.yml")
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    return text.split("PROMPT: |\n", 1)[1].replace("\n  ", "\n")
+
+
+def generate_reviews(count, seed=42):
+    """Yield (id, review) pairs with a Steam-like length distribution: many
+    one-liners, some paragraphs and a long tail of essays."""
+    rng = random.Random(seed)
+    for i in range(count):
+        sentences = max(1, int(rng.paretovariate(1.2)))
+        review = ". ".join(rng.choice(PHRASES) for _ in range(min(sentences, 200)))
+        if rng.random() < 0.05:
+            review += "\n\n" + review.upper()
+        yield str(FIRST_RECORD_ID + i), review.capitalize() + "."
+
+
+def classify(rng):
+    # some reviews name no topic the model can classify
+    topics = rng.sample(TOPICS, rng.randint(1, 3)) if rng.random() > 0.02 else []
+    return {
+        "overall_sentiment": rng.choice(SENTIMENTS),
+        "classifications": [{"topic": topic, "sentiment": rng.choice(SENTIMENTS)} for topic in topics],
+    }
+
+
+def write_reviews_csv(f, count, seed=42):
+    writer = csv.DictWriter(f, fieldnames=["id", "review"])
+    writer.writeheader()
+    for record_id, review in generate_reviews(count, seed):
+        writer.writerow({"id": record_id, "review": review})
+
+
+def output_lines(count, shape, seed=42, truncated=0.0):
+    """Yield the `.jsonl.out` lines Bedrock writes for `count` synthetic
+    reviews, as bytes. A `truncated` fraction of the completions is cut off
+    inside the result block, as when the output token limit is hit."""
+    sys.path.insert(0, os.path.join(ROOT, "functions", "prepareforinference"))
+    from utils.ModelFactory import ModelPayloadGeneratorFactory
+
+    generator = ModelPayloadGeneratorFactory().create_payload_generator(SHAPES[shape])
+    template = generator.compile(PROPERTIES, load_prompt())
+    rng = random.Random(seed + 1)
+    for record_id, review in generate_reviews(count, seed):
+        result = f"<result>{json.dumps(classify(rng), separators=(',', ':'))}</result>"
+        if truncated and rng.random() < truncated:
+            result = result[:rng.randint(len(result) // 2, len(result) - 12)]
+        if shape == "claude-v2":
+            model_output = {"type": "completion", "completion": f" {result}", "stop_reason": "stop_sequence", "stop": "\n\nHuman:"}
+        else:
+            model_output = {
+                "id": f"msg_bdrk_{record_id}",
+                "type": "message",
+                "role": "assistant",
+                "model": "claude-3-sonnet-20240229",
+                "content": [{"type": "text", "text": result}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 400 + len(review) // 4, "output_tokens": len(result) // 4},
+            }
+        yield (
+            b'{"modelInput":' + template.render(review)
+            + b',"modelOutput":' + json.dumps(model_output).encode("utf-8")
+            + b',"recordId":' + json.dumps(record_id).encode("utf-8") + b"}\n"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic reviews or canned Bedrock output.")
+    parser.add_argument("kind", choices=["reviews", "output"], help="review CSV or Bedrock .jsonl.out")
+    parser.add_argument("count", type=int, help="number of reviews")
+    parser.add_argument("path", help="file to write")
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="claude-3", help="Bedrock output shape")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncated", type=float, default=0.0, help="fraction of truncated completions")
+    args = parser.parse_args()
+
+    if args.kind == "reviews":
+        with open(args.path, "w", newline="", encoding="utf-8") as f:
+            write_reviews_csv(f, args.count, args.seed)
+    else:
+        with open(args.path, "wb") as f:
+            f.writelines(output_lines(args.count, args.shape, args.seed, args.truncated))
+    print(f"Wrote {args.count} {args.kind} to {args.path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
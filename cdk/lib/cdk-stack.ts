@@ -86,6 +86,7 @@ export class GameReviewsAnalysisStack extends Stack {
       billingMode: ddb.BillingMode.PAY_PER_REQUEST,
       removalPolicy: cdk.RemovalPolicy.DESTROY,
       encryption: ddb.TableEncryption.AWS_MANAGED,
+      timeToLiveAttribute: 'expiresAt',
     })
 
     gameReviewTable.addGlobalSecondaryIndex({
@@ -95,6 +96,16 @@ export class GameReviewsAnalysisStack extends Stack {
       projectionType: ddb.ProjectionType.ALL,
     })
 
+    // sparse index over the reviews of a job by overall sentiment and by
+    // topic and sentiment, see common/review_index.py
+    gameReviewTable.addGlobalSecondaryIndex({
+      indexName: 'ReviewFilterIndex',
+      partitionKey: { name: 'GSI1PK', type: ddb.AttributeType.STRING },
+      sortKey: { name: 'GSI1SK', type: ddb.AttributeType.STRING },
+      projectionType: ddb.ProjectionType.INCLUDE,
+      nonKeyAttributes: ['reviewId', 'overall_sentiment', 'classifications', 'original_review'],
+    })
+
     const logBucket = new s3.Bucket(this, 'MainLogBucket', {
       encryption: s3.BucketEncryption.S3_MANAGED,
       blockPublicAccess: s3.BlockPublicAccess.BLOCK_ALL,
@@ -145,10 +156,23 @@ export class GameReviewsAnalysisStack extends Stack {
       description: 'Game CRUD Layer',
     })
 
+    const commonLayer = new lambda.LayerVersion(this, 'CommonLayer', {
+      code: lambda.Code.fromAsset('../functions/lambda_layers/common'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'Modules shared by the analysis Lambda functions',
+    })
+
+    const parquetLayer = new lambda.LayerVersion(this, 'ParquetLayer', {
+      code: lambda.Code.fromAsset('../functions/lambda_layers/parquet/layer.zip'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'pyarrow for reading and writing Parquet',
+    })
+
     const prepareForInferenceLambda = new lambda.Function(this, 'PrepareForInferenceLambda', {
       runtime: lambda.Runtime.PYTHON_3_12,
       code: lambda.Code.fromAsset('../functions/prepareforinference'),
       handler: 'index.lambda_handler',
+      layers: [commonLayer, parquetLayer],
       timeout: Duration.seconds(300),
       tracing: lambda.Tracing.ACTIVE,
       environment: {
@@ -167,6 +191,8 @@ export class GameReviewsAnalysisStack extends Stack {
           actions: [
             's3:GetObject',
             's3:PutObject',
+            's3:DeleteObject',
+            's3:AbortMultipartUpload',
             's3:ListBucket'
           ],
           resources: [
@@ -179,9 +205,11 @@ export class GameReviewsAnalysisStack extends Stack {
           actions: [
             'ssm:GetParameter',
             'ssm:GetParameters',
+            'ssm:GetParametersByPath',
             'ssm:PutParameter'
           ],
           resources: [
+            `arn:aws:ssm:${this.region}:${this.account}:parameter/${this.stackName}/default`,
             `arn:aws:ssm:${this.region}:${this.account}:parameter/${this.stackName}/default/*`
           ]
         }),
@@ -250,7 +278,7 @@ export class GameReviewsAnalysisStack extends Stack {
       runtime: lambda.Runtime.PYTHON_3_12,
       code: lambda.Code.fromAsset('../functions/bedrockbatchinference'),
       handler: 'index.lambda_handler',
-      layers: [bedrockBatchInferenceLambdaLayer],
+      layers: [bedrockBatchInferenceLambdaLayer, commonLayer],
       tracing: lambda.Tracing.ACTIVE,
       environment: {
         stackName: this.stackName,
@@ -283,9 +311,11 @@ export class GameReviewsAnalysisStack extends Stack {
           actions: [
             'ssm:GetParameter',
             'ssm:GetParameters',
+            'ssm:GetParametersByPath',
             'ssm:PutParameter'
           ],
           resources: [
+            `arn:aws:ssm:${this.region}:${this.account}:parameter/${this.stackName}/default`,
             `arn:aws:ssm:${this.region}:${this.account}:parameter/${this.stackName}/default/*`
           ]
         }),
@@ -337,6 +367,7 @@ export class GameReviewsAnalysisStack extends Stack {
       runtime: lambda.Runtime.PYTHON_3_12,
       code: lambda.Code.fromAsset('../functions/parseandstoreresults'),
       handler: 'index.lambda_handler',
+      layers: [commonLayer],
       role: prepareForInferenceRole,
       timeout: Duration.seconds(120),
       tracing: lambda.Tracing.ACTIVE,
@@ -346,6 +377,36 @@ export class GameReviewsAnalysisStack extends Stack {
       }
     })
 
+    const cleanAndSaveParquet = new lambda.Function(this, 'CleanAndSaveParquetLambda', {
+      runtime: lambda.Runtime.PYTHON_3_12,
+      code: lambda.Code.fromAsset('../functions/cleanandsaveparquet'),
+      handler: 'index.lambda_handler',
+      layers: [commonLayer, parquetLayer],
+      role: prepareForInferenceRole,
+      timeout: Duration.seconds(300),
+      memorySize: 1024,
+      tracing: lambda.Tracing.ACTIVE,
+      environment: {
+        stackName: this.stackName,
+        ddbTableName: gameReviewTable.tableName,
+        gameDataBucketName: privateS3Bucket.bucketName
+      }
+    })
+
+    // one-off migration of review items to the slim layout, invoked by hand
+    const migrateReviewItems = new lambda.Function(this, 'MigrateReviewItemsLambda', {
+      runtime: lambda.Runtime.PYTHON_3_12,
+      code: lambda.Code.fromAsset('../functions/migratereviewitems'),
+      handler: 'index.lambda_handler',
+      layers: [commonLayer],
+      role: prepareForInferenceRole,
+      timeout: Duration.minutes(15),
+      tracing: lambda.Tracing.ACTIVE,
+      environment: {
+        ddbTableName: gameReviewTable.tableName
+      }
+    })
+
     const summarizeReviews = new lambda.Function(this, 'SummarizeReviewsLambda', {
       runtime: lambda.Runtime.PYTHON_3_12,
       code: lambda.Code.fromAsset('../functions/summarisereviews'),
@@ -360,7 +421,7 @@ export class GameReviewsAnalysisStack extends Stack {
       payload: sfn.TaskInput.fromJsonPathAt('$'),
       resultPath: '$.taskresult',
       resultSelector: {
-        "s3_input_data_uri.$": "$.Payload.body.s3_input_data_uri",
+        "shards.$": "$.Payload.body.shards",
         "s3_output_data_uri.$": "$.Payload.body.s3_output_data_uri"
       }
 
@@ -371,7 +432,8 @@ export class GameReviewsAnalysisStack extends Stack {
       payload: sfn.TaskInput.fromJsonPathAt('$'),
       resultPath: '$.taskresult',
       resultSelector: {
-        "jobARN.$": "$.Payload.body.jobARN"
+        "jobARN.$": "$.Payload.body.jobARN",
+        "jobARNs.$": "$.Payload.body.jobARNs"
       }
 
     })
@@ -385,7 +447,8 @@ export class GameReviewsAnalysisStack extends Stack {
       resultPath: '$.taskresult',
       resultSelector: {
         "status.$": "$.Payload.status",
-        "jobARN.$": "$.Payload.jobARN"
+        "jobARN.$": "$.Payload.jobARN",
+        "jobARNs.$": "$.Payload.jobARNs"
       }
     })
 
@@ -407,10 +470,33 @@ export class GameReviewsAnalysisStack extends Stack {
       message: sfn.TaskInput.fromJsonPathAt('$')
     })
 
+    // ingests one time-bounded slice of the results per invocation, resuming
+    // from the checkpoint the previous slice saved, so a retry resumes too
     const storeResultsToDB = new tasks.LambdaInvoke(this, 'StoreResultsToDB', {
       lambdaFunction: parseAndStoreResults,
       payload: sfn.TaskInput.fromJsonPathAt('$'),
+      resultPath: '$.taskresult',
+      resultSelector: {
+        "done.$": "$.Payload.done"
+      }
+    }).addRetry({
+      errors: ['States.TaskFailed'],
+      maxAttempts: 2,
+      interval: Duration.seconds(10),
+      backoffRate: 2
+    })
+
+    const jobSucceeded = new sfn.Succeed(this, 'Job Succeeded')
+
+    // the Parquet output only feeds the analytics endpoint; the reviews are
+    // stored by now, so a failure here is recorded and the job still succeeds
+    const saveParquet = new tasks.LambdaInvoke(this, 'SaveParquet', {
+      lambdaFunction: cleanAndSaveParquet,
+      payload: sfn.TaskInput.fromJsonPathAt('$'),
       resultPath: '$.taskresult'
+    }).addCatch(jobSucceeded, {
+      errors: ['States.ALL'],
+      resultPath: '$.parquetError'
     })
 
     const stateMachine = new sfn.StateMachine(this, 'BedrockBatchInferenceStateMachine', {
@@ -420,7 +506,7 @@ export class GameReviewsAnalysisStack extends Stack {
           prepareforinferenceTask
             .next(BedrockBatchInferenceTask.addRetry(
               {
-                errors: ['ServiceQuotaExceededException'],
+                errors: ['ServiceQuotaExceededException', 'ThrottlingException'],
                 maxAttempts: 3,
                 interval: Duration.minutes(6),
                 backoffRate: 2
@@ -429,10 +515,15 @@ export class GameReviewsAnalysisStack extends Stack {
             .next(waitTask)
             .next(checkJobStatusTask)
             .next(new sfn.Choice(this, 'Job Complete?')
-              .when(sfn.Condition.stringEquals(
-                '$.taskresult.status', 'Completed'
+              // a partially completed job has results for most of its records
+              .when(sfn.Condition.or(
+                sfn.Condition.stringEquals('$.taskresult.status', 'Completed'),
+                sfn.Condition.stringEquals('$.taskresult.status', 'PartiallyCompleted')
               ), storeResultsToDB
-                .next(new sfn.Succeed(this, 'Job Succeeded')))
+                .next(new sfn.Choice(this, 'Results Stored?')
+                  .when(sfn.Condition.booleanEquals('$.taskresult.done', false), storeResultsToDB)
+                  .otherwise(saveParquet
+                    .next(jobSucceeded))))
               .when(sfn.Condition.stringEquals(
                 '$.taskresult.status', 'Failed'
               ), sendFailureMessage.next(new sfn.Fail(this, 'Job Failed')))
@@ -455,10 +546,11 @@ export class GameReviewsAnalysisStack extends Stack {
         'dynamodb:PutItem',
         'dynamodb:UpdateItem',
         'dynamodb:DeleteItem',
+        'dynamodb:BatchWriteItem',
         'dynamodb:Query',
         'dynamodb:Scan'
       ],
-      resources: [gameReviewTable.tableArn]
+      resources: [gameReviewTable.tableArn, `${gameReviewTable.tableArn}/index/*`]
     }));
 
     gamescrudRole.addToPolicy(new iam.PolicyStatement({
@@ -496,19 +588,89 @@ export class GameReviewsAnalysisStack extends Stack {
       iam.ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole')
     );
 
+    // deletes large games and jobs in the background, see common/deletion.py
+    const deleteGameDataRole = new iam.Role(this, 'DeleteGameDataRole', {
+      assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
+    });
+
+    deleteGameDataRole.addToPolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: [
+        'dynamodb:GetItem',
+        'dynamodb:UpdateItem',
+        'dynamodb:DeleteItem',
+        'dynamodb:BatchWriteItem',
+        'dynamodb:Query'
+      ],
+      resources: [gameReviewTable.tableArn]
+    }));
+
+    deleteGameDataRole.addToPolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: [
+        's3:ListBucket',
+        's3:DeleteObject'
+      ],
+      resources: [
+        privateS3Bucket.bucketArn,
+        `${privateS3Bucket.bucketArn}/*`
+      ]
+    }));
+
+    deleteGameDataRole.addManagedPolicy(
+      iam.ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole')
+    );
+
+    const deleteGameData = new lambda.Function(this, 'DeleteGameDataLambda', {
+      runtime: lambda.Runtime.PYTHON_3_12,
+      code: lambda.Code.fromAsset('../functions/deletegamedata'),
+      handler: 'index.lambda_handler',
+      layers: [commonLayer],
+      role: deleteGameDataRole,
+      timeout: Duration.minutes(15),
+      tracing: lambda.Tracing.ACTIVE,
+      environment: {
+        ddbTableName: gameReviewTable.tableName,
+        gameDataBucketName: privateS3Bucket.bucketName
+      }
+    })
+
+    // a run that nears its timeout invokes itself again; attached as its own
+    // policy so that the function does not depend on it
+    deleteGameDataRole.attachInlinePolicy(new iam.Policy(this, 'DeleteGameDataInvokePolicy', {
+      statements: [
+        new iam.PolicyStatement({
+          effect: iam.Effect.ALLOW,
+          actions: ['lambda:InvokeFunction'],
+          resources: [deleteGameData.functionArn]
+        })
+      ]
+    }));
+
+    gamescrudRole.addToPolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: [
+        'lambda:InvokeFunction'
+      ],
+      resources: [deleteGameData.functionArn]
+    }));
+
     const gamescrud = new lambda.Function(this, 'GamesCrud', {
       runtime: lambda.Runtime.PYTHON_3_12,
       code: lambda.Code.fromAsset('../functions/gamescrud'),
       handler: 'index.lambda_handler',
       timeout: Duration.seconds(300),
+      // analytics queries load Parquet columns into memory
+      memorySize: 1024,
       tracing: lambda.Tracing.ACTIVE,
       environment: {
         ddbTableName: gameReviewTable.tableName,
         gameDataBucketName: privateS3Bucket.bucketName,
         stateMachineArn: stateMachine.stateMachineArn,
+        deleteWorkerFunctionName: deleteGameData.functionName,
         APP_ENV: appEnv
       },
-      layers: [gamesCrudLayer],
+      layers: [gamesCrudLayer, commonLayer, parquetLayer],
       role: gamescrudRole
     })
 
@@ -711,6 +873,16 @@ export class GameReviewsAnalysisStack extends Stack {
     const reviewsResource = jobResource.addResource('reviews');
     reviewsResource.addMethod('GET', gameCrudIntegration, { authorizer: auth, });
 
+    const statsResource = jobResource.addResource('stats');
+    statsResource.addMethod('GET', gameCrudIntegration, { authorizer: auth, });
+
+    const analyticsResource = jobResource.addResource('analytics');
+    analyticsResource.addMethod('GET', gameCrudIntegration, { authorizer: auth, });
+
+    const deletionsResource = gamesAPI.root.addResource('deletions');
+    const deletionResource = deletionsResource.addResource('{deletion_id}');
+    deletionResource.addMethod('GET', gameCrudIntegration, { authorizer: auth, });
+
     const analysisResource = gameResource.addResource('analysis');
     analysisResource.addMethod('DELETE', gameCrudIntegration, {
       authorizer: auth,
@@ -728,7 +900,7 @@ export class GameReviewsAnalysisStack extends Stack {
       code: lambda.Code.fromAsset('../functions/converse'),
       handler: 'index.lambda_handler',
       timeout: Duration.seconds(120),
-      layers: [converseLayer],
+      layers: [converseLayer, commonLayer],
       tracing: lambda.Tracing.ACTIVE,
     })
 
@@ -746,7 +918,7 @@ export class GameReviewsAnalysisStack extends Stack {
     converseLambda.addToRolePolicy(
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
-        actions: ['ssm:GetParameter'],
+        actions: ['ssm:GetParameter', 'ssm:GetParametersByPath'],
         resources: ['*']
       })
     )
@@ -795,6 +967,10 @@ export class GameReviewsAnalysisStack extends Stack {
       value: gamesAPI.url
     })
 
+    new CfnOutput(this, 'migrateReviewItemsFunctionName', {
+      value: migrateReviewItems.functionName
+    })
+
 
 
   }
@@ -1,7 +1,9 @@
 import os
 import boto3
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from common.config import get_config
 
 # Set up logging
 logger = logging.getLogger()
@@ -9,16 +11,83 @@ logger.setLevel(logging.INFO)
 
 # Initialize clients outside the handler
 bedrock = boto3.client(service_name="bedrock")
-ssm = boto3.client("ssm")
 dynamodb = boto3.resource("dynamodb")
 
 # Get environment variables
-stack_name = os.getenv("stackName")
 ddb_table_name = os.environ.get("ddbTableName")
 bedrock_role_arn = os.getenv("BEDROCK_ROLE_ARN")
 
 table = dynamodb.Table(ddb_table_name)
 
+# Upper bound on concurrent create_model_invocation_job calls
+MAX_SUBMIT_WORKERS = 8
+
+
+class ServiceQuotaExceededException(Exception):
+    """Raised by name so that the state machine's retry matches it."""
+
+
+class ThrottlingException(Exception):
+    """Raised by name so that the state machine's retry matches it."""
+
+
+# Bedrock errors the state machine retries, by error code
+RETRIED_ERRORS = {error.__name__: error for error in (ServiceQuotaExceededException, ThrottlingException)}
+
+
+def submit_shard(model_id, job_name, s3_input_uri, s3_output_uri):
+    input_data_config = {"s3InputDataConfig": {"s3Uri": s3_input_uri, "s3InputFormat": "JSONL"}}
+    output_data_config = {"s3OutputDataConfig": {"s3Uri": s3_output_uri}}
+
+    # Create model invocation job
+    response = bedrock.create_model_invocation_job(
+        roleArn=bedrock_role_arn,
+        modelId=model_id,
+        jobName=job_name,
+        inputDataConfig=input_data_config,
+        outputDataConfig=output_data_config,
+    )
+
+    logger.info(f"Created model invocation job: {response}")
+
+    job_arn = response.get("jobArn")
+    if job_arn is None:
+        raise Exception("Failed to create model invocation job")
+
+    return job_arn, response.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get("date", "Not Found")
+
+
+def submit_shards(model_id, job_name, shards, s3_output_uri):
+    """Submit one invocation job per input shard in parallel. If any submission
+    fails, jobs that were already created are stopped before re-raising."""
+    if not shards:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(MAX_SUBMIT_WORKERS, len(shards))) as executor:
+        futures = [
+            executor.submit(submit_shard, model_id, f"{job_name}-{index:03d}", shard["s3_input_data_uri"], s3_output_uri)
+            for index, shard in enumerate(shards)
+        ]
+
+    submitted, errors = [], []
+    for shard, future in zip(shards, futures):
+        try:
+            job_arn, date = future.result()
+            submitted.append({"jobARN": job_arn, "s3InputURI": shard["s3_input_data_uri"], "invokedAt": date})
+        except Exception as e:
+            errors.append(e)
+
+    if errors:
+        for child in submitted:
+            try:
+                bedrock.stop_model_invocation_job(jobIdentifier=child["jobARN"])
+            except ClientError as ce:
+                logger.error(f"Failed to stop model invocation job {child['jobARN']}: {str(ce)}")
+        raise errors[0]
+
+    return submitted
+
+
 def lambda_handler(event, context):
     try:
         # Input validation
@@ -27,49 +96,46 @@ def lambda_handler(event, context):
             if field not in event:
                 raise ValueError(f"Missing required field: {field}")
 
-        s3_input_uri = event["taskresult"]["s3_input_data_uri"]
+        shards = event["taskresult"]["shards"]
         s3_output_uri = event["taskresult"]["s3_output_data_uri"]
         job_name = event["job_name"]
         job_id = event["job_id"]
         game_id = event["game_id"]
 
         # Get model ID from SSM Parameter Store
-        model_id = ssm.get_parameter(Name=f"/{stack_name}/default/MODEL_ID")["Parameter"]["Value"]
-
-        input_data_config = {"s3InputDataConfig": {"s3Uri": s3_input_uri, "s3InputFormat": "JSONL"}}
-        output_data_config = {"s3OutputDataConfig": {"s3Uri": s3_output_uri}}
-
-        # Create model invocation job
-        response = bedrock.create_model_invocation_job(
-            roleArn=bedrock_role_arn,
-            modelId=model_id,
-            jobName=job_name,
-            inputDataConfig=input_data_config,
-            outputDataConfig=output_data_config,
-        )
-
-        logger.info(f"Created model invocation job: {response}")
-
-        job_arn = response.get("jobArn")
-        if job_arn is None:
-            raise Exception("Failed to create model invocation job")
+        model_id = get_config()["MODEL_ID"]
 
-        date = response.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get("date", "Not Found")
+        child_jobs = submit_shards(model_id, job_name, shards, s3_output_uri)
+        job_arns = [child["jobARN"] for child in child_jobs]
+        job_arn = job_arns[0] if job_arns else ""
+        date = child_jobs[0]["invokedAt"] if child_jobs else "Not Found"
 
         # Update DynamoDB table
         table.update_item(
             Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"},
-            UpdateExpression="SET jobARN = :jobARN, jobStatus = :jobStatus, s3OutputURI = :s3OutputURI, invokedAt = :invokedAt",
-            ExpressionAttributeValues={":jobARN": job_arn, ":jobStatus": "Submitted", ":s3OutputURI": s3_output_uri, ":invokedAt": date},
+            UpdateExpression="SET jobARN = :jobARN, jobARNs = :jobARNs, childJobs = :childJobs, modelId = :modelId, jobStatus = :jobStatus, s3OutputURI = :s3OutputURI, invokedAt = :invokedAt",
+            ExpressionAttributeValues={
+                ":jobARN": job_arn,
+                ":jobARNs": job_arns,
+                ":childJobs": child_jobs,
+                ":modelId": model_id,
+                ":jobStatus": "Submitted",
+                ":s3OutputURI": s3_output_uri,
+                ":invokedAt": date,
+            },
         )
 
-        return {"statusCode": 200, "body": {"jobARN": job_arn}}
+        return {"statusCode": 200, "body": {"jobARN": job_arn, "jobARNs": job_arns}}
 
     except ValueError as ve:
         logger.error(f"Input validation error: {str(ve)}")
         return {"statusCode": 400, "body": str(ve)}
     except ClientError as ce:
         logger.error(f"AWS service error: {str(ce)}")
+        # the Lambda error type is the exception's class name
+        retried = RETRIED_ERRORS.get(ce.response["Error"]["Code"])
+        if retried is not None:
+            raise retried(str(ce)) from ce
         return {"statusCode": 500, "body": f"AWS service error: {str(ce)}"}
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
@@ -5,35 +5,71 @@ import logging
 bedrock = boto3.client(service_name="bedrock")
 logger = logging.getLogger()
 
+# Child job statuses that will not change any more
+TERMINAL_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+
+
+def aggregate_status(statuses):
+    """Collapse the statuses of all child invocation jobs into the status of
+    the logical analysis job. A job with a partially completed child is
+    PartiallyCompleted: its results are stored, but some records have
+    none."""
+    pending = [status for status in statuses if status not in TERMINAL_STATUSES]
+    if pending:
+        return "InProgress" if "InProgress" in pending else pending[0]
+    if any(status in ("Failed", "Expired") for status in statuses):
+        return "Failed"
+    if "Stopped" in statuses:
+        return "Stopped"
+    if "PartiallyCompleted" in statuses:
+        return "PartiallyCompleted"
+    return "Completed"
+
+
 def lambda_handler(event, context):
     
     game_id = event['game_id']
     job_id = event['job_id']
     job_identifier = event['taskresult']['jobARN']
-    
-    job = bedrock.get_model_invocation_job(jobIdentifier=job_identifier)
-    jobStatus = job['status']
-    lastModifiedTime = job['lastModifiedTime']
-    lastModifiedTime_int = int(lastModifiedTime.timestamp())
-    submitTime = job['submitTime']
-    submitTime_int = int(submitTime.timestamp())
-    jobMessage = job.get("message", "")
+    job_identifiers = event['taskresult'].get('jobARNs', [job_identifier])
+
+    child_statuses = {}
+    messages = []
+    lastModifiedTime_int = 0
+    submitTime_int = None
+    for arn in job_identifiers:
+        job = bedrock.get_model_invocation_job(jobIdentifier=arn)
+        child_statuses[arn] = job['status']
+        lastModifiedTime_int = max(lastModifiedTime_int, int(job['lastModifiedTime'].timestamp()))
+        submitTime = int(job['submitTime'].timestamp())
+        submitTime_int = submitTime if submitTime_int is None else min(submitTime_int, submitTime)
+        if job.get("message"):
+            messages.append(job["message"])
+
+    jobStatus = aggregate_status(list(child_statuses.values()))
+    # child jobs some of whose records failed
+    partial_job_arns = [arn for arn, status in child_statuses.items() if status == "PartiallyCompleted"]
+    jobMessage = "\n".join(messages)
+    logger.info(f"Job {job_id} status {jobStatus}: {child_statuses}")
 
     #update dynamodb table with new status
     dynamodb = boto3.resource('dynamodb')
     table = dynamodb.Table(os.environ.get('ddbTableName'))
     table.update_item(
         Key={'PK': f"GAME#{game_id}", "SK": f"JOB#{job_id}"},
-        UpdateExpression="SET jobStatus = :val, jobMessage = :jobMessage, lastModifiedTime = :lastModifiedTime, submitTime = :submitTime",
+        UpdateExpression="SET jobStatus = :val, childJobStatuses = :childJobStatuses, partialJobARNs = :partialJobARNs, jobMessage = :jobMessage, lastModifiedTime = :lastModifiedTime, submitTime = :submitTime",
         ExpressionAttributeValues={
             ':val': jobStatus,
+            ':childJobStatuses': child_statuses,
+            ':partialJobARNs': partial_job_arns,
             ':jobMessage': jobMessage,
-            ':submitTime': submitTime_int,
+            ':submitTime': submitTime_int or 0,
             ':lastModifiedTime': lastModifiedTime_int
         }
     )
     return {
         'statusCode': 200,
-        'status': job['status'],
-        'jobARN': job_identifier
+        'status': jobStatus,
+        'jobARN': job_identifier,
+        'jobARNs': job_identifiers
     }
@@ -1,101 +1,307 @@
 import boto3
 import json
-import io
-import pandas as pd
-import re
+import logging
+import os
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.parquet as pq
+from urllib.parse import quote
+from common.config import get_config
+from common.model_output import ModelOutputParser, review_start
+from common.multipart_upload import MIN_PART_SIZE, MultipartUploadWriter
+from common.review_duplicates import Duplicates
+from common.review_results import ReviewResults
 
 s3 = boto3.client("s3")
+ddb = boto3.resource("dynamodb")
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Rows buffered as Python lists, across all partitions, before they are
+# written out as row groups
+ROW_GROUP_SIZE = 20000
+
+# Size of each chunk read from a result object
+READ_CHUNK_SIZE = 1024 * 1024
+
+COMPRESSION = "zstd"
+
+PARTITIONING_MODES = ("none", "topic_sentiment")
+# Partition files open at once, each holding an upload part in memory; the
+# least recently written is closed to open another, and a partition written
+# to again gets a further part file
+MAX_OPEN_PARTITIONS = 32
+PARTITION_COLUMNS = ("topic", "sentiment")
+# partition directory of rows without a topic, as Hive and pyarrow name it
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+
+LABEL = pa.dictionary(pa.int32(), pa.string())
+
+# One row per classification of a review, or a single row without topic and
+# sentiment when the review has none. The prompt is the same for every
+# review, so it is stored once in the file metadata instead of per row.
+SCHEMA = pa.schema([
+    ("recordId", pa.string()),
+    ("overall_sentiment", LABEL),
+    ("gamereview", pa.string()),
+    ("topic", LABEL),
+    ("sentiment", LABEL),
+])
+
+# Partitioned files keep topic and sentiment in their path only
+PARTITION_SCHEMA = pa.schema([field for field in SCHEMA if field.name not in PARTITION_COLUMNS])
+
+
+def prompt_template(prompt):
+    """The prompt without the review appended to it."""
+    start = review_start(prompt)
+    return prompt if start == -1 else prompt[:start]
+
+
+def partition_path(topic, sentiment):
+    def segment(name, value):
+        return f"{name}={HIVE_NULL if value is None else quote(str(value), safe='')}"
+    return f"{segment('topic', topic)}/{segment('sentiment', sentiment)}"
+
+
+class _RowGroupWriter:
+    """Buffers the rows of one Parquet file as Python lists and writes them
+    as an Arrow row group on flush."""
+
+    def __init__(self, sink, schema):
+        self.sink = sink
+        self.schema = schema
+        self.rows = 0
+        self.buffered = 0
+        self._writer = None
+        self._columns = [[] for _ in schema]
+
+    def append(self, row):
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        self.buffered += 1
+
+    def flush(self, metadata):
+        if not self.buffered:
+            return
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.sink, self.schema.with_metadata(metadata), compression=COMPRESSION)
+        batch = pa.record_batch(
+            [pa.array(column, type=field.type) for column, field in zip(self._columns, self.schema)],
+            schema=self._writer.schema,
+        )
+        self._writer.write_batch(batch)
+        self.rows += self.buffered
+        self.buffered = 0
+        self._columns = [[] for _ in self.schema]
+
+    def close(self, metadata):
+        self.flush(metadata)
+        if self._writer is None:
+            # an empty file still carries the schema
+            self._writer = pq.ParquetWriter(self.sink, self.schema.with_metadata(metadata), compression=COMPRESSION)
+        self._writer.close()
+
+
+class ParquetReviewWriter:
+    """Streams classified reviews to Parquet as Arrow row groups, either to
+    a single file or to files per topic and sentiment in Hive-style
+    `topic=.../sentiment=...` directories.
+
+    `open_sink(path)` returns the file object for a path relative to the
+    output location; sinks are closed when the writer is, or aborted when
+    it exits with an error. At most `row_group_size` rows are buffered and
+    at most `max_open_partitions` partition files are open at once."""
+
+    def __init__(self, open_sink, partitioning="none", row_group_size=ROW_GROUP_SIZE, max_open_partitions=MAX_OPEN_PARTITIONS):
+        if partitioning not in PARTITIONING_MODES:
+            raise ValueError(f"Invalid Parquet partitioning: {partitioning}")
+        self.open_sink = open_sink
+        self.partitioning = partitioning
+        self.row_group_size = row_group_size
+        self.max_open_partitions = max_open_partitions
+        self.metadata = {}
+        self.paths = []
+        self._closed_rows = 0
+        self._sinks = {}
+        self._files = OrderedDict()
+        self._part_files = Counter()
+        self._buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def rows(self):
+        return self._closed_rows + sum(file.rows + file.buffered for file in self._files.values())
+
+    def _file(self, directory, schema):
+        file = self._files.get(directory)
+        if file is not None:
+            self._files.move_to_end(directory)
+            return file
+        if len(self._files) >= self.max_open_partitions:
+            self._close_file(next(iter(self._files)))
+        path = f"{directory}/part-{self._part_files[directory]:05d}.parquet" if directory else "output.parquet"
+        self._part_files[directory] += 1
+        self.paths.append(path)
+        self._sinks[directory] = self.open_sink(path)
+        file = self._files[directory] = _RowGroupWriter(self._sinks[directory], schema)
+        return file
+
+    def _close_file(self, directory):
+        file = self._files.pop(directory)
+        self._buffered -= file.buffered
+        file.close(self.metadata)
+        self._closed_rows += file.rows
+        self._sinks.pop(directory).close()
+
+    def write(self, record_id, overall_sentiment, prompt, review, classifications):
+        if prompt is not None and "prompt" not in self.metadata:
+            self.metadata["prompt"] = prompt_template(prompt)
+        classifications = [c for c in classifications if isinstance(c, dict)] or [{}]
+        for classification in classifications:
+            topic, sentiment = classification.get("topic"), classification.get("sentiment")
+            if self.partitioning == "none":
+                file = self._file("", SCHEMA)
+                file.append((record_id, overall_sentiment, review, topic, sentiment))
+            else:
+                file = self._file(partition_path(topic, sentiment), PARTITION_SCHEMA)
+                file.append((record_id, overall_sentiment, review))
+            self._buffered += 1
+        if self._buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        for file in self._files.values():
+            file.flush(self.metadata)
+        self._buffered = 0
+
+    def close(self):
+        if not self.paths and self.partitioning == "none":
+            self._file("", SCHEMA)
+        for directory in list(self._files):
+            self._close_file(directory)
+
+    def abort(self):
+        for sink in self._sinks.values():
+            sink.abort()
+
+
+def iter_output_keys(bucket, output_prefix, job_arns):
+    paginator = s3.get_paginator("list_objects_v2")
+    for job_arn in job_arns:
+        prefix = f"{output_prefix}{job_arn.split('/')[-1]}"
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(".jsonl.out"):
+                    yield obj["Key"]
+
+
+def iter_object_lines(bucket, key):
+    response = s3.get_object(Bucket=bucket, Key=key)
+    for line in response["Body"].iter_lines(chunk_size=READ_CHUNK_SIZE):
+        if line:
+            yield line
+
+
+def write_parquet(lines, parser, open_sink, partitioning="none", row_group_size=ROW_GROUP_SIZE, cached_lines=(), duplicates=None):
+    """Parse model output lines, and the lines of the job's cached results,
+    and write the reviews they stand for as Parquet through `open_sink`:
+    split reviews merged and duplicates given their review's result, as
+    parseandstoreresults stores them. Records without a usable result are
+    left out there and here. Returns the writer, which reports the rows and
+    the paths written."""
+    with ParquetReviewWriter(open_sink, partitioning, row_group_size) as writer:
+        def store(record_id, prompt, overall_sentiment, classifications, review):
+            writer.write(record_id, overall_sentiment, prompt, review if review is not None else "not found", classifications)
+
+        results = ReviewResults(store, duplicates)
+        for line in lines:
+            record = parser.parse_line(line)
+            if record is None or record.result is None:
+                continue
+            results.add(
+                record.record_id,
+                record.prompt,
+                record.result["overall_sentiment"],
+                record.result.get("classifications", []),
+                record.review,
+            )
+        for line in cached_lines:
+            cached = json.loads(line)
+            shape = parser.shape(cached["modelInput"])
+            results.add(
+                cached["recordId"],
+                shape.prompt(cached["modelInput"]) if shape is not None else None,
+                cached["overall_sentiment"],
+                cached["classifications"],
+                parser.review(cached["modelInput"]),
+            )
+        for base_id, stored in results.flush():
+            logger.warning(f"Review {base_id} is missing chunks, wrote {stored} of them")
+    return writer
+
 
 def lambda_handler(event, context):
 
-    jobArn = event['taskresult']['jobARN']
-    jobId = jobArn.split("/")[-1]
-    gameID = event['game_id']
-    bucket = event['bucket']
-    keypath = f"{gameID}/output/{jobId}"
-
-    print("bucket", bucket)
-    print("keypath", keypath)
-    
-    
-    s3_object = s3.get_object(
-        Bucket=bucket,
-        Key=f"{keypath}/data.jsonl.out"
+    bucket = os.getenv("gameDataBucketName")
+    table = ddb.Table(os.getenv("ddbTableName"))
+    game_id = event["game_id"]
+    job_id = event["job_id"]
+    partitioning = get_config()["PARQUET_PARTITIONING"]
+
+    job = table.get_item(Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"})["Item"]
+    output_prefix = "/".join(job["s3OutputURI"].split("/")[3:])
+    # sharded jobs are made of several child invocation jobs
+    job_arns = job.get("jobARNs", [job["jobARN"]])
+
+    if partitioning == "none":
+        key_prefix = f"{game_id}/jobs/{job_id}"
+        output_key = f"{key_prefix}/output.parquet"
+    else:
+        key_prefix = output_key = f"{game_id}/jobs/{job_id}/parquet"
+
+    def open_sink(path):
+        # each partition holds an upload part in memory, so parts are kept small
+        return MultipartUploadWriter(s3, bucket, f"{key_prefix}/{path}", part_size=MIN_PART_SIZE)
+
+    parser = ModelOutputParser()
+    lines = (
+        line
+        for key in iter_output_keys(bucket, output_prefix, job_arns)
+        for line in iter_object_lines(bucket, key)
     )
+    # reviews answered from the inference cache and duplicates collapsed
+    # before inference are not in the model output
+    cached_lines = iter_object_lines(bucket, job["cachedResultsKey"]) if job.get("cachedResultsKey") else ()
+    duplicates = Duplicates(s3, bucket, job["duplicatesKey"]) if job.get("duplicatesKey") else {}
+    writer = write_parquet(lines, parser, open_sink, partitioning, cached_lines=cached_lines, duplicates=duplicates)
 
-    json_data = s3_object["Body"].read().decode("utf-8").splitlines()
-    
-    records = []
-    pattern = r"<result>(.*?)</result>"
-    regex = r"Game Review:(.*?)Assistant"
-    
-    for item in json_data:
-        json_item = json.loads(item)
-        prompt = json_item["modelInput"]["prompt"]
-        result = json_item["modelOutput"]["completion"]
-        match = re.search(pattern, result)
-        gamereviewmatch = re.search(regex,prompt, re.DOTALL)
-        gamereview = ""
-        if(gamereviewmatch):
-            gamereview = gamereviewmatch.group(1)
-        else:
-            gamereview = "not found"
-        if match:
-            result_string = match.group(1).replace('\\"', '"')
+    logger.info(f"Model output parse results: {dict(parser.stats)}")
+    logger.info(f"Wrote {writer.rows} rows to {len(writer.paths)} files under s3://{bucket}/{key_prefix}")
 
-            json_data = remove_extra_data(result_string)
-            
-        else:
-            json_data = {"overall_sentiment":"null","classifications":[]}
-            
-        
-        record = {
-            "recordId": json_item["recordId"],
-            "prompt": json_item["modelInput"]["prompt"],
-            "gamereview": gamereview,
-            "overall_sentiment": json_data["overall_sentiment"],
-            "classifications": json_data["classifications"],
-        }
-
-        records.append(record)
-        
-    df = pd.DataFrame(records)
-    exploded = df.explode('classifications').reset_index(drop=True)
-
-    new_df = exploded['classifications'].apply(pd.Series)
-    new_df = pd.concat([exploded['recordId'], exploded['overall_sentiment'], exploded['prompt'], exploded['gamereview'], new_df], axis=1)
-    new_df = new_df.drop(0, axis=1)
-    parquet_buffer = io.BytesIO()
-    
-    new_df.to_parquet(parquet_buffer, engine='pyarrow')
-    try:
-        response = s3.put_object(Body=parquet_buffer.getvalue(), Bucket=bucket, Key=f"{keypath}/output.parquet")
-        print(f'Object saved successfully! Response: {response}')
-    except Exception as e:
-        print(f'Error saving object to S3: {e}')
+    table.update_item(
+        Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"},
+        UpdateExpression="SET parquetOutputKey = :key, parquetPartitioning = :partitioning, parquetWrittenOn = :written",
+        ExpressionAttributeValues={
+            ":key": output_key,
+            ":partitioning": partitioning,
+            ":written": str(datetime.now(timezone.utc)),
+        },
+    )
 
     return {
         'statusCode': 200,
-        'jobARN': jobArn,
-        'gameID': gameID,
+        'gameID': game_id,
         'bucket': bucket,
+        'key': output_key,
     }
-
-
-def remove_extra_data(json_str):
-    try:
-        data = json.loads(json_str)
-        return data
-    except json.JSONDecodeError as e:
-        # Find the position of the error
-        idx = e.pos
-
-        # Remove extra data from the string
-        cleaned_json_str = json_str[:idx]
-
-        # Try parsing the cleaned string
-        try:
-            data = json.loads(cleaned_json_str)
-            return data
-        except json.JSONDecodeError:
-            raise ValueError("Invalid JSON")
\ No newline at end of file
@@ -9,9 +9,9 @@ from fastapi import Depends, FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from mangum import Mangum
 from botocore.exceptions import ClientError
+from common.config import get_config
 
 app = FastAPI()
-ssm = boto3.client("ssm")
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -19,12 +19,12 @@ stackName = os.environ.get("stackName")
 gamescrudendpoint = os.environ.get("GAMECRUD_ENDPOINT")
 logger.info(f"Gamecrudendpoint: {gamescrudendpoint}")
 logger.info(f"Stackname: {stackName}")
-model_id = ssm.get_parameter(Name=f"/{stackName}/default/MODEL_ID_CONVERSE")[
-    "Parameter"
-]["Value"]
 
 allowed_origins = os.environ.get("ALLOWED_ORIGINS", "").split(",")
 
+# reviews fetched into the conversation, the largest page gamescrud returns
+MAX_REVIEWS = 1000
+
 
 def get_lambda_event(request: Request):
     return request.scope.get("aws.event", {})
@@ -61,12 +61,16 @@ def get_reviews(game_id, job_id, sentiment, classification, user_token):
 
     url = f"{gamescrudendpoint}games/{game_id}/analysis-jobs/{job_id}/reviews"
 
-    params = {}
+    # the reviews endpoint filters a topic and sentiment pair through its
+    # index; "All" asks for every review with that overall sentiment
+    params = {"limit": MAX_REVIEWS, "fields": "original_review"}
 
-    if sentiment:
-        params["sentiment"] = sentiment
-    if classification:
-        params["classification"] = classification
+    if classification and classification.lower() != "all":
+        params["topic"] = classification
+        if sentiment:
+            params["sentiment"] = sentiment
+    elif sentiment:
+        params["overall_sentiment"] = sentiment
 
     headers = {"Authorization": f"Bearer {user_token}"}
 
@@ -139,6 +143,7 @@ async def converse(
 
     try:
         bedrock_client = boto3.client(service_name="bedrock-runtime")
+        model_id = get_config(stackName)["MODEL_ID_CONVERSE"]
 
         logger.info("Calling converse")
 
@@ -0,0 +1,55 @@
+import boto3
+import json
+import logging
+import os
+from common.deletion import COMPLETE, FAILED, IN_PROGRESS, Deleter, delete_game, delete_job, update_deletion
+
+ddb = boto3.resource("dynamodb")
+s3 = boto3.client("s3")
+lambda_client = boto3.client("lambda")
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Stop when less than this is left of the invocation and continue in a new one
+MIN_REMAINING_MILLIS = 60000
+
+
+def lambda_handler(event, context):
+    """Delete a game, or one of its jobs when `job_id` is given, in the
+    background. Invoked asynchronously by gamescrud with the id of the
+    deletion whose status it keeps up to date; a run that nears the timeout
+    invokes itself again with the same event."""
+
+    table = ddb.Table(os.getenv("ddbTableName"))
+    deletion_id = event["deletion_id"]
+    game_id = event["game_id"]
+    job_id = event.get("job_id")
+
+    deleter = Deleter(
+        table,
+        s3,
+        os.getenv("gameDataBucketName"),
+        should_stop=lambda: context is not None and context.get_remaining_time_in_millis() < MIN_REMAINING_MILLIS,
+    )
+    try:
+        done = delete_job(deleter, game_id, job_id) if job_id else delete_game(deleter, game_id)
+    except Exception as e:
+        logger.error(f"Deletion {deletion_id} failed", exc_info=True)
+        update_deletion(table, deletion_id, FAILED, deleter.deleted, error=str(e))
+        raise
+
+    logger.info(f"Deletion {deletion_id}: deleted {deleter.deleted}, done: {done}")
+    update_deletion(table, deletion_id, COMPLETE if done else IN_PROGRESS, deleter.deleted)
+    if not done:
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps(event).encode("utf-8"),
+        )
+
+    return {
+        "statusCode": 200,
+        "deletionId": deletion_id,
+        "deleted": deleter.deleted,
+        "done": done,
+    }
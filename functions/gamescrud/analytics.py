@@ -0,0 +1,125 @@
+import os
+from collections import OrderedDict
+from itertools import combinations
+
+# Results kept per warm container, keyed by job output and query
+MAX_CACHED_RESULTS = 128
+
+DEFAULT_LIMIT = 20
+
+
+def _decoded(table):
+    """Cast dictionary columns to their values; row groups carry their own
+    dictionaries, which grouping kernels will not unify."""
+    import pyarrow as pa
+
+    return pa.table(
+        [column.cast(column.type.value_type) if pa.types.is_dictionary(column.type) else column for column in table.columns],
+        names=table.column_names,
+    )
+
+
+def _rename(rows, names):
+    return [{names.get(name, name): value for name, value in row.items()} for row in rows]
+
+
+def topic_sentiment(table, limit):
+    """Classification counts per topic and sentiment."""
+    counts = table.group_by(["topic", "sentiment"]).aggregate([("recordId", "count")])
+    counts = counts.sort_by([("recordId_count", "descending")]).slice(0, limit)
+    return _rename(counts.to_pylist(), {"recordId_count": "count"})
+
+
+def topic_cooccurrence(table, limit):
+    """Pairs of topics most often classified together in one review."""
+    topics = table.group_by("recordId").aggregate([("topic", "list")])
+    pairs = {}
+    for review_topics in topics.column("topic_list").to_pylist():
+        for pair in combinations(sorted({topic for topic in review_topics if topic is not None}), 2):
+            pairs[pair] = pairs.get(pair, 0) + 1
+    top = sorted(pairs.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{"topics": list(pair), "count": count} for pair, count in top]
+
+
+def review_length(table, limit):
+    """Review length in characters per overall sentiment."""
+    import pyarrow.compute as pc
+
+    # rows are per classification, so every review is measured once
+    table = table.append_column("length", pc.utf8_length(table["gamereview"]))
+    reviews = table.group_by(["recordId", "overall_sentiment"]).aggregate([("length", "max")])
+    lengths = reviews.group_by("overall_sentiment").aggregate([
+        ("length_max", "count"),
+        ("length_max", "mean"),
+        ("length_max", "approximate_median"),
+        ("length_max", "max"),
+    ])
+    return _rename(lengths.to_pylist(), {
+        "length_max_count": "reviews",
+        "length_max_mean": "mean_length",
+        "length_max_approximate_median": "median_length",
+        "length_max_max": "max_length",
+    })
+
+
+# Columns read by each query; every other column is pruned
+QUERIES = {
+    "topic_sentiment": (("recordId", "topic", "sentiment"), topic_sentiment),
+    "topic_cooccurrence": (("recordId", "topic"), topic_cooccurrence),
+    "review_length": (("recordId", "overall_sentiment", "gamereview"), review_length),
+}
+
+FILTER_COLUMNS = ("overall_sentiment", "topic", "sentiment")
+
+
+class ParquetAnalytics:
+    """Aggregations over the Parquet output of an analysis job, read with
+    pyarrow datasets so that only the query's columns are fetched and
+    filters are pushed down to row group statistics and, for Hive
+    partitioned output, to partition directories. Results are cached per
+    job output in a bounded LRU."""
+
+    def __init__(self, bucket, max_cached=MAX_CACHED_RESULTS):
+        self.bucket = bucket
+        self.max_cached = max_cached
+        self._filesystem = None
+        self._cache = OrderedDict()
+
+    def _dataset(self, key, partitioning):
+        import pyarrow.dataset as ds
+        from pyarrow import fs
+
+        if self._filesystem is None:
+            self._filesystem = fs.S3FileSystem(region=os.environ.get("AWS_REGION"))
+        return ds.dataset(
+            f"{self.bucket}/{key}",
+            format="parquet",
+            filesystem=self._filesystem,
+            partitioning="hive" if partitioning != "none" else None,
+        )
+
+    def run(self, job, query, filters, limit=DEFAULT_LIMIT):
+        """Run a named query over a job's output. `filters` maps columns of
+        FILTER_COLUMNS to the value they must equal."""
+        import pyarrow.dataset as ds
+
+        columns, aggregate = QUERIES[query]
+        filters = {name: value for name, value in filters.items() if value}
+        key = job["parquetOutputKey"]
+        partitioning = job.get("parquetPartitioning", "none")
+        cache_key = (key, job.get("parquetWrittenOn"), query, tuple(sorted(filters.items())), limit)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+
+        expression = None
+        for name, value in filters.items():
+            condition = ds.field(name) == value
+            expression = condition if expression is None else expression & condition
+        table = self._dataset(key, partitioning).to_table(columns=list(columns), filter=expression)
+        result = aggregate(_decoded(table), limit)
+
+        self._cache[cache_key] = result
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return result
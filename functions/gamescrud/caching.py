@@ -0,0 +1,71 @@
+import hashlib
+import json
+from collections import OrderedDict
+from decimal import Decimal
+
+# Review pages kept per warm container; a page holds at most
+# MAX_REVIEW_PAGE_SIZE reviews
+MAX_CACHED_PAGES = 32
+
+# Only the reviews of jobs in these states, whose results have been stored,
+# are cached
+SETTLED_JOB_STATUSES = ("Completed", "PartiallyCompleted")
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def etag(value):
+    """Strong ETag of a JSON serializable value."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=json_default)
+    return f'"{hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match, tag):
+    """Whether an If-None-Match header matches an ETag, compared weakly as
+    RFC 9110 asks for If-None-Match."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag.removeprefix("W/") for candidate in if_none_match.split(","))
+
+
+def results_version(job):
+    """Version of the reviews stored for a job, or None while they may
+    still change. parseandstoreresults removes resultsUpdatedOn from the job
+    that holds the reviews before it writes any and sets it once all are
+    stored, so a job that is completed and has it holds a fixed set."""
+    if not job or job.get("jobStatus") not in SETTLED_JOB_STATUSES or not job.get("resultsUpdatedOn"):
+        return None
+    return f"{job['jobStatus']}@{job['resultsUpdatedOn']}"
+
+
+class ReviewPageCache:
+    """Bounded LRU of review pages of settled jobs, keyed by game, job,
+    results version and request. A new results version makes older entries
+    unreachable; writes through this container drop a game's or job's
+    entries straight away."""
+
+    def __init__(self, max_pages=MAX_CACHED_PAGES):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+
+    def get(self, key):
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+        return page
+
+    def put(self, key, page):
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def invalidate(self, game_id, job_id=None):
+        for key in [key for key in self._pages if key[0] == game_id and (job_id is None or key[1] == job_id)]:
+            del self._pages[key]
@@ -1,7 +1,12 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from itertools import islice
 import json
-from fastapi import Depends, FastAPI, HTTPException, Request, Query
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.openapi.utils import get_openapi
 from mangum import Mangum
 from pydantic import BaseModel, Field, validator
@@ -9,10 +14,14 @@ import boto3
 from boto3.dynamodb.conditions import Key, Attr
 from typing import Optional
 import os
+import re
 import uuid
 from typing import Dict
 import logging
-import mimetypes
+from common.deletion import IN_PROGRESS, Deleter, delete_game as delete_game_data, delete_job, has_many_reviews, start_deletion, status_key
+from analytics import DEFAULT_LIMIT, QUERIES, ParquetAnalytics
+from caching import ReviewPageCache, etag, etag_matches, json_default, results_version
+from common.review_index import INDEX_PK, INDEX_SK, REVIEW_ATTRIBUTES, REVIEW_INDEX_NAME, overall_partition, review_sort_key, review_view, topic_partition
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -21,6 +30,32 @@ app = FastAPI()
 
 dynamodb = boto3.resource("dynamodb")
 table = dynamodb.Table(os.environ.get("ddbTableName"))
+analytics = ParquetAnalytics(os.environ.get("gameDataBucketName"))
+review_pages = ReviewPageCache()
+
+GAME_USER_INDEX_NAME = "GameUserIndex"
+MAX_PAGE_SIZE = 100
+MAX_REVIEW_PAGE_SIZE = 1000
+# streamed responses are still returned whole through API Gateway, so they
+# stop well below its 10 MB and Lambda's 6 MB payload limits
+MAX_STREAM_BYTES = 4 * 1024 * 1024
+# room kept below MAX_STREAM_BYTES for the closing cursor line
+STREAM_CURSOR_BYTES = 1024
+# opaque cursor of the next page of a paginated listing
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_JOB_QUERY_WORKERS = 16
+
+# Attributes returned by default, and those that can be asked for with
+# `fields`. Jobs listed with a game carry what the job list shows.
+JOB_SUMMARY_FIELDS = (
+    "PK", "SK", "id", "jobName", "jobDescription", "jobStatus", "jobMessage",
+    "jobCreatedOn", "submitTime", "lastModifiedTime", "rawreviewsfilename",
+)
+REVIEW_FIELDS = ("SK",) + REVIEW_ATTRIBUTES
+# only these are projected into the review index
+INDEXED_REVIEW_FIELDS = REVIEW_FIELDS
+TABLE_REVIEW_FIELDS = REVIEW_FIELDS + ("configHash", "modelInput")
+FIELD_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
 
 app_env = os.environ.get("APP_ENV", "production").lower()
 
@@ -80,26 +115,92 @@ def get_authenticated_user_id(event: dict = Depends(get_lambda_event)):
         logger.error("Invalid event structure in authentication", exc_info=True)
         raise HTTPException(status_code=500, detail="Invalid event structure")
 
+def encode_cursor(last_evaluated_key: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        start_key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(start_key, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return start_key
+
+def parse_fields(fields: Optional[str], allowed, default):
+    """The attributes named by a comma separated `fields` parameter, or
+    `default` when it is not given. Names must be in `allowed`, or be plain
+    attribute names when it is None."""
+    if not fields:
+        return tuple(default)
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    if allowed is None:
+        unknown = [name for name in names if not FIELD_NAME.fullmatch(name)]
+    else:
+        unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        expected = f"; expected any of {', '.join(allowed)}" if allowed is not None else ""
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(unknown) or fields}{expected}")
+    return names
+
+def projection(fields) -> dict:
+    """ProjectionExpression arguments for the given attribute names, every
+    one through a placeholder as some attribute names are reserved words."""
+    return {
+        "ProjectionExpression": ", ".join(f"#f{index}" for index in range(len(fields))),
+        "ExpressionAttributeNames": {f"#f{index}": name for index, name in enumerate(fields)},
+    }
+
+def query_jobs(game_pk: str, fields=JOB_SUMMARY_FIELDS):
+    # through the resource's client, which unlike the resource can be shared between threads
+    query = {
+        "TableName": table.name,
+        "KeyConditionExpression": Key("PK").eq(game_pk) & Key("SK").begins_with("JOB#"),
+        **projection(fields),
+    }
+    jobs = []
+    while True:
+        response = table.meta.client.query(**query)
+        jobs.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return jobs
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+# responses carrying an ETag are revalidated by the client before reuse
+ETAG_CACHE_CONTROL = "private, no-cache"
+
+def with_etag(body, if_none_match: Optional[str]):
+    """Respond with `body` and its ETag, or with 304 when If-None-Match
+    names it."""
+    tag = etag(body)
+    headers = {"ETag": tag, "Cache-Control": ETAG_CACHE_CONTROL}
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=jsonable_encoder(body), headers=headers)
+
 @app.get("/games/{game_id}")
-async def get_game(game_id: str, user_id:str = Depends(get_authenticated_user_id)):
+async def get_game(
+    game_id: str,
+    job_fields: Optional[str] = None,
+    user_id:str = Depends(get_authenticated_user_id),
+    if_none_match: Optional[str] = Header(None),
+):
     try:
+        # jobs are sorted on their creation time
+        fields = tuple(dict.fromkeys(parse_fields(job_fields, None, JOB_SUMMARY_FIELDS) + ("jobCreatedOn",)))
         response = table.get_item(
             Key={"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"}
         )
         item = response.get("Item")
         #get jobs from ddb
         if item:
-            response = table.query(
-                KeyConditionExpression=Key("PK").eq(f"GAME#{game_id}")
-                & Key("SK").begins_with("JOB#")
-            )
-            jobs = response.get("Items", [])
+            jobs = query_jobs(f"GAME#{game_id}", fields)
             item["jobs"] = sorted(jobs, key=lambda x: x.get("jobCreatedOn", 0), reverse=True)
 
         if not item:
             logger.warning(f"Game not found: {game_id}")
             raise HTTPException(status_code=404, detail="Game not found")
-        return item
+        return with_etag(item, if_none_match)
     except HTTPException:
         raise
     except Exception as e:
@@ -139,7 +240,7 @@ async def update_game(game_id: str, game: GameCreate, user_id: str = Depends(get
         expression_attribute_names = {f"#{k}": k for k in game.dict(exclude_unset=True)}
 
         if not expression_attribute_values:
-            return await get_game(game_id)  # No updates to apply
+            return await get_game(game_id, user_id=user_id, if_none_match=None)  # No updates to apply
 
         response = table.update_item(
             Key={"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"},
@@ -148,6 +249,7 @@ async def update_game(game_id: str, game: GameCreate, user_id: str = Depends(get
             ExpressionAttributeNames=expression_attribute_names,
             ReturnValues="ALL_NEW",
         )
+        review_pages.invalidate(game_id)
         return response["Attributes"]
     except HTTPException:
         raise
@@ -155,29 +257,40 @@ async def update_game(game_id: str, game: GameCreate, user_id: str = Depends(get
         handle_error(e, f"Error updating game {game_id}", "An error occurred while updating the game")
 
 
+def delete_in_background(user_id: str, game_id: str, job_id: Optional[str] = None):
+    """Hand a deletion to the delete worker and answer 202 with where its
+    status can be polled."""
+    deletion_id = start_deletion(table, user_id, game_id, job_id)
+    event = {"deletion_id": deletion_id, "game_id": game_id}
+    if job_id:
+        event["job_id"] = job_id
+    lambda_client = boto3.client("lambda")
+    lambda_client.invoke(
+        FunctionName=os.environ.get("deleteWorkerFunctionName"),
+        InvocationType="Event",
+        Payload=json.dumps(event).encode("utf-8"),
+    )
+    return JSONResponse(
+        status_code=202,
+        content={"deletionId": deletion_id, "deletionStatus": IN_PROGRESS},
+        headers={"Location": f"/deletions/{deletion_id}"},
+    )
+
+
 @app.delete("/games/{game_id}", status_code=204)
 async def delete_game(game_id: str, user_id:str =  Depends(get_authenticated_user_id)):
+    """Delete a game with its jobs, reviews and files. Games with many
+    reviews are deleted in the background: the game is gone from listings
+    at once, and the response is a 202 with the deletion to poll."""
     try:
-        table.delete_item(Key={"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"})
-        # delete all reviews in dynamodb as well
-        response = table.query(
-            KeyConditionExpression=Key("PK").eq(f"GAME#{game_id}")
-            & Key("SK").begins_with("REVIEW#")
-        )
-        reviews = response["Items"]
-        with table.batch_writer() as batch:
-            for review in reviews:
-                batch.delete_item(Key={"PK": review["PK"], "SK": review["SK"]})
-        # delete s3 files for game
-        s3 = boto3.client("s3")
-        bucket_name = os.environ.get("gameDataBucketName")
-        prefix = f"{game_id}/"
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        if "Contents" in response:
-            for obj in response["Contents"]:
-                s3.delete_object(Bucket=bucket_name, Key=obj["Key"])
-                print(f"Deleted {obj['Key']}")
-
+        review_pages.invalidate(game_id)
+        if has_many_reviews(table, game_id):
+            table.delete_item(Key={"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"})
+            return delete_in_background(user_id, game_id)
+
+        deleter = Deleter(table, boto3.client("s3"), os.environ.get("gameDataBucketName"))
+        delete_game_data(deleter, game_id)
+        logger.info(f"Deleted game {game_id}: {deleter.deleted}")
         return {"message": "Game deleted successfully"}
     except HTTPException:
         raise
@@ -185,49 +298,84 @@ async def delete_game(game_id: str, user_id:str =  Depends(get_authenticated_use
         handle_error(e, f"Error deleting game {game_id}", "An error occurred while deleting the game")
 
 
-@app.get("/games")
-async def list_games(user_id: str = Depends(get_authenticated_user_id)):
+@app.get("/deletions/{deletion_id}")
+async def get_deletion(deletion_id: str, user_id: str = Depends(get_authenticated_user_id)):
+    """Status of a background deletion: deletionStatus is IN_PROGRESS,
+    COMPLETE or FAILED, with the number of items and objects deleted."""
+    try:
+        item = table.get_item(Key=status_key(deletion_id)).get("Item")
+        if not item or item.get("requestedBy") != user_id:
+            raise HTTPException(status_code=404, detail="Deletion not found")
+        return {name: value for name, value in item.items() if name not in ("PK", "SK", "expiresAt", "requestedBy")}
+    except HTTPException:
+        raise
+    except Exception as e:
+        handle_error(e, f"Error retrieving deletion {deletion_id}", "An error occurred while retrieving the deletion")
+
 
+@app.get("/games")
+async def list_games(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    job_fields: Optional[str] = None,
+    user_id: str = Depends(get_authenticated_user_id),
+):
+    """The user's games, newest first, each with its jobs. Without `limit`
+    every game is returned; with it, one page is, and the cursor of the next
+    page is returned in the X-Next-Cursor header. Jobs carry
+    JOB_SUMMARY_FIELDS unless `job_fields` names others."""
     try:
-        filter_expression = Attr("SK").begins_with("METADATA#")
-        if user_id:
-            filter_expression = filter_expression & Attr("user_id").eq(user_id)
+        fields = parse_fields(job_fields, None, JOB_SUMMARY_FIELDS)
+        query = {
+            "IndexName": GAME_USER_INDEX_NAME,
+            "KeyConditionExpression": Key("user_id").eq(user_id),
+            "FilterExpression": Attr("SK").begins_with("METADATA#"),
+            "ScanIndexForward": False,
+        }
+        if cursor:
+            start_key = decode_cursor(cursor)
+            if start_key.get("user_id") != user_id:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query["ExclusiveStartKey"] = start_key
         games = []
-        last_evaluated_key = None
-
         while True:
-            if last_evaluated_key:
-                response = table.scan(
-                    FilterExpression=filter_expression,
-                    ExclusiveStartKey=last_evaluated_key
-                )
-            else:
-                response = table.scan(
-                    FilterExpression=filter_expression
-                )
-            
-            games.extend(response["Items"])
-
-            last_evaluated_key = response.get("LastEvaluatedKey")
-            if not last_evaluated_key:
+            if limit:
+                query["Limit"] = limit - len(games)
+            page = table.query(**query)
+            games.extend(page["Items"])
+            last_evaluated_key = page.get("LastEvaluatedKey")
+            if not last_evaluated_key or (limit and len(games) >= limit):
                 break
+            query["ExclusiveStartKey"] = last_evaluated_key
 
-        for game in games:
-            response = table.query(
-                KeyConditionExpression=Key("PK").eq(game["PK"])
-                & Key("SK").begins_with("JOB#")
-            )
-            game["jobs"] = response["Items"]
+        if limit and last_evaluated_key:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last_evaluated_key)
+
+        if games:
+            with ThreadPoolExecutor(max_workers=min(MAX_JOB_QUERY_WORKERS, len(games))) as executor:
+                for game, jobs in zip(games, executor.map(query_jobs, [game["PK"] for game in games], [fields] * len(games))):
+                    game["jobs"] = jobs
 
         return games
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Error listing games", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# generate presigned url for S3 to upload csv file
+# content type of each accepted review file format, by file name suffix
+UPLOAD_CONTENT_TYPES = {
+    ".csv": "text/csv",
+    ".csv.gz": "application/gzip",
+    ".parquet": "application/vnd.apache.parquet",
+}
+
+
+# generate presigned url for S3 to upload a csv, gzip-compressed csv or parquet file
 @app.get("/upload-url")
-async def get_upload_url(game_id: str, job_id: str, filename: str = Query(..., regex=r"^.*\.csv$"), user_id: str = Depends(get_authenticated_user_id)):
+async def get_upload_url(game_id: str, job_id: str, filename: str = Query(..., regex=r"^.*\.(csv|csv\.gz|parquet)$"), user_id: str = Depends(get_authenticated_user_id)):
     try:
         # validate game exists
         response = table.get_item(
@@ -237,19 +385,23 @@ async def get_upload_url(game_id: str, job_id: str, filename: str = Query(..., r
             logger.warning(f"Game {game_id} not found")
             raise HTTPException(status_code=404, detail="Game not found")
 
-        mime_type, _ = mimetypes.guess_type(filename)
-        if not mime_type or not mime_type.startswith("text/csv"):
-            raise HTTPException(status_code=400, detail="Invalid file type. Only CSV files are allowed.")
+        content_type = next(
+            (content_type for suffix, content_type in UPLOAD_CONTENT_TYPES.items() if filename.endswith(suffix)),
+            None,
+        )
+        if content_type is None:
+            raise HTTPException(status_code=400, detail="Invalid file type. Only CSV, CSV.GZ and Parquet files are allowed.")
         s3 = boto3.client("s3")
         bucket_name = os.environ.get("gameDataBucketName")
         key = f"{game_id}/jobs/{job_id}/raw-data/{filename}"
         url = s3.generate_presigned_url(
             ClientMethod="put_object",
-            Params={"Bucket": bucket_name, "Key": key, "ContentType": "text/csv"},
+            Params={"Bucket": bucket_name, "Key": key, "ContentType": content_type},
             ExpiresIn=3600,
             HttpMethod="PUT",
         )
-        return {"upload_url": url}
+        # the upload must be sent with the content type the URL was signed for
+        return {"upload_url": url, "content_type": content_type}
     except HTTPException:
         raise
     except Exception as e:
@@ -258,7 +410,11 @@ async def get_upload_url(game_id: str, job_id: str, filename: str = Query(..., r
 
 # endpoint that triggers a statemachine to process the csv file
 @app.post("/process-csv")
-async def process_csv(game_id: str, job_id: str, user_id: str =  Depends(get_authenticated_user_id)):
+async def process_csv(
+    game_id: str,
+    job_id: str,
+    mode: str = Query("full", regex=r"^(full|incremental)$"),
+    user_id: str =  Depends(get_authenticated_user_id)):
     try:
         # validate game exists
         response = table.get_item(
@@ -268,22 +424,36 @@ async def process_csv(game_id: str, job_id: str, user_id: str =  Depends(get_aut
             raise HTTPException(status_code=404, detail="Job not found")
         
         #if job is not Completed or Not Sumbitted don't start execution
-        if response["Item"]["jobStatus"] not in ["Completed", "Not Submitted"]:
+        if response["Item"]["jobStatus"] not in ["Completed", "PartiallyCompleted", "Not Submitted"]:
             raise HTTPException(
-                status_code=400, detail="Job is not in Completed or Not Submitted state"
+                status_code=400, detail="Job is not in Completed, PartiallyCompleted or Not Submitted state"
             )
+        job = response["Item"]
+
+        # an incremental job only analyzes reviews newer than the game's
+        # watermark and merges them into the game's latest result set
+        if mode == "incremental":
+            game = table.get_item(
+                Key={"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"}
+            ).get("Item")
+            if not game or not game.get("latestResultJobId"):
+                raise HTTPException(
+                    status_code=400, detail="Game has no completed analysis to run an incremental job against"
+                )
         # trigger statemachine
         stepfunctions = boto3.client("stepfunctions")
         state_machine_arn = os.environ.get("stateMachineArn")
         input = {
             "game_id": game_id,
             "job_id": job_id,
-            "s3_raw_data_source_key": response["Item"]["rawreviewsfilename"],
+            "s3_raw_data_source_key": job["rawreviewsfilename"],
             "job_name": job_id,
+            "mode": mode,
         }
         response = stepfunctions.start_execution(
             stateMachineArn=state_machine_arn, input=json.dumps(input)
         )
+        review_pages.invalidate(game_id, job.get("resultJobId") if mode == "incremental" else job_id)
         return {"message": "CSV file processing started"}
     except HTTPException:
         raise
@@ -292,18 +462,70 @@ async def process_csv(game_id: str, job_id: str, user_id: str =  Depends(get_aut
 
 
 @app.get("/games/{game_id}/analysis-jobs/{job_id}", status_code=200)
-async def get_analysis_job(game_id: str, job_id: str, user_id: str =  Depends(get_authenticated_user_id)):
+async def get_analysis_job(
+    game_id: str,
+    job_id: str,
+    fields: Optional[str] = None,
+    user_id: str =  Depends(get_authenticated_user_id),
+    if_none_match: Optional[str] = Header(None),
+):
     try:
-        response = table.get_item(
-            Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"}
-        )
+        # the whole job unless `fields` names some of its attributes
+        get = {"Key": {"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"}}
+        if fields:
+            get.update(projection(parse_fields(fields, None, ())))
+        response = table.get_item(**get)
         item = response.get("Item")
-        return item
+        if item is None:
+            return None
+        return with_etag(item, if_none_match)
     except HTTPException:
         raise
     except Exception as e:
         handle_error(e, f"Error retrieving analysis job for game {game_id}, job {job_id}", "An error occurred while retrieving the analysis job")
 
+@app.get("/games/{game_id}/analysis-jobs/{job_id}/stats", status_code=200)
+async def get_analysis_job_stats(game_id: str, job_id: str, user_id: str =  Depends(get_authenticated_user_id)):
+    """Review counts per overall sentiment and per topic and sentiment,
+    written by the job's result ingestion."""
+    try:
+        result_job_id, _ = result_set(game_id, job_id)
+        item = table.get_item(
+            Key={"PK": f"GAME#{game_id}", "SK": f"STATS#{result_job_id}"}
+        ).get("Item")
+        if not item:
+            raise HTTPException(status_code=404, detail="Analysis job stats not found")
+        return item
+    except HTTPException:
+        raise
+    except Exception as e:
+        handle_error(e, f"Error retrieving stats for game {game_id}, job {job_id}", "An error occurred while retrieving the analysis job stats")
+
+@app.get("/games/{game_id}/analysis-jobs/{job_id}/analytics", status_code=200)
+async def get_analysis_job_analytics(
+    game_id: str,
+    job_id: str,
+    query: str = Query(..., regex=f"^({'|'.join(QUERIES)})$"),
+    overall_sentiment: Optional[str] = None,
+    topic: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=1000),
+    user_id: str =  Depends(get_authenticated_user_id)):
+    """Run a named aggregation over the job's Parquet output."""
+    try:
+        job = table.get_item(
+            Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"},
+            ProjectionExpression="parquetOutputKey, parquetPartitioning, parquetWrittenOn",
+        ).get("Item")
+        if not job or "parquetOutputKey" not in job:
+            raise HTTPException(status_code=404, detail="Analysis job output not found")
+        filters = {"overall_sentiment": overall_sentiment, "topic": topic, "sentiment": sentiment}
+        return {"query": query, "rows": analytics.run(job, query, filters, limit)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        handle_error(e, f"Error running {query} for game {game_id}, job {job_id}", "An error occurred while running the analytics query")
+
 @app.post("/games/{game_id}/analysis-jobs", status_code=201)
 async def create_analysis_job(game_id: str, job_request: JobRequest, user_id: str =  Depends(get_authenticated_user_id)):
     try:
@@ -354,6 +576,7 @@ async def update_analysis_job(game_id: str, job_id: str, job: dict, user_id: str
             ExpressionAttributeNames=expression_attribute_names,
             ReturnValues="ALL_NEW",
         )
+        review_pages.invalidate(game_id, job_id)
         return response["Attributes"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -362,60 +585,190 @@ async def update_analysis_job(game_id: str, job_id: str, job: dict, user_id: str
 # delete analysis job
 @app.delete("/games/{game_id}/analysis-jobs/{job_id}", status_code=204)
 async def delete_analysis_job(game_id: str, job_id: str, user_id: str =  Depends(get_authenticated_user_id)):
+    """Delete a job with its reviews, stats and files, in the background
+    for jobs with many reviews as delete_game does."""
     try:
-        response = table.get_item(
-            Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"})
-
-        table.delete_item(Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"})
-        # delete s3 files for analysis job
-        s3 = boto3.client("s3")
-        bucket_name = os.environ.get("gameDataBucketName")
-        prefix = f"{game_id}/jobs/{job_id}/"
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        if "Contents" in response:
-            for obj in response["Contents"]:
-                s3.delete_object(Bucket=bucket_name, Key=obj["Key"])
-                print(f"Deleted {obj['Key']}")
+        review_pages.invalidate(game_id, job_id)
+        if has_many_reviews(table, game_id, review_sort_key(job_id, "")):
+            table.delete_item(Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"})
+            return delete_in_background(user_id, game_id, job_id)
+
+        deleter = Deleter(table, boto3.client("s3"), os.environ.get("gameDataBucketName"))
+        delete_job(deleter, game_id, job_id)
+        logger.info(f"Deleted analysis job {job_id} of game {game_id}: {deleter.deleted}")
         return {"message": "Analysis job deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def result_set(game_id: str, job_id: str, fields=()):
+    """The id of the job whose result set holds a job's reviews and stats,
+    and that job's `fields`. An incremental job stores its reviews under
+    the result set it merged into, any other job under itself."""
+    names = tuple(dict.fromkeys(("resultJobId",) + tuple(fields)))
+    job = table.get_item(Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"}, **projection(names)).get("Item", {})
+    result_job_id = job.get("resultJobId") or job_id
+    if result_job_id != job_id:
+        job = table.get_item(Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{result_job_id}"}, **projection(names)).get("Item", {})
+    return result_job_id, job
+
+def query_pages(query: dict, limit: Optional[int] = None):
+    """Yield (items, cursor) for each page of a table query, where cursor
+    resumes after the page or is None at the end. Stops after `limit`
+    items; DynamoDB stops evaluating there too, so the cursor of the last
+    page resumes right after its last item."""
+    query = dict(query)
+    remaining = limit
+    while True:
+        if remaining is not None:
+            query["Limit"] = remaining
+        response = table.query(**query)
+        last_evaluated_key = response.get("LastEvaluatedKey")
+        yield response["Items"], encode_cursor(last_evaluated_key) if last_evaluated_key else None
+        if remaining is not None:
+            remaining -= len(response["Items"])
+        if not last_evaluated_key or remaining == 0:
+            return
+        query["ExclusiveStartKey"] = last_evaluated_key
+
+
+def stream_ndjson(pages, view, key_names):
+    """One JSON document per line, written as pages arrive. A line that
+    would take the stream past MAX_STREAM_BYTES is not written; the stream
+    then ends with the cursor of the last line written, made of its
+    `key_names`, and otherwise with the cursor of the last page when
+    reviews remain. The first line is always written."""
+    written = 0
+    next_cursor = None
+    for items, next_cursor in pages:
+        chunk = []
+        for index, item in enumerate(items):
+            line = (json.dumps(view(item), default=json_default) + "\n").encode("utf-8")
+            if written and written + len(line) + STREAM_CURSOR_BYTES > MAX_STREAM_BYTES:
+                last = items[index - 1] if index else previous
+                next_cursor = encode_cursor({name: last[name] for name in key_names})
+                yield b"".join(chunk)
+                yield (json.dumps({"cursor": next_cursor}) + "\n").encode("utf-8")
+                return
+            chunk.append(line)
+            written += len(line)
+        if items:
+            previous = items[-1]
+        yield b"".join(chunk)
+    if next_cursor:
+        yield (json.dumps({"cursor": next_cursor}) + "\n").encode("utf-8")
+
+
 @app.get("/games/{game_id}/analysis-jobs/{job_id}/reviews")
 async def filter_analysis_job_reviews(
     game_id: str, 
     job_id: str, 
+    response: Response,
     overall_sentiment: Optional[str] = None, 
     topic: Optional[str] = None, 
     sentiment: Optional[str] = None, 
-    user_id: str =  Depends(get_authenticated_user_id)):
+    limit: Optional[int] = Query(None, ge=1, le=MAX_REVIEW_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", regex="^(json|ndjson)$"),
+    fields: Optional[str] = None,
+    user_id: str =  Depends(get_authenticated_user_id),
+    if_none_match: Optional[str] = Header(None)):
+    """A page of a job's reviews, optionally filtered. The JSON body is a
+    list of at most `limit` reviews, or of one DynamoDB page of up to 1 MB
+    without it, and the cursor of the next page is returned in the
+    X-Next-Cursor header. `format=ndjson` streams one review per line
+    instead, up to `limit` reviews or MAX_STREAM_BYTES, and ends with a
+    `{"cursor": ...}` line when there are more. Reviews carry REVIEW_FIELDS
+    unless `fields` names others; configHash and modelInput are only kept
+    on the review items, so cannot be asked for with a filter. An
+    incremental job lists the reviews of the result set it merged into."""
     
     try:
-        filter_expression = Attr("overall_sentiment").eq(overall_sentiment) if overall_sentiment else None
-
-        #if topic and sentiment is provided find the classification that contains topic and sentiment
+        # the reviews of a completed job stay as they are until its results
+        # are written again, so their pages are versioned by the job
+        job_id, job = result_set(game_id, job_id, ("jobStatus", "resultsUpdatedOn"))
+        version = results_version(job)
+
+        # a topic and sentiment filter reads the REVIEWIDX# items of matching
+        # classifications, an overall sentiment filter the matching reviews;
+        # both through the sparse review index instead of filtering the job
         if topic and sentiment:
-            if filter_expression:
-                filter_expression = filter_expression & Attr("classifications").contains({"topic": topic, "sentiment": sentiment})
-                
-            else:
-                filter_expression = Attr("classifications").contains({"topic": topic, "sentiment": sentiment})
-                
-
-        if filter_expression:
-            response = table.query(
-                KeyConditionExpression=Key("PK").eq(f"GAME#{game_id}")
-                & Key("SK").begins_with(f"REVIEW#{job_id}"),
-                FilterExpression=filter_expression
-            )
+            partition_key, partition = INDEX_PK, topic_partition(game_id, job_id, topic, sentiment)
+        elif overall_sentiment:
+            partition_key, partition = INDEX_PK, overall_partition(game_id, job_id, overall_sentiment)
         else:
-            response = table.query(
-                KeyConditionExpression=Key("PK").eq(f"GAME#{game_id}")
-                & Key("SK").begins_with(f"REVIEW#{job_id}")
-            )
-        return response["Items"]
+            partition_key, partition = "PK", f"GAME#{game_id}"
+
+        if partition_key == INDEX_PK:
+            names = parse_fields(fields, INDEXED_REVIEW_FIELDS, REVIEW_FIELDS)
+            if "SK" in names:
+                # index items stand for their review through its reviewId
+                names = tuple(dict.fromkeys(names + ("reviewId",)))
+            key_names = ("PK", "SK", INDEX_PK, INDEX_SK)
+            query = {
+                "IndexName": REVIEW_INDEX_NAME,
+                "KeyConditionExpression": Key(INDEX_PK).eq(partition),
+                **projection(tuple(dict.fromkeys(names + key_names))),
+            }
+            if topic and sentiment and overall_sentiment:
+                query["FilterExpression"] = Attr("overall_sentiment").eq(overall_sentiment)
+        else:
+            names = parse_fields(fields, TABLE_REVIEW_FIELDS, REVIEW_FIELDS)
+            key_names = ("PK", "SK")
+            query = {
+                "KeyConditionExpression": Key("PK").eq(partition)
+                & Key("SK").begins_with(review_sort_key(job_id, "")),
+                **projection(tuple(dict.fromkeys(names + key_names))),
+            }
+        if cursor:
+            start_key = decode_cursor(cursor)
+            # a cursor only resumes the listing it was returned with
+            if start_key.get(partition_key) != partition:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query["ExclusiveStartKey"] = start_key
+
+        headers = {}
+        if version:
+            page_key = (game_id, job_id, version, overall_sentiment, topic, sentiment, limit, cursor, format, fields)
+            headers = {"ETag": etag(page_key), "Cache-Control": ETAG_CACHE_CONTROL}
+            if etag_matches(if_none_match, headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+
+        # keys are read to resume a stream after any review, but only
+        # returned when asked for
+        def view(item):
+            shown = review_view(item, job_id) if "IndexName" in query else item
+            return {name: value for name, value in shown.items() if name in names or name not in key_names}
+
+        if format == "ndjson":
+            pages = stream_ndjson(query_pages(query, limit), view, key_names)
+            return StreamingResponse(pages, media_type="application/x-ndjson", headers=headers)
+
+        page = review_pages.get(page_key) if version else None
+        if page is None:
+            reviews = []
+            next_cursor = None
+            pages = query_pages(query, limit)
+            if limit is None:
+                # without a limit a single page of up to 1 MB, as clients
+                # that do not follow the cursor have always been given
+                pages = islice(pages, 1)
+            for items, next_cursor in pages:
+                reviews.extend(view(item) for item in items)
+            page = (reviews, next_cursor)
+            if version:
+                review_pages.put(page_key, page)
+        reviews, next_cursor = page
+        response.headers.update(headers)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return reviews
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
@@ -441,6 +794,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 # Lambda handler
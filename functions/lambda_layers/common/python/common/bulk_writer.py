@@ -0,0 +1,198 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# batch_write_item accepts at most 25 requests per call
+BATCH_WRITE_LIMIT = 25
+
+DEFAULT_MAX_WORKERS = 8
+
+THROTTLING_ERRORS = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+)
+
+
+class BulkWriter:
+    """Writes and deletes items of one table with concurrent batch_write_item
+    calls.
+
+    Exposes the put_item/delete_item interface of boto3's batch writer, so it
+    can be used wherever a batch writer is, and unlike it is safe to share
+    between threads. Calls go through the table resource's client, which
+    takes and returns plain Python values.
+
+    Items are sent in batches of 25 by up to `max_workers` workers.
+    Unprocessed items are retried with full-jitter exponential backoff, and
+    the number of workers allowed in flight is halved whenever a batch is
+    throttled and grows back by one after every `recovery_batches` clean
+    batches.
+    """
+
+    def __init__(
+        self,
+        table,
+        max_workers=DEFAULT_MAX_WORKERS,
+        overwrite_by_pkeys=None,
+        max_attempts=10,
+        base_delay=0.05,
+        max_delay=5.0,
+        recovery_batches=10,
+    ):
+        self.client = table.meta.client
+        self.table_name = table.name
+        self.max_workers = max_workers
+        self.overwrite_by_pkeys = overwrite_by_pkeys
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.recovery_batches = recovery_batches
+
+        self._buffer = {}
+        self._buffer_lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._limit = max_workers
+        self._in_flight = 0
+        self._clean_batches = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._error = None
+
+        self.items = 0
+        self.consumed_wcu = 0.0
+        self.throttled_batches = 0
+        self._started = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def put_item(self, Item):
+        self._add({"PutRequest": {"Item": Item}}, Item)
+
+    def delete_item(self, Key):
+        self._add({"DeleteRequest": {"Key": Key}}, Key)
+
+    def _add(self, request, item):
+        # later requests for the same key replace earlier ones in the batch,
+        # as batch_write_item rejects duplicate keys
+        dedupe_key = tuple(item[key] for key in self.overwrite_by_pkeys) if self.overwrite_by_pkeys else object()
+        with self._buffer_lock:
+            self._buffer.pop(dedupe_key, None)
+            self._buffer[dedupe_key] = request
+            if len(self._buffer) < BATCH_WRITE_LIMIT:
+                return
+            batch = list(self._buffer.values())
+            self._buffer = {}
+        self._submit(batch)
+
+    def _submit(self, batch):
+        self._raise_error()
+        with self._slots:
+            while self._in_flight >= self._limit:
+                self._slots.wait()
+            self._in_flight += 1
+        self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            self._write(batch)
+        except Exception as e:
+            logger.error(f"Bulk write to {self.table_name} failed: {e}")
+            self._error = self._error or e
+        finally:
+            with self._slots:
+                self._in_flight -= 1
+                self._slots.notify_all()
+
+    def _write(self, batch):
+        requests = batch
+        for attempt in range(self.max_attempts):
+            try:
+                response = self.client.batch_write_item(
+                    RequestItems={self.table_name: requests},
+                    ReturnConsumedCapacity="TOTAL",
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERRORS:
+                    raise
+                self._throttled()
+                self._backoff(attempt)
+                continue
+
+            consumed = sum(capacity.get("CapacityUnits", 0) for capacity in response.get("ConsumedCapacity", []))
+            processed = len(requests)
+            requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+            processed -= len(requests)
+            with self._slots:
+                self.consumed_wcu += consumed
+                self.items += processed
+            if not requests:
+                self._succeeded()
+                return
+            self._throttled()
+            self._backoff(attempt)
+        raise Exception(f"{len(requests)} items left unprocessed after {self.max_attempts} attempts")
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def _throttled(self):
+        with self._slots:
+            self.throttled_batches += 1
+            self._clean_batches = 0
+            self._limit = max(1, self._limit // 2)
+
+    def _succeeded(self):
+        with self._slots:
+            self._clean_batches += 1
+            if self._clean_batches >= self.recovery_batches and self._limit < self.max_workers:
+                self._limit += 1
+                self._clean_batches = 0
+                self._slots.notify_all()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        """Send buffered items and wait for every batch in flight."""
+        with self._buffer_lock:
+            batch = list(self._buffer.values())
+            self._buffer = {}
+        if batch:
+            self._submit(batch)
+        with self._slots:
+            while self._in_flight:
+                self._slots.wait()
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+            metrics = self.metrics()
+            logger.info(
+                f"Bulk wrote {metrics['items']} items to {self.table_name} in {metrics['seconds']:.1f}s: "
+                f"{metrics['items_per_second']:.0f} items/s, {metrics['consumed_wcu']:.0f} WCU, "
+                f"{metrics['throttled_batches']} throttled batches"
+            )
+
+    def metrics(self):
+        seconds = time.monotonic() - self._started
+        return {
+            "items": self.items,
+            "seconds": seconds,
+            "items_per_second": self.items / seconds if seconds else 0.0,
+            "consumed_wcu": self.consumed_wcu,
+            "throttled_batches": self.throttled_batches,
+        }
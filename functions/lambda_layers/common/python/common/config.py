@@ -0,0 +1,74 @@
+import os
+import time
+import boto3
+
+# How long a warm container reuses parameters before reloading them
+DEFAULT_TTL_SECONDS = int(os.environ.get("CONFIG_TTL_SECONDS", "300"))
+
+
+def to_bool(value):
+    return value.strip().lower() in ("true", "1", "yes")
+
+
+# Parameters that are not plain strings, by name under /{stackName}/default/
+PARAMETER_TYPES = {
+    "MODEL_TEMPERATURE": float,
+    "MODEL_TOP_P": float,
+    "MODEL_TOP_K": int,
+    "MODEL_MAX_TOKENS_TO_SAMPLE": int,
+    "BATCH_MAX_RECORDS_PER_SHARD": int,
+    "BATCH_MAX_BYTES_PER_SHARD": int,
+    "BATCH_MIN_RECORDS_PER_SHARD": int,
+    "INFERENCE_CACHE_ENABLED": to_bool,
+    "REVIEW_MAX_INPUT_TOKENS": int,
+    "ESTIMATED_OUTPUT_TOKENS_PER_RECORD": int,
+    "MODEL_INPUT_PRICE_PER_1K_TOKENS": float,
+    "MODEL_OUTPUT_PRICE_PER_1K_TOKENS": float,
+    "FILTER_MIN_CHARS": int,
+    "FILTER_MAX_CHARS": int,
+    "FILTER_MIN_WORDS": int,
+    "FILTER_MIN_ALPHA_RATIO": float,
+    "FILTER_MIN_LATIN_RATIO": float,
+    "FILTER_NEAR_DUP_THRESHOLD": float,
+    "FILTER_MAX_TRACKED_REVIEWS": int,
+    "SOURCE_READ_CONCURRENCY": int,
+}
+
+_ssm = None
+_cache = {}
+
+
+def _client():
+    global _ssm
+    if _ssm is None:
+        _ssm = boto3.client("ssm")
+    return _ssm
+
+
+def _load(path):
+    values = {}
+    paginator = _client().get_paginator("get_parameters_by_path")
+    for page in paginator.paginate(Path=path, Recursive=True, WithDecryption=True):
+        for parameter in page["Parameters"]:
+            name = parameter["Name"][len(path):]
+            coerce = PARAMETER_TYPES.get(name, str)
+            values[name] = coerce(parameter["Value"])
+    return values
+
+
+def get_config(stack_name=None, ttl=DEFAULT_TTL_SECONDS):
+    """Return every parameter under /{stackName}/default/ as a dict of typed
+    values, loading the whole tree with get_parameters_by_path and caching it
+    for `ttl` seconds."""
+    path = f"/{stack_name or os.environ.get('stackName')}/default/"
+    now = time.monotonic()
+    cached = _cache.get(path)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    values = _load(path)
+    _cache[path] = (now + ttl, values)
+    return values
+
+
+def invalidate():
+    _cache.clear()
@@ -0,0 +1,196 @@
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from common.bulk_writer import BulkWriter
+
+# Most keys one delete_objects call takes
+MAX_DELETE_KEYS = 1000
+MAX_DELETE_WORKERS = 8
+
+# Games and jobs with more reviews than this are deleted in the background
+ASYNC_DELETE_THRESHOLD = 500
+
+# Deletion status items expire this long after they were last updated
+STATUS_TTL_DAYS = 7
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETE = "COMPLETE"
+FAILED = "FAILED"
+
+
+def game_prefixes():
+    """Sort key prefixes of everything stored for a game besides its
+    METADATA item, which is deleted last."""
+    return ("REVIEW#", "REVIEWIDX#", "MODELCONFIG#", "STATS#", "JOB#")
+
+
+def job_prefixes(job_id):
+    return (f"REVIEW#{job_id}#", f"REVIEWIDX#{job_id}#", f"MODELCONFIG#{job_id}#")
+
+
+class Deleter:
+    """Deletes the items under sort key prefixes of a game partition and the
+    objects under S3 prefixes, reading every page of both.
+
+    Items go through a BulkWriter and objects through delete_objects calls of
+    up to 1000 keys, run by up to `max_workers` threads. Between pages
+    `should_stop()` is asked whether to give up for now; deleting again later
+    carries on with what is left. `deleted` counts items and objects."""
+
+    def __init__(self, table, s3, bucket, should_stop=None, max_workers=MAX_DELETE_WORKERS):
+        self.table = table
+        self.s3 = s3
+        self.bucket = bucket
+        self.should_stop = should_stop or (lambda: False)
+        self.max_workers = max_workers
+        self.stopped = False
+        self.deleted = {"items": 0, "objects": 0}
+
+    def _stop(self):
+        if not self.stopped and self.should_stop():
+            self.stopped = True
+        return self.stopped
+
+    def items(self, game_id, prefixes):
+        with BulkWriter(self.table, max_workers=self.max_workers) as bulk:
+            for prefix in prefixes:
+                query = {
+                    "KeyConditionExpression": Key("PK").eq(f"GAME#{game_id}") & Key("SK").begins_with(prefix),
+                    "ProjectionExpression": "PK, SK",
+                }
+                while not self._stop():
+                    response = self.table.query(**query)
+                    for item in response["Items"]:
+                        bulk.delete_item(Key={"PK": item["PK"], "SK": item["SK"]})
+                    self.deleted["items"] += len(response["Items"])
+                    if "LastEvaluatedKey" not in response:
+                        break
+                    query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return not self.stopped
+
+    def item(self, key):
+        self.table.delete_item(Key=key)
+        self.deleted["items"] += 1
+
+    def _delete_batch(self, keys):
+        response = self.s3.delete_objects(
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+        errors = response.get("Errors", [])
+        if errors:
+            raise RuntimeError(f"Failed to delete {len(errors)} objects, first {errors[0].get('Key')}: {errors[0].get('Message')}")
+        return len(keys)
+
+    def objects(self, prefix):
+        paginator = self.s3.get_paginator("list_objects_v2")
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, PaginationConfig={"PageSize": MAX_DELETE_KEYS}):
+                    keys = [obj["Key"] for obj in page.get("Contents", [])]
+                    if keys:
+                        pending.append(executor.submit(self._delete_batch, keys))
+                    # listing is not held back by deletes, but runs at most
+                    # a few batches ahead of them
+                    while len(pending) > self.max_workers:
+                        self.deleted["objects"] += pending.popleft().result()
+                    if self._stop():
+                        break
+            finally:
+                for future in pending:
+                    self.deleted["objects"] += future.result()
+        return not self.stopped
+
+
+def delete_game(deleter, game_id):
+    """Delete a game's items and objects. Returns whether everything was
+    deleted before `deleter` was asked to stop."""
+    return (
+        deleter.items(game_id, game_prefixes())
+        and deleter.objects(f"{game_id}/")
+        and deleter.items(game_id, ("METADATA#",))
+    )
+
+
+def delete_job(deleter, game_id, job_id):
+    """Delete a job, its reviews, their index items, its stats and model
+    configs, and its objects. When the job holds the reviews incremental
+    jobs build on, the next job of the game runs in full again."""
+    if not (deleter.items(game_id, job_prefixes(job_id)) and deleter.objects(f"{game_id}/jobs/{job_id}/")):
+        return False
+    try:
+        deleter.table.update_item(
+            Key={"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"},
+            UpdateExpression="REMOVE latestResultJobId, reviewWatermark",
+            ConditionExpression="latestResultJobId = :job",
+            ExpressionAttributeValues={":job": job_id},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+    deleter.item({"PK": f"GAME#{game_id}", "SK": f"STATS#{job_id}"})
+    deleter.item({"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"})
+    return True
+
+
+def has_many_reviews(table, game_id, prefix="REVIEW#"):
+    """Whether a game has more than ASYNC_DELETE_THRESHOLD items under a
+    review prefix, reading no more than that many keys."""
+    response = table.query(
+        KeyConditionExpression=Key("PK").eq(f"GAME#{game_id}") & Key("SK").begins_with(prefix),
+        Select="COUNT",
+        Limit=ASYNC_DELETE_THRESHOLD,
+    )
+    return "LastEvaluatedKey" in response
+
+
+def status_key(deletion_id):
+    return {"PK": f"DELETION#{deletion_id}", "SK": "STATUS"}
+
+
+def start_deletion(table, user_id, game_id, job_id=None):
+    """Put the status item of a background deletion and return its id."""
+    deletion_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    item = {
+        **status_key(deletion_id),
+        "deletionId": deletion_id,
+        # not user_id, which would put the item in GameUserIndex
+        "requestedBy": user_id,
+        "game_id": game_id,
+        "deletionStatus": IN_PROGRESS,
+        "itemsDeleted": 0,
+        "objectsDeleted": 0,
+        "startedOn": now,
+        "lastModifiedTime": now,
+        "expiresAt": int(time.time()) + STATUS_TTL_DAYS * 86400,
+    }
+    if job_id:
+        item["job_id"] = job_id
+    table.put_item(Item=item)
+    return deletion_id
+
+
+def update_deletion(table, deletion_id, status, deleted, error=None):
+    """Set the status of a background deletion and add to its counts."""
+    assignments = ["deletionStatus = :status", "lastModifiedTime = :now", "expiresAt = :expires"]
+    values = {
+        ":status": status,
+        ":now": datetime.now(timezone.utc).isoformat(),
+        ":expires": int(time.time()) + STATUS_TTL_DAYS * 86400,
+        ":items": deleted["items"],
+        ":objects": deleted["objects"],
+    }
+    if error is not None:
+        assignments.append("deletionError = :error")
+        values[":error"] = error
+    table.update_item(
+        Key=status_key(deletion_id),
+        UpdateExpression=f"SET {', '.join(assignments)} ADD itemsDeleted :items, objectsDeleted :objects",
+        ExpressionAttributeValues=values,
+    )
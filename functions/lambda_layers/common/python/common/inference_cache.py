@@ -0,0 +1,86 @@
+import hashlib
+import json
+import random
+import time
+from itertools import islice
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+DEFAULT_TTL_DAYS = 90
+
+
+def cache_key(model_id, model_input):
+    """Content address of an inference request.
+
+    The model input already carries the prompt, the review text and the
+    inference parameters, so hashing its canonical JSON together with the
+    model id identifies the request exactly.
+    """
+    payload = json.dumps(model_input, sort_keys=True, separators=(",", ":"))
+    return cache_key_from_encoded(model_id, payload.encode("utf-8"))
+
+
+def cache_key_from_encoded(model_id, encoded_model_input):
+    """cache_key for a model input that is already canonical JSON bytes."""
+    return hashlib.sha256(f"{model_id}\n".encode("utf-8") + encoded_model_input).hexdigest()
+
+
+def _item_key(digest):
+    return {"PK": f"INFERENCECACHE#{digest}", "SK": "RESULT"}
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class InferenceCache:
+    """Classification results keyed by cache_key, stored in the game table.
+    Unprocessed keys of a lookup are retried with full-jitter exponential
+    backoff, as BulkWriter retries unprocessed items."""
+
+    def __init__(self, ddb_resource, table_name, ttl_days=DEFAULT_TTL_DAYS, max_attempts=10, base_delay=0.05, max_delay=5.0):
+        self.ddb = ddb_resource
+        self.table_name = table_name
+        self.ttl_days = ttl_days
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_many(self, digests):
+        results = {}
+        for batch in batched(set(digests), BATCH_GET_LIMIT):
+            request = {
+                self.table_name: {
+                    "Keys": [_item_key(digest) for digest in batch],
+                    "ProjectionExpression": "PK, overall_sentiment, classifications",
+                }
+            }
+            for attempt in range(self.max_attempts):
+                response = self.ddb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    results[item["PK"].split("#", 1)[1]] = {
+                        "overall_sentiment": item["overall_sentiment"],
+                        "classifications": item["classifications"],
+                    }
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                self._backoff(attempt)
+            else:
+                raise Exception(f"{len(request[self.table_name]['Keys'])} keys left unprocessed after {self.max_attempts} attempts")
+        return results
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def put(self, batch, digest, overall_sentiment, classifications):
+        batch.put_item(
+            Item={
+                **_item_key(digest),
+                "overall_sentiment": overall_sentiment,
+                "classifications": classifications,
+                "expiresAt": int(time.time()) + self.ttl_days * 86400,
+            }
+        )
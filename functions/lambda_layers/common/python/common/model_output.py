@@ -0,0 +1,290 @@
+import json
+import logging
+import re
+from collections import Counter, namedtuple
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+RESULT_PATTERN = re.compile(r"<result>(.*?)</result>", re.DOTALL)
+RESULT_OPEN = "<result>"
+OVERALL_PATTERN = re.compile(r'"overall_sentiment"\s*:\s*"([^"]*)"')
+
+# The prompt ends with this marker followed by the review text
+REVIEW_MARKER = "Game Review:"
+
+# How many cut points are tried when repairing a truncated result
+MAX_REPAIR_ATTEMPTS = 8
+
+# Failures logged verbatim per parser, the rest are only counted
+MAX_LOGGED_FAILURES = 5
+
+def review_start(prompt):
+    """Index in a prompt where the review text starts, or -1. The template
+    holds the marker once, before the review, so the first occurrence is
+    taken; the review itself may contain it too."""
+    start = prompt.find(REVIEW_MARKER)
+    return start if start == -1 else start + len(REVIEW_MARKER)
+
+
+ParsedRecord = namedtuple("ParsedRecord", "record_id model_input prompt review result recovered")
+
+
+class OutputShape:
+    """Where one model family keeps the prompt in its input and the
+    generated text in its output."""
+
+    name = None
+    # template text the payload generator appends after the review
+    prompt_suffix = ""
+
+    def matches(self, model_input):
+        raise NotImplementedError
+
+    def prompt(self, model_input):
+        raise NotImplementedError
+
+    def with_prompt(self, model_input, prompt):
+        """A copy of the model input with its prompt replaced."""
+        raise NotImplementedError
+
+    def text(self, model_output):
+        raise NotImplementedError
+
+
+class Claude3Shape(OutputShape):
+    name = "claude-3"
+
+    def matches(self, model_input):
+        return "messages" in model_input
+
+    def prompt(self, model_input):
+        return model_input["messages"][0]["content"][0]["text"]
+
+    def with_prompt(self, model_input, prompt):
+        message = model_input["messages"][0]
+        content = [{**message["content"][0], "text": prompt}] + message["content"][1:]
+        return {**model_input, "messages": [{**message, "content": content}] + model_input["messages"][1:]}
+
+    def text(self, model_output):
+        return model_output["content"][0]["text"]
+
+
+class ClaudeTextShape(OutputShape):
+    name = "claude-v2"
+    prompt_suffix = "\n\nAssistant:"
+
+    def matches(self, model_input):
+        return "prompt" in model_input and "max_tokens_to_sample" in model_input
+
+    def prompt(self, model_input):
+        return model_input["prompt"]
+
+    def with_prompt(self, model_input, prompt):
+        return {**model_input, "prompt": prompt}
+
+    def text(self, model_output):
+        return model_output["completion"]
+
+
+class Llama3Shape(OutputShape):
+    name = "llama3"
+    prompt_suffix = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+
+    def matches(self, model_input):
+        return "prompt" in model_input and "max_gen_len" in model_input
+
+    def prompt(self, model_input):
+        return model_input["prompt"]
+
+    def with_prompt(self, model_input, prompt):
+        return {**model_input, "prompt": prompt}
+
+    def text(self, model_output):
+        return model_output["generation"]
+
+
+class TitanTextShape(OutputShape):
+    name = "titan-text"
+
+    def matches(self, model_input):
+        return "inputText" in model_input
+
+    def prompt(self, model_input):
+        return model_input["inputText"]
+
+    def with_prompt(self, model_input, prompt):
+        return {**model_input, "inputText": prompt}
+
+    def text(self, model_output):
+        return model_output["results"][0]["outputText"]
+
+
+# first match wins
+SHAPES = [Claude3Shape(), ClaudeTextShape(), Llama3Shape(), TitanTextShape()]
+
+
+def register_shape(shape):
+    SHAPES.append(shape)
+
+
+def find_shape(model_input):
+    for shape in SHAPES:
+        if shape.matches(model_input):
+            return shape
+    return None
+
+
+def _is_result(value):
+    return isinstance(value, dict) and "overall_sentiment" in value
+
+
+def _repair(fragment):
+    """Recover a result from JSON that was cut off mid-way, by closing it
+    after one of the last complete objects, or failing that keep just the
+    overall sentiment."""
+    end = len(fragment)
+    for _ in range(MAX_REPAIR_ATTEMPTS):
+        end = fragment.rfind("}", 0, end)
+        if end == -1:
+            break
+        for closing in ("]}", "}"):
+            try:
+                value = json.loads(fragment[:end + 1] + closing)
+            except json.JSONDecodeError:
+                continue
+            if _is_result(value):
+                return value
+    match = OVERALL_PATTERN.search(fragment)
+    if match:
+        return {"overall_sentiment": match.group(1), "classifications": []}
+    return None
+
+
+def _decode(fragment, complete):
+    if complete:
+        try:
+            value = _loads(fragment)
+            if _is_result(value):
+                return value, False
+        except json.JSONDecodeError:
+            pass
+    try:
+        value, _ = json.JSONDecoder().raw_decode(fragment)
+        if _is_result(value):
+            return value, True
+    except json.JSONDecodeError:
+        pass
+    value = _repair(fragment)
+    return value, value is not None
+
+
+def parse_result_text(text):
+    """Return (result, recovered) for the `<result>` block in a model
+    completion, or (None, reason) when there is nothing usable.
+
+    A complete block is decoded as is. Trailing text after the JSON object
+    is ignored, and a block cut off by the token limit is repaired by
+    closing it after its last complete classification. Completions that
+    escape their quotes are unescaped as a last resort."""
+    match = RESULT_PATTERN.search(text)
+    if match:
+        fragment = match.group(1).strip()
+    else:
+        start = text.find(RESULT_OPEN)
+        if start == -1:
+            return None, "no_result"
+        fragment = text[start + len(RESULT_OPEN):].strip()
+
+    value, recovered = _decode(fragment, match is not None)
+    if value is None and '\\"' in fragment:
+        value, recovered = _decode(fragment.replace('\\"', '"'), match is not None)
+    if value is None:
+        return None, "invalid_result"
+    return value, recovered
+
+
+class ModelOutputParser:
+    """Parses Bedrock batch inference output records of any registered
+    model family, counting outcomes in `stats`."""
+
+    def __init__(self, shapes=SHAPES):
+        self.shapes = shapes
+        self.stats = Counter()
+        self._shape = None
+
+    def shape(self, model_input):
+        # every record of a job comes from the same model
+        if self._shape is not None and self._shape.matches(model_input):
+            return self._shape
+        for shape in self.shapes:
+            if shape.matches(model_input):
+                self._shape = shape
+                return shape
+        return None
+
+    def review(self, model_input):
+        """Return the review text that was appended to the prompt."""
+        shape = self.shape(model_input)
+        if shape is None:
+            return None
+        return self._review(shape, shape.prompt(model_input))
+
+    @staticmethod
+    def _review(shape, prompt):
+        start = review_start(prompt)
+        if start == -1:
+            return None
+        review = prompt[start:]
+        if shape.prompt_suffix and review.endswith(shape.prompt_suffix):
+            review = review[:-len(shape.prompt_suffix)]
+        return review.strip()
+
+    def _fail(self, reason, detail):
+        self.stats[reason] += 1
+        if self.stats["failed"] < MAX_LOGGED_FAILURES:
+            logger.error(f"Could not parse model output ({reason}): {detail[:500]}")
+        self.stats["failed"] += 1
+
+    def parse_line(self, line):
+        """Parse one `.jsonl.out` line. Returns None when the line itself is
+        unusable; otherwise a ParsedRecord whose `result` is None when the
+        model output held no usable classification."""
+        try:
+            record = _loads(line)
+        except json.JSONDecodeError:
+            self._fail("invalid_line", line if isinstance(line, str) else line.decode("utf-8", "replace"))
+            return None
+
+        model_input = record.get("modelInput", {})
+        shape = self.shape(model_input)
+        if shape is None:
+            self._fail("unknown_shape", json.dumps(model_input))
+            return None
+
+        prompt = shape.prompt(model_input)
+        parsed = ParsedRecord(record.get("recordId"), model_input, prompt, self._review(shape, prompt), None, False)
+
+        # failed invocations carry an error instead of an output
+        model_output = record.get("modelOutput")
+        if model_output is None:
+            self._fail("model_error", json.dumps(record.get("error")))
+            return parsed
+
+        try:
+            text = shape.text(model_output)
+        except (KeyError, IndexError, TypeError):
+            self._fail("unknown_output", json.dumps(model_output))
+            return parsed
+
+        result, recovered = parse_result_text(text)
+        if result is None:
+            self._fail(recovered, text)
+            return parsed
+        self.stats["recovered" if recovered else "parsed"] += 1
+        return parsed._replace(result=result, recovered=recovered)
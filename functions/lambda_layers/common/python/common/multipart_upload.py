@@ -0,0 +1,88 @@
+import logging
+
+logger = logging.getLogger()
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class MultipartUploadWriter:
+    """File-like writer that streams bytes to S3 as multipart upload parts.
+
+    Only one part is held in memory at a time. Objects smaller than a single
+    part are written with a plain put_object when the writer is closed.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=DEFAULT_PART_SIZE):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.bytes_written = 0
+        self.closed = False
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._flush_part()
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def _flush_part(self):
+        if self._upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self._upload_id = response["UploadId"]
+        part_number = len(self._parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=bytes(self._buffer),
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self._buffer = bytearray()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            return
+        if self._buffer:
+            self._flush_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+        logger.info(f"Uploaded s3://{self.bucket}/{self.key} in {len(self._parts)} parts ({self.bytes_written} bytes)")
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
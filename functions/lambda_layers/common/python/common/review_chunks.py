@@ -0,0 +1,70 @@
+import re
+from collections import Counter
+
+# Over-long reviews split before inference are sent as separate records whose
+# ids carry the chunk position, e.g. "12345__chunk2of3"
+CHUNK_SEPARATOR = "__chunk"
+CHUNK_ID_PATTERN = re.compile(rf"^(.*){CHUNK_SEPARATOR}(\d+)of(\d+)$")
+
+
+def chunk_record_id(record_id, index, count):
+    return f"{record_id}{CHUNK_SEPARATOR}{index}of{count}"
+
+
+def parse_chunk_record_id(record_id):
+    """Return (base_id, index, count), or None for a record that was not split."""
+    match = CHUNK_ID_PATTERN.match(record_id)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
+def _vote(values):
+    counts = Counter(values).most_common()
+    if not counts:
+        return "null"
+    if len(counts) > 1 and counts[0][1] == counts[1][1]:
+        return "Neutral"
+    return counts[0][0]
+
+
+def merge_chunk_results(results):
+    """Merge the classifications of the chunks of one review.
+
+    The overall sentiment and the sentiment of each topic are decided by
+    majority vote across chunks, with ties resolved as Neutral.
+    """
+    topics = {}
+    for result in results:
+        for classification in result["classifications"]:
+            topics.setdefault(classification["topic"], []).append(classification["sentiment"])
+    return {
+        "overall_sentiment": _vote([result["overall_sentiment"] for result in results]),
+        "classifications": [
+            {"topic": topic, "sentiment": _vote(sentiments)} for topic, sentiments in topics.items()
+        ],
+    }
+
+
+class ChunkAssembler:
+    """Collects chunk results until every chunk of a review has arrived."""
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, record_id, result):
+        """Return (base_id, [results in chunk order]) once the review is
+        complete, or None while chunks are still missing."""
+        base_id, index, count = parse_chunk_record_id(record_id)
+        parts = self.pending.setdefault(base_id, {})
+        parts[index] = result
+        if len(parts) < count:
+            return None
+        del self.pending[base_id]
+        return base_id, [parts[i] for i in sorted(parts)]
+
+    def drain(self):
+        """Yield the reviews that are still missing chunks."""
+        for base_id, parts in self.pending.items():
+            yield base_id, [parts[i] for i in sorted(parts)]
+        self.pending = {}
@@ -0,0 +1,88 @@
+import json
+
+# Size of each chunk read from the duplicates file
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Lines of a review's duplicates that are this close in the file are read
+# with one ranged request, of at most MAX_RANGE_BYTES
+MAX_RANGE_GAP = 64 * 1024
+MAX_RANGE_BYTES = 1024 * 1024
+
+
+def resolve_representatives(representatives):
+    """Map every duplicate id in `representatives`, which maps duplicates to
+    the review they were collapsed onto, to the review that was classified
+    for it. A duplicate may have been collapsed onto another duplicate, so
+    chains are followed to the review they start from."""
+    resolved = {}
+    for record_id in representatives:
+        chain = []
+        representative = record_id
+        while representative in representatives and representative not in resolved and representative not in chain:
+            chain.append(representative)
+            representative = representatives[representative]
+        representative = resolved.get(representative, representative)
+        for duplicate_id in chain:
+            resolved[duplicate_id] = representative
+    return resolved
+
+
+def _object_lines(s3, bucket, key):
+    """Yield (line, start, end) for every non-empty line of an object, with
+    the byte range of the line in it."""
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    offset = 0
+    pending = b""
+    for chunk in body.iter_chunks(chunk_size=READ_CHUNK_SIZE):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line, offset, offset + len(line)
+            offset += len(line) + 1
+    if pending.strip():
+        yield pending, offset, offset + len(pending)
+
+
+class Duplicates:
+    """The reviews collapsed onto each classified review before inference,
+    directly or through another duplicate, as prepareforinference recorded
+    them in the job's duplicates file. Only ids and the place of each line
+    in the file are kept in memory; the texts of a review's duplicates are
+    read back from the file when they are asked for."""
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        representatives = {}
+        ranges = {}
+        for line, start, end in _object_lines(s3, bucket, key):
+            item = json.loads(line)
+            representatives[item["recordId"]] = item["representativeId"]
+            ranges[item["recordId"]] = (start, end)
+        self._ranges = {}
+        for record_id, representative in resolve_representatives(representatives).items():
+            self._ranges.setdefault(representative, []).append(ranges[record_id])
+
+    def get(self, record_id, default=()):
+        """Yield the (record id, review) pairs collapsed onto a review."""
+        ranges = self._ranges.get(record_id)
+        if not ranges:
+            return iter(default)
+        return ((item["recordId"], item["review"]) for item in self._read(sorted(ranges)))
+
+    def _read(self, ranges):
+        span = []
+        for line_range in ranges:
+            if span and (line_range[0] - span[-1][1] > MAX_RANGE_GAP or line_range[1] - span[0][0] > MAX_RANGE_BYTES):
+                yield from self._read_span(span)
+                span = []
+            span.append(line_range)
+        yield from self._read_span(span)
+
+    def _read_span(self, span):
+        start, end = span[0][0], span[-1][1]
+        body = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}")["Body"].read()
+        for line_start, line_end in span:
+            yield json.loads(body[line_start - start:line_end - start])
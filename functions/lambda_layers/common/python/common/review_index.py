@@ -0,0 +1,58 @@
+# Sparse global secondary index over the reviews of a job. Review items are
+# keyed by their overall sentiment; every classification of a review gets its
+# own REVIEWIDX# item keyed by topic and sentiment, carrying a copy of the
+# review, so a filter reads only the reviews that match it.
+REVIEW_INDEX_NAME = "ReviewFilterIndex"
+INDEX_PK = "GSI1PK"
+INDEX_SK = "GSI1SK"
+
+# Attributes copied to REVIEWIDX# items and projected into the index
+REVIEW_ATTRIBUTES = ("reviewId", "overall_sentiment", "classifications", "original_review")
+
+
+def overall_partition(game_id, job_id, overall_sentiment):
+    return f"GAME#{game_id}#JOB#{job_id}#OVERALL#{overall_sentiment}"
+
+
+def topic_partition(game_id, job_id, topic, sentiment):
+    return f"GAME#{game_id}#JOB#{job_id}#TOPIC#{topic}#SENT#{sentiment}"
+
+
+def review_sort_key(job_id, record_id):
+    return f"REVIEW#{job_id}#{record_id}"
+
+
+def index_sort_key(record_id):
+    return f"REVIEW#{record_id}"
+
+
+def index_items(game_id, job_id, review):
+    """Yield one REVIEWIDX# item per distinct topic and sentiment of a
+    review item."""
+    record_id = review["reviewId"]
+    seen = set()
+    for classification in review.get("classifications", []):
+        if not isinstance(classification, dict):
+            continue
+        pair = (classification.get("topic"), classification.get("sentiment"))
+        if pair in seen:
+            continue
+        seen.add(pair)
+        topic, sentiment = pair
+        item = {
+            "PK": f"GAME#{game_id}",
+            "SK": f"REVIEWIDX#{job_id}#{record_id}#{topic}#{sentiment}",
+            INDEX_PK: topic_partition(game_id, job_id, topic, sentiment),
+            INDEX_SK: index_sort_key(record_id),
+        }
+        item.update({name: review[name] for name in REVIEW_ATTRIBUTES if name in review})
+        yield item
+
+
+def review_view(item, job_id):
+    """Present an item read from the index like the review item it stands
+    for."""
+    view = {name: value for name, value in item.items() if name not in (INDEX_PK, INDEX_SK)}
+    if "reviewId" in view:
+        view["SK"] = review_sort_key(job_id, view["reviewId"])
+    return view
@@ -0,0 +1,59 @@
+import hashlib
+import json
+from decimal import Decimal
+from common.model_output import find_shape, review_start
+from common.review_index import INDEX_PK, INDEX_SK, index_sort_key, overall_partition, review_sort_key
+
+# Stands in for the review text in a stored model input config
+REVIEW_PLACEHOLDER = "{review}"
+
+
+def _number(value):
+    # model inputs read back from the table hold Decimals; integral ones were
+    # ints and the others floats when the model input was first encoded
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def model_input_config(model_input, review):
+    """Return (config_hash, config) for a model input: its canonical JSON
+    with the review replaced by REVIEW_PLACEHOLDER, so that every review
+    sent with the same prompt and inference parameters shares one config.
+    The review is only looked for where it was appended to the prompt."""
+    shape = find_shape(model_input) if review else None
+    if shape is not None:
+        prompt = shape.prompt(model_input)
+        start = review_start(prompt)
+        # the review follows the marker and the whitespace after it
+        at = prompt.find(review, start) if start != -1 else -1
+        if at != -1:
+            try:
+                model_input = shape.with_prompt(model_input, prompt[:at] + REVIEW_PLACEHOLDER + prompt[at + len(review):])
+            except NotImplementedError:
+                pass
+    config = json.dumps(model_input, sort_keys=True, separators=(",", ":"), default=_number)
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()[:16], config
+
+
+def config_item(game_id, job_id, config_hash, config):
+    return {
+        "PK": f"GAME#{game_id}",
+        "SK": f"MODELCONFIG#{job_id}#{config_hash}",
+        "configHash": config_hash,
+        "modelInput": config,
+    }
+
+
+def review_item(game_id, job_id, record_id, config_hash, overall_sentiment, classifications, original_review):
+    return {
+        "PK": f"GAME#{game_id}",
+        "SK": review_sort_key(job_id, record_id),
+        INDEX_PK: overall_partition(game_id, job_id, overall_sentiment),
+        INDEX_SK: index_sort_key(record_id),
+        "reviewId": record_id,
+        "overall_sentiment": overall_sentiment,
+        "classifications": classifications,
+        "configHash": config_hash,
+        "original_review": original_review
+    }
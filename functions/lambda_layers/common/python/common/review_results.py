@@ -0,0 +1,58 @@
+import threading
+from common.review_chunks import ChunkAssembler, merge_chunk_results, parse_chunk_record_id
+
+
+class ReviewResults:
+    """Turns classified records into the reviews they stand for, the same
+    way for every place results are stored: the chunks of a review split
+    before inference are merged once all have arrived, and each review's
+    result is repeated for the duplicates collapsed onto it.
+
+    `store(record_id, context, overall_sentiment, classifications, review)`
+    is called once per review, where `context` is what was added with the
+    record, or with the first chunk of a merged review. Safe to share
+    between threads when `store` is."""
+
+    def __init__(self, store, duplicates=None):
+        self.store = store
+        self.duplicates = duplicates or {}
+        self.chunks = ChunkAssembler()
+        self.chunks_lock = threading.Lock()
+
+    def add(self, record_id, context, overall_sentiment, classifications, review):
+        if parse_chunk_record_id(record_id) is None:
+            self._store(record_id, context, overall_sentiment, classifications, review)
+            return
+        with self.chunks_lock:
+            complete = self.chunks.add(record_id, {
+                "context": context,
+                "overall_sentiment": overall_sentiment,
+                "classifications": classifications,
+                "original_review": review,
+            })
+        if complete:
+            self._store_merged(*complete)
+
+    def _store(self, record_id, context, overall_sentiment, classifications, review):
+        self.store(record_id, context, overall_sentiment, classifications, review)
+        for duplicate_id, duplicate_review in self.duplicates.get(record_id, []):
+            self.store(duplicate_id, context, overall_sentiment, classifications, duplicate_review)
+
+    def _store_merged(self, base_id, parts):
+        merged = merge_chunk_results(parts)
+        self._store(
+            base_id,
+            parts[0]["context"],
+            merged["overall_sentiment"],
+            merged["classifications"],
+            " ".join(part["original_review"] or "" for part in parts),
+        )
+
+    def flush(self):
+        """Store the reviews still missing chunks with the chunks that did
+        arrive, and return (review id, chunks stored) for each."""
+        with self.chunks_lock:
+            incomplete = list(self.chunks.drain())
+        for base_id, parts in incomplete:
+            self._store_merged(base_id, parts)
+        return [(base_id, len(parts)) for base_id, parts in incomplete]
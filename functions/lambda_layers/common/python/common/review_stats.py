@@ -0,0 +1,114 @@
+import logging
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Conditional puts tried when other writers keep merging into the same stats
+MAX_MERGE_ATTEMPTS = 10
+
+
+class ReviewStats:
+    """Counts stored reviews per overall sentiment and per topic and
+    sentiment. Safe to share between threads."""
+
+    def __init__(self):
+        self.total = 0
+        self.overall = Counter()
+        self.topics = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, overall_sentiment, classifications, count=1):
+        with self.lock:
+            self.total += count
+            self.overall[overall_sentiment] += count
+            for classification in classifications:
+                if not isinstance(classification, dict):
+                    continue
+                self.topics[(classification.get("topic"), classification.get("sentiment"))] += count
+
+    def merge(self, item):
+        """Add the counts of an existing STATS item."""
+        with self.lock:
+            self.total += int(item.get("totalReviews", 0))
+            self.overall.update({sentiment: int(count) for sentiment, count in item.get("overallSentiment", {}).items()})
+            for topic, sentiments in item.get("topicSentiment", {}).items():
+                self.topics.update({(topic, sentiment): int(count) for sentiment, count in sentiments.items()})
+
+    def to_dict(self):
+        """JSON-serializable counts, e.g. for an ingestion checkpoint."""
+        with self.lock:
+            return {
+                "total": self.total,
+                "overall": dict(self.overall),
+                "topics": [[topic, sentiment, count] for (topic, sentiment), count in self.topics.items()],
+            }
+
+    @classmethod
+    def from_dict(cls, state):
+        stats = cls()
+        stats.total = state["total"]
+        stats.overall.update(state["overall"])
+        stats.topics.update({(topic, sentiment): count for topic, sentiment, count in state["topics"]})
+        return stats
+
+    def to_item(self, game_id, job_id):
+        topic_sentiment = {}
+        for (topic, sentiment), count in self.topics.items():
+            topic_sentiment.setdefault(str(topic), {})[str(sentiment)] = count
+        return {
+            "PK": f"GAME#{game_id}",
+            "SK": f"STATS#{job_id}",
+            "jobId": job_id,
+            "totalReviews": self.total,
+            "overallSentiment": {str(sentiment): count for sentiment, count in self.overall.items()},
+            "topicSentiment": topic_sentiment,
+            "updatedOn": str(datetime.now(timezone.utc)),
+        }
+
+
+def write_stats(table, game_id, job_id, stats, merged_job_id=None):
+    """Store the review counts of a result set as its STATS item.
+
+    An incremental job, `merged_job_id`, adds its counts to those of the
+    result set it merged into. The merge is a conditional put on the
+    revision that was read, retried when another writer got there first,
+    and is skipped for a job already merged, so concurrent merges and a
+    re-run of the same merge count each job once."""
+    key = {"PK": f"GAME#{game_id}", "SK": f"STATS#{job_id}"}
+    if merged_job_id is None:
+        table.put_item(Item={**stats.to_item(game_id, job_id), "revision": uuid.uuid4().hex})
+        logger.info(f"Stored stats for {stats.total} reviews of job {job_id}")
+        return
+
+    for _ in range(MAX_MERGE_ATTEMPTS):
+        existing = table.get_item(Key=key, ConsistentRead=True).get("Item")
+        if existing and merged_job_id in existing.get("mergedJobs", set()):
+            logger.info(f"Stats of job {merged_job_id} were already merged into job {job_id}")
+            return
+        merged = ReviewStats.from_dict(stats.to_dict())
+        if existing:
+            merged.merge(existing)
+        item = {
+            **merged.to_item(game_id, job_id),
+            "revision": uuid.uuid4().hex,
+            "mergedJobs": set(existing.get("mergedJobs", set()) if existing else ()) | {merged_job_id},
+        }
+        if existing and "revision" in existing:
+            condition = {"ConditionExpression": "revision = :revision", "ExpressionAttributeValues": {":revision": existing["revision"]}}
+        elif existing:
+            condition = {"ConditionExpression": "attribute_not_exists(revision)"}
+        else:
+            condition = {"ConditionExpression": "attribute_not_exists(PK)"}
+        try:
+            table.put_item(Item=item, **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            continue
+        logger.info(f"Merged stats for {stats.total} reviews of job {merged_job_id} into job {job_id}, {merged.total} in total")
+        return
+    raise RuntimeError(f"Could not merge stats of job {merged_job_id} into job {job_id} after {MAX_MERGE_ATTEMPTS} attempts")
@@ -0,0 +1,119 @@
+import boto3
+import logging
+import os
+from boto3.dynamodb.conditions import Attr, Key
+from common.bulk_writer import BulkWriter
+from common.review_index import INDEX_PK, index_items
+from common.review_items import config_item, model_input_config, review_item
+
+ddb = boto3.resource("dynamodb")
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Stop when less than this is left of the invocation and return where to resume
+MIN_REMAINING_MILLIS = 60000
+
+MAX_WRITE_WORKERS = 16
+
+
+def list_game_ids(table):
+    game_ids = []
+    scan = {"FilterExpression": Attr("SK").begins_with("METADATA#"), "ProjectionExpression": "PK"}
+    while True:
+        response = table.scan(**scan)
+        game_ids.extend(item["PK"][len("GAME#"):] for item in response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return sorted(game_ids)
+        scan["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def migrate_item(bulk, game_id, item, configs):
+    """Rewrite one review item in the current layout: the model input is
+    replaced by the hash of its config, stored once per job, and the item
+    gets its review index keys and index items."""
+    job_id, record_id = item["SK"][len("REVIEW#"):].split("#", 1)
+    config_hash = item.get("configHash")
+    if "modelInput" in item:
+        config_hash, config = model_input_config(item["modelInput"], item.get("original_review"))
+        if (job_id, config_hash) not in configs:
+            configs.add((job_id, config_hash))
+            bulk.put_item(Item=config_item(game_id, job_id, config_hash, config))
+    migrated = review_item(
+        game_id,
+        job_id,
+        record_id,
+        config_hash,
+        item.get("overall_sentiment"),
+        item.get("classifications", []),
+        item.get("original_review"),
+    )
+    bulk.put_item(Item=migrated)
+    for index_item in index_items(game_id, job_id, migrated):
+        bulk.put_item(Item=index_item)
+
+
+def running_out(context):
+    return context is not None and context.get_remaining_time_in_millis() < MIN_REMAINING_MILLIS
+
+
+def stopped(event, migrated, skipped, next_game_id, start_key):
+    """Result of a run stopped before the timeout, with the event that
+    resumes it at `next_game_id`, from `start_key` within its reviews."""
+    return {
+        "statusCode": 200,
+        "migrated": migrated,
+        "skipped": skipped,
+        "done": False,
+        "next": {
+            "game_id": event.get("game_id"),
+            "next_game_id": next_game_id,
+            "start_key": start_key,
+        },
+    }
+
+
+def lambda_handler(event, context):
+    """Migrate the review items of one game, or of every game when no
+    `game_id` is given. A run that nears the Lambda timeout returns
+    `done: false` and, in `next`, the event that resumes it."""
+
+    table = ddb.Table(os.getenv("ddbTableName"))
+    game_ids = [event["game_id"]] if event.get("game_id") else list_game_ids(table)
+    if event.get("next_game_id"):
+        game_ids = [game_id for game_id in game_ids if game_id >= event["next_game_id"]]
+    start_key = event.get("start_key")
+
+    migrated = skipped = 0
+    configs = set()
+    with BulkWriter(table, max_workers=MAX_WRITE_WORKERS, overwrite_by_pkeys=["PK", "SK"]) as bulk:
+        for index, game_id in enumerate(game_ids):
+            # the first game always makes progress, so a resumed run does too
+            if index > 0 and running_out(context):
+                logger.info(f"Migrated {migrated} review items, skipped {skipped}; stopping before game {game_id}")
+                return stopped(event, migrated, skipped, game_id, None)
+            query = {"KeyConditionExpression": Key("PK").eq(f"GAME#{game_id}") & Key("SK").begins_with("REVIEW#")}
+            if start_key:
+                query["ExclusiveStartKey"] = start_key
+                start_key = None
+            while True:
+                response = table.query(**query)
+                for item in response["Items"]:
+                    if "modelInput" not in item and INDEX_PK in item:
+                        skipped += 1
+                        continue
+                    migrate_item(bulk, game_id, item, configs)
+                    migrated += 1
+                if "LastEvaluatedKey" not in response:
+                    break
+                query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+                if running_out(context):
+                    logger.info(f"Migrated {migrated} review items, skipped {skipped}; stopping before the timeout")
+                    return stopped(event, migrated, skipped, game_id, response["LastEvaluatedKey"])
+
+    logger.info(f"Migrated {migrated} review items, skipped {skipped}")
+    return {
+        "statusCode": 200,
+        "migrated": migrated,
+        "skipped": skipped,
+        "done": True,
+    }
@@ -1,25 +1,47 @@
 import json
 import os
-import re
+import threading
+import time
 import boto3
 import logging
-from decimal import Decimal
+from collections import Counter
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from common.bulk_writer import BulkWriter
+from common.deletion import Deleter
+from common.inference_cache import InferenceCache, cache_key
+from common.model_output import ModelOutputParser
+from common.review_duplicates import Duplicates
+from common.review_index import index_items
+from common.review_items import config_item, model_input_config, review_item
+from common.review_results import ReviewResults
+from common.review_stats import ReviewStats, write_stats
 
 s3 = boto3.client("s3")
 ddb = boto3.resource("dynamodb")
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def extract_game_review(text):
-    pattern = r"Game Review:\s*(.*)"
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    else:
-        return None
+# Output files ingested concurrently
+MAX_INGEST_WORKERS = 4
+
+# Concurrent batch_write_item calls shared by all ingest workers
+MAX_WRITE_WORKERS = 16
+
+# Size of each chunk read from a result object
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Time left at the end of a slice to flush writes and save the checkpoint
+SLICE_RESERVE_SECONDS = 20
+
 
 def lambda_handler(event, context):
+    """Ingest the job's results in slices bounded by the Lambda's remaining
+    time. Each slice resumes from the checkpoint the previous one left and
+    returns `done: false` until every output file has been ingested."""
 
     #extract bucket name from string
     bucket_name  = os.getenv("gameDataBucketName")
@@ -30,68 +52,357 @@ def lambda_handler(event, context):
     table = ddb.Table(tableName)
 
     response = response = table.get_item(Key={'PK': f"GAME#{game_id}", "SK": f"JOB#{job_id}"})
+    job = response["Item"]
     
     s3OutputURI = response["Item"]["s3OutputURI"]
-    jobArn = response["Item"]["jobARN"].split("/")[-1]
-    key = "/".join(s3OutputURI.split("/")[3:])
-    key = f"{key}{jobArn}"
-    
+    output_prefix = "/".join(s3OutputURI.split("/")[3:])
 
-    response = s3.list_objects_v2(
-        Bucket=bucket_name,
-        Prefix=key
+    # a sharded job has one child invocation job per input shard, each
+    # writing its output under its own job id
+    jobArns = response["Item"].get("jobARNs", [response["Item"]["jobARN"]])
+
+    s3Keys = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for jobArn in jobArns:
+        key = f"{output_prefix}{jobArn.split('/')[-1]}"
+
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=key):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(".jsonl.out"):
+                    print(obj["Key"])
+                    s3Keys.append(obj["Key"])
+
+    checkpoint = IngestCheckpoint.load(bucket_name, checkpoint_key(game_id, job_id))
+    # leave time to flush the writes and save the checkpoint
+    stop_at = None
+    if context is not None:
+        stop_at = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - SLICE_RESERVE_SECONDS
+
+    # new classifications are added to the inference cache so that the next
+    # job over the same reviews can skip them
+    cache = InferenceCache(ddb, tableName) if job.get("inferenceCacheEnabled") else None
+
+    duplicates = Duplicates(s3, bucket_name, job["duplicatesKey"]) if job.get("duplicatesKey") else {}
+
+    # an incremental job merges its reviews into the result set it builds on
+    result_job_id = job.get("resultJobId", job_id)
+
+    # the result set is unsettled until every review is stored, which
+    # readers such as gamescrud's review cache go by
+    mark_results_updated(table, game_id, result_job_id, None)
+
+    # a job processed again may classify a review differently, so the index
+    # items of the earlier run go before any are written; an incremental job
+    # only adds reviews newer than its result set's watermark
+    if result_job_id == job_id and not checkpoint.index_cleared:
+        deleter = Deleter(table, s3, bucket_name, should_stop=lambda: stop_at is not None and time.monotonic() >= stop_at)
+        checkpoint.index_cleared = deleter.items(game_id, (f"REVIEWIDX#{job_id}#",))
+        if deleter.deleted["items"]:
+            logger.info(f"Removed {deleter.deleted['items']} index items of an earlier run of job {job_id}")
+        if not checkpoint.index_cleared:
+            return continue_later(checkpoint, job_id)
+
+    tasks = [
+        partial(store_results, s3Key=s3Key, bucket_name=bucket_name, cache=cache, model_id=job.get("modelId"))
+        for s3Key in s3Keys
+    ]
+    if job.get("cachedResultsKey"):
+        tasks.append(partial(store_cached_results, s3Key=job["cachedResultsKey"], bucket_name=bucket_name))
+    tasks = [
+        partial(task, progress=checkpoint.progress(task.keywords["s3Key"]), stop_at=stop_at)
+        for task in tasks
+        if not checkpoint.progress(task.keywords["s3Key"]).done
+    ]
+
+    # every ingest worker shares one writer: chunks of one review may land in
+    # different output files, and the cache may receive the same key twice
+    # for byte-identical reviews
+    with BulkWriter(table, max_workers=MAX_WRITE_WORKERS, overwrite_by_pkeys=["PK", "SK"]) as bulk:
+        writer = ReviewWriter(bulk, game_id, result_job_id, duplicates, stats=checkpoint.stats)
+        writer.chunks.pending = checkpoint.pending_chunks
+        with ThreadPoolExecutor(max_workers=MAX_INGEST_WORKERS) as executor:
+            # consuming the results re-raises the first failure
+            checkpoint.parse_stats += sum(executor.map(lambda task: task(writer), tasks), Counter())
+        done = checkpoint.done
+        if done:
+            writer.flush()
+    # the checkpoint is only saved once every write before it has landed
+    checkpoint.pending_chunks = writer.chunks.pending
+
+    if not done:
+        return continue_later(checkpoint, job_id)
+
+    parse_stats = checkpoint.parse_stats
+    logger.info(f"Model output parse results for job {job_id}: {dict(parse_stats)}")
+    table.update_item(
+        Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"},
+        UpdateExpression="SET parseStats = :stats",
+        ExpressionAttributeValues={":stats": dict(parse_stats)},
     )
 
-    for obj in response["Contents"]:
-        if obj["Key"].endswith(".jsonl.out"):
-            print(obj["Key"])
-            s3Key = obj["Key"]
+    write_stats(table, game_id, result_job_id, writer.stats, merged_job_id=job_id if result_job_id != job_id else None)
+
+    mark_results_updated(table, game_id, result_job_id, str(datetime.now(timezone.utc)))
+
+    advance_watermark(table, game_id, job_id, job)
+
+    checkpoint.delete()
+
+    return {
+        'statusCode': 200,
+        'done': True,
+    }
+
+
+def continue_later(checkpoint, job_id):
+    checkpoint.slices += 1
+    checkpoint.save()
+    logger.info(f"Ingestion of job {job_id} continues after slice {checkpoint.slices}: {checkpoint.summary()}")
+    return {
+        'statusCode': 200,
+        'done': False,
+        'checkpoint': checkpoint.key,
+    }
+
+
+def mark_results_updated(table, game_id, job_id, updated_on):
+    """Set when a job's result set was last completed, or remove it while
+    reviews are written to it. A deleted job is left alone."""
+    update = {"UpdateExpression": "REMOVE resultsUpdatedOn"}
+    if updated_on is not None:
+        update = {"UpdateExpression": "SET resultsUpdatedOn = :updated", "ExpressionAttributeValues": {":updated": updated_on}}
+    try:
+        table.update_item(
+            Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"},
+            ConditionExpression="attribute_exists(PK)",
+            **update,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def checkpoint_key(game_id, job_id):
+    return f"{game_id}/jobs/{job_id}/ingest-checkpoint.json"
+
 
+class FileProgress:
+    """How far into one output file ingestion has got."""
+
+    def __init__(self, offset=0, done=False):
+        self.offset = offset
+        self.done = done
+
+
+class IngestCheckpoint:
+    """State carried from one ingestion slice to the next: the byte offset
+    reached in every file, chunks of split reviews still waiting for their
+    siblings, and the counts accumulated so far."""
+
+    def __init__(self, bucket, key, state=None):
+        state = state or {}
+        self.bucket = bucket
+        self.key = key
+        self.files = {
+            name: FileProgress(progress["offset"], progress["done"]) for name, progress in state.get("files", {}).items()
+        }
+        # JSON object keys are strings, chunk positions are ints
+        self.pending_chunks = {
+            base_id: {int(index): part for index, part in parts.items()}
+            for base_id, parts in state.get("pendingChunks", {}).items()
+        }
+        self.stats = ReviewStats.from_dict(state["stats"]) if "stats" in state else ReviewStats()
+        self.parse_stats = Counter(state.get("parseStats", {}))
+        self.slices = state.get("slices", 0)
+        # checkpoints saved before the index was cleared first have ingested
+        # with it as it was
+        self.index_cleared = state.get("indexCleared", bool(state))
+
+    @classmethod
+    def load(cls, bucket, key):
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key)
+        except s3.exceptions.NoSuchKey:
+            return cls(bucket, key)
+        checkpoint = cls(bucket, key, json.loads(response["Body"].read()))
+        logger.info(f"Resuming ingestion from s3://{bucket}/{key}: {checkpoint.summary()}")
+        return checkpoint
+
+    def progress(self, name):
+        return self.files.setdefault(name, FileProgress())
+
+    @property
+    def done(self):
+        return all(progress.done for progress in self.files.values())
+
+    def summary(self):
+        finished = sum(progress.done for progress in self.files.values())
+        return f"{finished}/{len(self.files)} files, {self.stats.total} reviews, {len(self.pending_chunks)} reviews awaiting chunks"
+
+    def save(self):
+        state = {
+            "files": {name: {"offset": progress.offset, "done": progress.done} for name, progress in self.files.items()},
+            "pendingChunks": self.pending_chunks,
+            "stats": self.stats.to_dict(),
+            "parseStats": dict(self.parse_stats),
+            "slices": self.slices,
+            "indexCleared": self.index_cleared,
+        }
+        s3.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(state).encode("utf-8"))
+
+    def delete(self):
+        s3.delete_object(Bucket=self.bucket, Key=self.key)
+
+
+def advance_watermark(table, game_id, job_id, job):
+    """Record the job's result set and review watermark on the game. A full
+    job becomes the game's latest result set; an incremental job only moves
+    the watermark forward, and only while the result set it merged into is
+    still the latest one."""
+    watermark = job.get("pendingReviewWatermark")
+    key = {"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"}
+
+    if job.get("jobMode", "full") == "full":
+        if watermark is None:
+            table.update_item(
+                Key=key,
+                UpdateExpression="SET latestResultJobId = :job REMOVE reviewWatermark",
+                ExpressionAttributeValues={":job": job_id},
+            )
+        else:
+            table.update_item(
+                Key=key,
+                UpdateExpression="SET latestResultJobId = :job, reviewWatermark = :watermark",
+                ExpressionAttributeValues={":job": job_id, ":watermark": watermark},
+            )
+        return
+
+    if watermark is None:
+        return
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression="SET reviewWatermark = :watermark",
+            ConditionExpression="latestResultJobId = :base AND (attribute_not_exists(reviewWatermark) OR reviewWatermark < :watermark)",
+            ExpressionAttributeValues={":base": job["resultJobId"], ":watermark": watermark},
+        )
+    except ddb.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info(f"Watermark of game {game_id} not advanced by job {job_id}: already at or past {watermark}")
+
+
+def iter_object_lines(s3Key, bucket_name, start=0):
+    """Stream the lines of a JSONL object from byte `start` without reading
+    it whole, each with the offset just past it."""
     response = s3.get_object(
         Bucket=bucket_name,
-        Key=s3Key
+        Key=s3Key,
+        **({"Range": f"bytes={start}-"} if start else {})
     )
 
-    data = response["Body"].read().decode("utf-8").splitlines()
-
-    pattern = r"<result>(.*?)</result>"
-
-    with table.batch_writer() as batch:
-        for item in data:
-            json_item = json.loads(item)
-            inferenceResult = json_item["modelOutput"]["content"][0]["text"]
-            match = re.search(pattern, inferenceResult)
-            if match:
-                json_inferenceResult = json.loads(match.group(1))
-                if json_inferenceResult is not None:
-                    overall_sentiment = json_inferenceResult["overall_sentiment"]
-                    classifications = json_inferenceResult["classifications"]
-                    original_review = extract_game_review(json_item["modelInput"]["messages"][0]["content"][0]["text"])
-
-                    # Convert floats to Decimal
-                    for key in json_item["modelInput"]:
-                        if isinstance(json_item["modelInput"][key], float):
-                            json_item["modelInput"][key] = Decimal(str(json_item["modelInput"][key]))
-
-                    # Add item to batch
-                    batch.put_item(
-                        Item={
-                            "PK": f"GAME#{game_id}",
-                            "SK": f"REVIEW#{job_id}#{json_item['recordId']}",
-                            "overall_sentiment": overall_sentiment,
-                            "classifications": classifications,
-                            "modelInput": json_item["modelInput"],
-                            "original_review": original_review
-                        }
-                    )
-            else:
-                logger.error(f"No match found in {inferenceResult}")
-
-        #convert all floats in json_item["model"] to decimal
-        for key in json_item["modelInput"]:
-            if isinstance(json_item["modelInput"][key], float):
-                json_item["modelInput"][key] = Decimal(str(json_item["modelInput"][key]))
-        
-    return {
-        'statusCode': 200
-    }
\ No newline at end of file
+    offset = start
+    pending = b""
+    for chunk in response["Body"].iter_chunks(chunk_size=READ_CHUNK_SIZE):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            offset += len(line) + 1
+            if line.strip():
+                yield line, offset
+    if pending.strip():
+        yield pending, offset + len(pending)
+
+
+class ReviewWriter:
+    """Writes classified reviews to the table, reassembling reviews that were
+    split into several chunks before inference and fanning results out to
+    the duplicates of each review through ReviewResults. Safe to share
+    between threads when the batch is."""
+
+    def __init__(self, batch, game_id, job_id, duplicates=None, stats=None):
+        self.batch = batch
+        self.game_id = game_id
+        self.job_id = job_id
+        self.stats = stats
+        self.results = ReviewResults(self._put, duplicates)
+        self.chunks = self.results.chunks
+        self.configs = set()
+        self.configs_lock = threading.Lock()
+
+    def _config_hash(self, model_input, review):
+        # the model input is the same for every review but for the review
+        # itself, so it is stored once per job instead of on every item
+        config_hash, config = model_input_config(model_input, review)
+        with self.configs_lock:
+            if config_hash in self.configs:
+                return config_hash
+            self.configs.add(config_hash)
+        self.batch.put_item(Item=config_item(self.game_id, self.job_id, config_hash, config))
+        return config_hash
+
+    def _put(self, record_id, config_hash, overall_sentiment, classifications, original_review):
+        item = review_item(
+            self.game_id, self.job_id, record_id, config_hash, overall_sentiment, classifications, original_review
+        )
+        self.batch.put_item(Item=item)
+        for index_item in index_items(self.game_id, self.job_id, item):
+            self.batch.put_item(Item=index_item)
+        if self.stats is not None:
+            self.stats.add(overall_sentiment, classifications)
+
+    def write(self, record_id, model_input, overall_sentiment, classifications, original_review):
+        config_hash = self._config_hash(model_input, original_review)
+        self.results.add(record_id, config_hash, overall_sentiment, classifications, original_review)
+
+    def flush(self):
+        # chunks whose siblings failed to parse are stored with what we have
+        for base_id, stored in self.results.flush():
+            logger.warning(f"Review {base_id} is missing chunks, stored {stored} of them")
+
+
+def store_cached_results(writer, s3Key, bucket_name, progress, stop_at=None):
+
+    parser = ModelOutputParser()
+    for item, offset in iter_object_lines(s3Key, bucket_name, progress.offset):
+        if stop_at is not None and time.monotonic() >= stop_at:
+            return Counter()
+        json_item = json.loads(item)
+        writer.write(
+            json_item["recordId"],
+            json_item["modelInput"],
+            json_item["overall_sentiment"],
+            json_item["classifications"],
+            parser.review(json_item["modelInput"]),
+        )
+        progress.offset = offset
+    progress.done = True
+    return Counter()
+
+
+def store_results(writer, s3Key, bucket_name, progress, stop_at=None, cache=None, model_id=None):
+    """Store the classified records of one output file from where `progress`
+    left off, until the file ends or `stop_at` passes, and return the
+    parser's outcome counts."""
+    parser = ModelOutputParser()
+    for item, offset in iter_object_lines(s3Key, bucket_name, progress.offset):
+        if stop_at is not None and time.monotonic() >= stop_at:
+            return parser.stats
+        progress.offset = offset
+        record = parser.parse_line(item)
+        if record is None or record.result is None:
+            continue
+        overall_sentiment = record.result["overall_sentiment"]
+        classifications = record.result.get("classifications", [])
+
+        # a repaired result may be missing classifications, so it is not reused
+        if cache is not None and not record.recovered:
+            cache.put(writer.batch, cache_key(model_id, record.model_input), overall_sentiment, classifications)
+
+        writer.write(
+            record.record_id,
+            record.model_input,
+            overall_sentiment,
+            classifications,
+            record.review,
+        )
+    progress.done = True
+    return parser.stats
@@ -1,39 +1,86 @@
 import json
-import csv
 import boto3
 import os
-import io
 from datetime import datetime
+from decimal import Decimal
 from utils.ModelFactory import ModelPayloadGeneratorFactory
+from utils.ShardWriter import ShardedJsonlWriter
+from utils.ReviewFilter import ReviewFilter
+from utils.ReviewWatermark import ReviewWatermark
+from utils.SourceReader import read_sources, resolve_source_keys
+from utils.TokenBudget import JobManifest, ReviewBudget
+from common.config import get_config
+from common.inference_cache import InferenceCache, batched, cache_key_from_encoded, BATCH_GET_LIMIT
+from common.multipart_upload import MultipartUploadWriter
 
 s3 = boto3.client("s3")
-ssm = boto3.client("ssm")
 ddb = boto3.resource("dynamodb")
-stackName = os.getenv("stackName")
 
-def process_row(factory,record, prompt, model_properties):
-    
-    model_input = factory.generate(
-        {**model_properties, "prompt": prompt + record["review"]}
-    )
-    return {"recordId": record["id"], "modelInput": model_input}
+def process_row(template, record):
+    """Return the record id and the JSON-encoded model input for a record."""
+    return record["id"], template.render(record["review"])
+
+
+def encode_request(record_id, model_input, **fields):
+    """Encode one JSONL request line around an already encoded model input."""
+    extra = b"".join(f',"{name}":{json.dumps(value)}'.encode("utf-8") for name, value in fields.items())
+    return b'{"recordId":' + json.dumps(record_id).encode("utf-8") + b',"modelInput":' + model_input + extra + b"}\n"
+
+
+def generate_requests(template, records, budget, manifest, review_filter, duplicates_writer):
+    """Yield (record id, encoded model input, estimated input tokens) for
+    every record that passes the review filter, after the over-length policy
+    has truncated or split long reviews. Duplicates are recorded against
+    their representative review instead of being sent. A record that
+    cannot be made into requests is skipped and counted in the manifest."""
+    for record in records:
+        manifest.source_records += 1
+        try:
+            keep, representative = review_filter.check(record["id"], record["review"])
+            requests = [
+                (*process_row(template, {"id": record_id, "review": review}), manifest.request_tokens(review))
+                for record_id, review in (budget.apply(record["id"], record["review"]) if keep else [])
+            ]
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            manifest.skip_record(record, e)
+            continue
+        if representative is not None:
+            duplicates_writer.write(
+                f"{json.dumps({'recordId': record['id'], 'representativeId': representative, 'review': record['review']})}\n".encode("utf-8")
+            )
+        yield from requests
+
+
+def lookup_cached_results(requests, cache, model_id):
+    """Pair every request with its cached classification, or None on a miss.
+    Lookups are batched so the stream is never held in memory as a whole."""
+    for batch in batched(requests, BATCH_GET_LIMIT):
+        if cache is None:
+            yield from ((request, None) for request in batch)
+            continue
+        digests = [cache_key_from_encoded(model_id, model_input) for _, model_input, _ in batch]
+        hits = cache.get_many(digests)
+        for request, digest in zip(batch, digests):
+            yield request, hits.get(digest)
 
 
 def lambda_handler(event, context):
 
-    ssmParams = getSSMParams()
+    ssmParams = get_config()
 
     game_id = event["game_id"]
     
     s3_source_key = event["s3_raw_data_source_key"].split("/",3)[-1]
     
-    print(f"Processing CSV file: {s3_source_key}")
-    
-    
+    print(f"Processing source: {s3_source_key}")
+
     job_name = event["job_name"]
+    job_id = event["job_id"]
+    mode = event.get("mode", "full")
 
     source_bucket_name = os.getenv("s3SourceBucketName")
     target_bucket_name = os.getenv("s3DestinationBucketName")
+    ddb_table_name = os.getenv("ddbTableName")
 
     prompt = ssmParams["PROMPT"]
     model_id = ssmParams["MODEL_ID"]
@@ -52,6 +99,8 @@ def lambda_handler(event, context):
     ModelPayloadFactory = ModelPayloadGeneratorFactory().create_payload_generator(
         model_id
     )
+    # the envelope and the shared prompt are encoded once for the whole job
+    payload_template = ModelPayloadFactory.compile(model_properties, prompt)
 
     now = datetime.now()
 
@@ -59,80 +108,119 @@ def lambda_handler(event, context):
     s3_input_data_path = f"{s3_job_prefix}/input"
     s3_output_data_path = f"{s3_job_prefix}/output/"
 
-    jsonl_data = f"{s3_input_data_path}/{game_id}_{job_name}_{now.strftime('%Y%m%d%H%M%S')}.jsonl"
-
-    try:
-        response = s3.get_object(
-            Bucket=f"{source_bucket_name}", Key=s3_source_key
-        )
-    except Exception as e:
-        raise Exception(f"Error retrieving object from S3: {e}")
-
-    csv_data = response["Body"].read().decode("utf-8")
-    #validate if csv has id and review columns
-    if not ("id" in csv_data and "review" in csv_data):
-        raise Exception("Invalid CSV file, missing 'id' or 'review' columns")
-    records = csv.DictReader(csv_data.splitlines())
-
-    with io.BytesIO() as jsonl_buffer:
-
-        for record in records:
-
-            try:
-                json_object = process_row(ModelPayloadFactory,record, prompt, model_properties)
-            except Exception as e:
-                print(f"Error processing record: {e}")
-                break
-
-            jsonl_buffer.write(f"{json.dumps(json_object)}\n".encode("utf-8"))
-
-        s3.put_object(
-            Bucket=target_bucket_name,
-            Key=jsonl_data,
-            Body=jsonl_buffer.getvalue(),
-        )
+    jsonl_prefix = f"{s3_input_data_path}/{game_id}_{job_name}_{now.strftime('%Y%m%d%H%M%S')}"
+
+    # the source is a single file or a prefix of CSV, CSV.GZ and Parquet files
+    # that are read concurrently and merged into one stream of records
+    source_keys = resolve_source_keys(s3, source_bucket_name, s3_source_key)
+    print(f"Reading {len(source_keys)} source file(s)")
+    records = read_sources(s3, source_bucket_name, source_keys, ssmParams["SOURCE_READ_CONCURRENCY"])
+
+    table = ddb.Table(ddb_table_name)
+
+    # an incremental job only sends reviews newer than the game's watermark and
+    # its results are merged into the game's latest result set
+    base_job_id = job_id
+    current_watermark = None
+    if mode == "incremental":
+        game = table.get_item(Key={"PK": f"GAME#{game_id}", "SK": f"METADATA#{game_id}"}).get("Item", {})
+        if not game.get("latestResultJobId"):
+            raise Exception(f"Game {game_id} has no completed analysis to merge an incremental job into")
+        base_job_id = game["latestResultJobId"]
+        current_watermark = game.get("reviewWatermark")
+    watermark = ReviewWatermark(mode, current_watermark)
+    records = watermark.newer(records)
+
+    cache_enabled = ssmParams["INFERENCE_CACHE_ENABLED"]
+    cache = InferenceCache(ddb, ddb_table_name) if cache_enabled else None
+    cached_results_key = f"{s3_job_prefix}/cache/cached_results.jsonl"
+    duplicates_key = f"{s3_job_prefix}/filter/duplicates.jsonl"
+    review_filter = ReviewFilter(
+        min_chars=ssmParams["FILTER_MIN_CHARS"],
+        max_chars=ssmParams["FILTER_MAX_CHARS"],
+        min_words=ssmParams["FILTER_MIN_WORDS"],
+        min_alpha_ratio=ssmParams["FILTER_MIN_ALPHA_RATIO"],
+        min_latin_ratio=ssmParams["FILTER_MIN_LATIN_RATIO"],
+        dedupe=ssmParams["FILTER_DEDUPE"],
+        near_dup_threshold=ssmParams["FILTER_NEAR_DUP_THRESHOLD"],
+        max_tracked=ssmParams["FILTER_MAX_TRACKED_REVIEWS"],
+    )
+    budget = ReviewBudget(ssmParams["REVIEW_MAX_INPUT_TOKENS"], ssmParams["REVIEW_OVERLENGTH_POLICY"])
+    manifest = JobManifest(
+        prompt,
+        output_tokens_per_record=ssmParams["ESTIMATED_OUTPUT_TOKENS_PER_RECORD"],
+        max_output_tokens=model_max_tokens_to_sample,
+        input_price_per_1k=ssmParams["MODEL_INPUT_PRICE_PER_1K_TOKENS"],
+        output_price_per_1k=ssmParams["MODEL_OUTPUT_PRICE_PER_1K_TOKENS"],
+    )
+    manifest.source_files = source_keys
+    manifest.watermark = watermark
+
+    # requests already classified by an earlier job are written to a side file
+    # that parseandstoreresults merges back in, everything else goes to Bedrock
+    with ShardedJsonlWriter(
+        s3,
+        target_bucket_name,
+        jsonl_prefix,
+        max_records=ssmParams["BATCH_MAX_RECORDS_PER_SHARD"],
+        max_bytes=ssmParams["BATCH_MAX_BYTES_PER_SHARD"],
+        min_records=ssmParams["BATCH_MIN_RECORDS_PER_SHARD"],
+    ) as jsonl_writer, MultipartUploadWriter(
+        s3, target_bucket_name, cached_results_key
+    ) as cached_writer, MultipartUploadWriter(
+        s3, target_bucket_name, duplicates_key
+    ) as duplicates_writer:
+        requests = generate_requests(payload_template, records, budget, manifest, review_filter, duplicates_writer)
+        for (record_id, model_input, input_tokens), cached in lookup_cached_results(requests, cache, model_id):
+            if cached is None:
+                manifest.add_request(input_tokens)
+                jsonl_writer.write(encode_request(record_id, model_input), input_tokens)
+            else:
+                manifest.cached_requests += 1
+                cached_writer.write(encode_request(record_id, model_input, **cached))
+
+    manifest_data = manifest.to_dict(budget, review_filter, jsonl_writer.shards)
+    manifest_key = f"{s3_job_prefix}/manifest.json"
+    s3.put_object(
+        Bucket=target_bucket_name,
+        Key=manifest_key,
+        Body=json.dumps(manifest_data, indent=2).encode("utf-8"),
+        ContentType="application/json",
+    )
+    print(f"Job manifest: {json.dumps({k: v for k, v in manifest_data.items() if k != 'shards'})}")
+
+    table.update_item(
+        Key={"PK": f"GAME#{game_id}", "SK": f"JOB#{job_id}"},
+        UpdateExpression="SET inferenceCacheEnabled = :enabled, cachedResultsKey = :key, cacheHits = :hits, cacheMisses = :misses, duplicatesKey = :duplicatesKey, "
+        "manifestKey = :manifestKey, estimatedInputTokens = :inputTokens, estimatedOutputTokens = :outputTokens, estimatedCost = :cost, "
+        "jobMode = :mode, resultJobId = :resultJobId, pendingReviewWatermark = :watermark",
+        ExpressionAttributeValues={
+            ":mode": mode,
+            ":resultJobId": base_job_id,
+            ":watermark": watermark.high,
+            ":enabled": cache_enabled,
+            ":key": cached_results_key,
+            ":hits": manifest.cached_requests,
+            ":misses": manifest.requests,
+            ":duplicatesKey": duplicates_key,
+            ":manifestKey": manifest_key,
+            ":inputTokens": manifest_data["estimated_input_tokens"],
+            ":outputTokens": manifest_data["estimated_output_tokens"],
+            ":cost": Decimal(str(manifest_data["estimated_cost_usd"])),
+        },
+    )
 
     return {
         "statusCode": 200,
         "body": {
-            "s3_input_data_uri": f"s3://{target_bucket_name}/{jsonl_data}",
+            "shards": [
+                {
+                    "s3_input_data_uri": f"s3://{target_bucket_name}/{shard['key']}",
+                    "record_count": shard["record_count"],
+                }
+                for shard in jsonl_writer.shards
+            ],
             "s3_output_data_uri": f"s3://{target_bucket_name}/{s3_output_data_path}",
         },
     }
 
-
-def getSSMParams():
-    return {
-        "S3_SOURCE_BUCKET_NAME": ssm.get_parameter(
-            Name=f"/{stackName}/default/S3_SOURCE_BUCKET_NAME"
-        )["Parameter"]["Value"],
-        "S3_TARGET_BUCKET_NAME": ssm.get_parameter(
-            Name=f"/{stackName}/default/S3_TARGET_BUCKET_NAME"
-        )["Parameter"]["Value"],
-        "MODEL_ID": ssm.get_parameter(Name=f"/{stackName}/default/MODEL_ID")[
-            "Parameter"
-        ]["Value"],
-        "MODEL_TEMPERATURE": float(
-            ssm.get_parameter(Name=f"/{stackName}/default/MODEL_TEMPERATURE")[
-                "Parameter"
-            ]["Value"]
-        ),
-        "MODEL_TOP_K": int(
-            ssm.get_parameter(Name=f"/{stackName}/default/MODEL_TOP_K")["Parameter"][
-                "Value"
-            ]
-        ),
-        "MODEL_TOP_P": float(
-            ssm.get_parameter(Name=f"/{stackName}/default/MODEL_TOP_P")["Parameter"][
-                "Value"
-            ]
-        ),
-        "MODEL_MAX_TOKENS_TO_SAMPLE": int(
-            ssm.get_parameter(Name=f"/{stackName}/default/MODEL_MAX_TOKENS_TO_SAMPLE")[
-                "Parameter"
-            ]["Value"]
-        ),
-        "PROMPT": ssm.get_parameter(Name=f"/{stackName}/default/PROMPT")["Parameter"][
-            "Value"
-        ],
-    }
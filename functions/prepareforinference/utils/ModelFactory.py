@@ -1,5 +1,28 @@
 from abc import ABC, abstractmethod
 import json
+from json.encoder import encode_basestring_ascii
+
+# Stands in for the review text while the static envelope is encoded
+PLACEHOLDER = "\x00REVIEW\x00"
+
+
+class PayloadTemplate:
+    """Model input with everything but the review text encoded once.
+
+    The envelope is encoded as canonical JSON (sorted keys, compact
+    separators). JSON string escaping works character by character, so the
+    escaped review can be spliced between the pre-encoded prefix and suffix
+    and the result is identical to encoding the full model input.
+    """
+
+    def __init__(self, model_input):
+        encoded = json.dumps(model_input, sort_keys=True, separators=(",", ":"))
+        prefix, suffix = encoded.split(encode_basestring_ascii(PLACEHOLDER)[1:-1])
+        self.prefix = prefix.encode("ascii")
+        self.suffix = suffix.encode("ascii")
+
+    def render(self, review):
+        return self.prefix + encode_basestring_ascii(review)[1:-1].encode("ascii") + self.suffix
 
 
 class Payload(ABC):
@@ -7,6 +30,10 @@ class Payload(ABC):
     def generate(self, properties):
         pass
 
+    def compile(self, properties, prompt):
+        """Build a PayloadTemplate for `prompt` followed by a review."""
+        return PayloadTemplate(self.generate({**properties, "prompt": prompt + PLACEHOLDER}))
+
 
 class Claudev2_1PayloadGenerator(Payload):
 
@@ -30,12 +57,50 @@ class Claude3PayloadGenerator(Payload):
         }
 
 
+class Llama3PayloadGenerator(Payload):
+
+    def generate(self, properties):
+        prompt = (
+            "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
+            f"{properties['prompt']}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+        )
+        return {
+            "prompt": prompt,
+            "temperature": properties["temperature"],
+            "top_p": properties["top_p"],
+            "max_gen_len": properties["max_tokens_to_sample"],
+        }
+
+
+class TitanTextPayloadGenerator(Payload):
+
+    def generate(self, properties):
+        return {
+            "inputText": properties["prompt"],
+            "textGenerationConfig": {
+                "temperature": properties["temperature"],
+                "topP": properties["top_p"],
+                "maxTokenCount": properties["max_tokens_to_sample"],
+            },
+        }
+
+
 class ModelPayloadGeneratorFactory:
 
+    # (predicate on the model id, generator class), first match wins
+    generators = [
+        (lambda model_id: model_id == "anthropic.claude-v2:1", Claudev2_1PayloadGenerator),
+        (lambda model_id: "anthropic.claude-3" in model_id, Claude3PayloadGenerator),
+        (lambda model_id: "meta.llama3" in model_id, Llama3PayloadGenerator),
+        (lambda model_id: "amazon.titan-text" in model_id, TitanTextPayloadGenerator),
+    ]
+
+    @classmethod
+    def register(cls, predicate, generator_class):
+        cls.generators.append((predicate, generator_class))
+
     def create_payload_generator(self, model_id):
-        if model_id == "anthropic.claude-v2:1":
-            return Claudev2_1PayloadGenerator()
-        if "anthropic.claude-3" in model_id:
-            return Claude3PayloadGenerator()
-        else:
-            raise ValueError("Invalid model name")
+        for predicate, generator_class in self.generators:
+            if predicate(model_id):
+                return generator_class()
+        raise ValueError("Invalid model name")
@@ -0,0 +1,130 @@
+import hashlib
+import random
+import re
+import zlib
+from array import array
+from collections import Counter
+
+DEDUPE_MODES = ("off", "exact", "near")
+
+# MinHash signature layout for near-duplicate detection: NUM_BANDS bands of
+# ROWS_PER_BAND rows. Candidates found through any band are confirmed by the
+# estimated Jaccard similarity of the full signatures.
+NUM_BANDS = 8
+ROWS_PER_BAND = 4
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+SHINGLE_SIZE = 3
+
+# Reviews remembered for deduplication; later reviews are still checked
+# against them but not remembered. An exact entry takes about 150 bytes, a
+# near one about 800.
+MAX_TRACKED_REVIEWS = 100000
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)
+]
+
+_WORD = re.compile(r"\w+")
+
+
+def _normalize(review):
+    return " ".join(_WORD.findall(review.casefold()))
+
+
+def minhash(words):
+    hashes = {zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8")) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return array("I", (min((a * h + b) % _MERSENNE_PRIME for h in hashes) & 0xFFFFFFFF for a, b in _PERMUTATIONS))
+
+
+class ReviewFilter:
+    """Drops reviews that are not worth classifying and collapses duplicates
+    onto a representative review. Only the first `max_tracked` distinct
+    reviews can be representatives, which bounds the memory deduplication
+    takes; duplicates of later ones are classified like any review."""
+
+    def __init__(self, min_chars, max_chars, min_words, min_alpha_ratio, min_latin_ratio, dedupe, near_dup_threshold, max_tracked=MAX_TRACKED_REVIEWS):
+        if dedupe not in DEDUPE_MODES:
+            raise ValueError(f"Invalid dedupe mode: {dedupe}")
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.min_words = min_words
+        self.min_alpha_ratio = min_alpha_ratio
+        self.min_latin_ratio = min_latin_ratio
+        self.dedupe = dedupe
+        self.near_dup_threshold = near_dup_threshold
+        self.max_tracked = max_tracked
+        self.stats = Counter()
+        self._exact = {}
+        self._bands = [{} for _ in range(NUM_BANDS)]
+        self._signatures = {}
+
+    def _rejection(self, review):
+        text = review.strip()
+        if len(text) < self.min_chars:
+            return "too_short"
+        if self.max_chars and len(text) > self.max_chars:
+            return "too_long"
+        if len(text.split()) < self.min_words:
+            return "too_few_words"
+        visible = [ch for ch in text if not ch.isspace()]
+        letters = [ch for ch in visible if ch.isalpha()]
+        # ASCII art and emoji spam are mostly symbols
+        if len(letters) < self.min_alpha_ratio * len(visible):
+            return "not_text"
+        if self.min_latin_ratio and sum(ord(ch) < 0x250 for ch in letters) < self.min_latin_ratio * len(letters):
+            return "language"
+        return None
+
+    def _find_duplicate(self, record_id, review):
+        normalized = _normalize(review)
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+        representative = self._exact.get(digest)
+        if representative is not None:
+            self.stats["exact_duplicate"] += 1
+            return representative
+        representative = self._find_near_duplicate(record_id, normalized) if self.dedupe == "near" else None
+        # a near duplicate is not sent, so its exact copies are collapsed
+        # onto the review it duplicates rather than onto it
+        if len(self._exact) < self.max_tracked:
+            self._exact[digest] = representative or record_id
+        else:
+            self.stats["untracked"] += 1
+        return representative
+
+    def _find_near_duplicate(self, record_id, normalized):
+        words = normalized.split()
+        if len(words) < SHINGLE_SIZE:
+            return None
+        signature = minhash(words)
+        band_keys = [
+            hash(tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])) for band in range(NUM_BANDS)
+        ]
+        for band, key in enumerate(band_keys):
+            candidate = self._bands[band].get(key)
+            if candidate is None:
+                continue
+            matches = sum(x == y for x, y in zip(signature, self._signatures[candidate]))
+            if matches >= self.near_dup_threshold * NUM_PERM:
+                self.stats["near_duplicate"] += 1
+                return candidate
+        if len(self._signatures) < self.max_tracked:
+            for band, key in enumerate(band_keys):
+                self._bands[band].setdefault(key, record_id)
+            self._signatures[record_id] = signature
+        return None
+
+    def check(self, record_id, review):
+        """Return (keep, representative_id). A rejected review has neither,
+        a duplicate is not kept and names the review it duplicates."""
+        reason = self._rejection(review)
+        if reason is not None:
+            self.stats[reason] += 1
+            return False, None
+        if self.dedupe != "off":
+            representative = self._find_duplicate(record_id, review)
+            if representative is not None:
+                return False, representative
+        self.stats["kept"] += 1
+        return True, None
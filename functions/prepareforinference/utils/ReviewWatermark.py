@@ -0,0 +1,44 @@
+from decimal import Decimal
+
+JOB_MODES = ("full", "incremental")
+
+
+def watermark_value(record_id):
+    """Steam recommendation ids grow over time and are compared as numbers;
+    ids that are not numeric fall back to string order."""
+    return Decimal(record_id) if record_id.isascii() and record_id.isdigit() else record_id
+
+
+def _order(value):
+    return (0, value) if isinstance(value, Decimal) else (1, value)
+
+
+class ReviewWatermark:
+    """Tracks the highest review id seen in a job and, in incremental mode,
+    drops reviews at or below the game's current watermark."""
+
+    def __init__(self, mode, current=None):
+        if mode not in JOB_MODES:
+            raise ValueError(f"Invalid job mode: {mode}")
+        self.mode = mode
+        self.current = current
+        self.high = current
+        self.skipped = 0
+
+    def newer(self, records):
+        for record in records:
+            value = watermark_value(record["id"])
+            if self.high is None or _order(value) > _order(self.high):
+                self.high = value
+            if self.mode == "incremental" and self.current is not None and _order(value) <= _order(self.current):
+                self.skipped += 1
+                continue
+            yield record
+
+    def to_dict(self):
+        return {
+            "mode": self.mode,
+            "current": None if self.current is None else str(self.current),
+            "pending": None if self.high is None else str(self.high),
+            "skipped_reviews": self.skipped,
+        }
@@ -0,0 +1,118 @@
+from collections import deque
+from common.multipart_upload import MultipartUploadWriter
+
+
+class _Shard:
+    """One shard being written. Its last `hold` lines are held back from the
+    upload so that they can still move to the shard after it."""
+
+    def __init__(self, writer, hold):
+        self.writer = writer
+        self.hold = hold
+        self.held = deque()
+        self.record_count = 0
+        self.size_bytes = 0
+        self.input_tokens = 0
+
+    def append(self, line, input_tokens):
+        self.held.append((line, input_tokens))
+        self._count(line, input_tokens, 1)
+        if len(self.held) > self.hold:
+            self.writer.write(self.held.popleft()[0])
+
+    def _count(self, line, input_tokens, sign):
+        self.record_count += sign
+        self.size_bytes += sign * len(line)
+        self.input_tokens += sign * input_tokens
+
+    def give_tail(self, shard, count):
+        """Move the last `count` lines to the front of a shard that has
+        written none of its lines yet."""
+        for _ in range(count):
+            line, input_tokens = self.held.pop()
+            self._count(line, input_tokens, -1)
+            shard.held.appendleft((line, input_tokens))
+            shard._count(line, input_tokens, 1)
+
+    def close(self):
+        for line, _ in self.held:
+            self.writer.write(line)
+        self.held.clear()
+        self.writer.close()
+        return {
+            "key": self.writer.key,
+            "record_count": self.record_count,
+            "size_bytes": self.writer.bytes_written,
+            "estimated_input_tokens": self.input_tokens,
+        }
+
+
+class ShardedJsonlWriter:
+    """Splits a stream of JSONL lines into S3 objects bounded by record count
+    and size, so that each shard can be submitted as its own batch job.
+
+    Bedrock rejects batch jobs of fewer than `min_records` records, so a
+    shard is only completed once the next one has that many; a last shard
+    that ends up smaller takes records from the end of the one before it.
+    Only a job with fewer records in total than `min_records` is left with
+    a smaller shard."""
+
+    def __init__(self, s3_client, bucket, key_prefix, max_records, max_bytes, min_records=0):
+        if max_records < 2 * min_records:
+            raise ValueError(f"max_records {max_records} must be at least twice min_records {min_records}")
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.min_records = min_records
+        self.shards = []
+        self._previous = None
+        self._current = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+    def write(self, line, input_tokens=0):
+        if (
+            self._current is None
+            or self._current.record_count >= self.max_records
+            or self._current.size_bytes + len(line) > self.max_bytes
+        ):
+            self._roll()
+        self._current.append(line, input_tokens)
+        if self._previous is not None and self._current.record_count >= self.min_records:
+            self._close_previous()
+
+    def _roll(self):
+        self._close_previous()
+        self._previous = self._current
+        key = f"{self.key_prefix}_{len(self.shards) + (self._previous is not None):04d}.jsonl"
+        self._current = _Shard(MultipartUploadWriter(self.s3, self.bucket, key), self.min_records)
+
+    def _close_previous(self):
+        if self._previous is not None:
+            self.shards.append(self._previous.close())
+            self._previous = None
+
+    def close(self):
+        if self._previous is not None and self._current.record_count < self.min_records:
+            self._previous.give_tail(self._current, self.min_records - self._current.record_count)
+        self._close_previous()
+        if self._current is not None:
+            self.shards.append(self._current.close())
+            self._current = None
+
+    def abort(self):
+        for shard in (self._previous, self._current):
+            if shard is not None:
+                shard.writer.abort()
+        self._previous = None
+        self._current = None
@@ -0,0 +1,162 @@
+import codecs
+import csv
+import gzip
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+from common.inference_cache import batched
+
+# Size of each chunk read from a raw input stream
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Records handed from a reader thread to the consumer at a time
+RECORD_BATCH_SIZE = 1000
+
+SUPPORTED_SUFFIXES = (".csv", ".csv.gz", ".parquet")
+
+REQUIRED_COLUMNS = {"id", "review"}
+
+
+def iter_lines(chunks):
+    """Decode an iterator of byte chunks into lines, keeping line endings so
+    that quoted multi-line CSV fields are reassembled by the csv module."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def iter_csv_lines(body, chunk_size=READ_CHUNK_SIZE):
+    return iter_lines(body.iter_chunks(chunk_size))
+
+
+def iter_gzip_lines(body, chunk_size=READ_CHUNK_SIZE):
+    # GzipFile only calls read() on the body, so the object is decompressed
+    # while it streams in
+    with gzip.GzipFile(fileobj=body) as stream:
+        yield from iter_lines(iter(lambda: stream.read(chunk_size), b""))
+
+
+def _iter_csv_records(lines, key):
+    records = csv.DictReader(lines)
+    if not records.fieldnames or not REQUIRED_COLUMNS.issubset(records.fieldnames):
+        raise Exception(f"Invalid CSV file {key}, missing 'id' or 'review' columns")
+    yield from records
+
+
+def _iter_parquet_records(body, key):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("pyarrow is required to read Parquet input")
+
+    # Parquet keeps its footer at the end of the file, so the object is read
+    # whole and record batches are decoded from memory
+    parquet_file = pq.ParquetFile(pa.BufferReader(body.read()))
+    if not REQUIRED_COLUMNS.issubset(parquet_file.schema_arrow.names):
+        raise Exception(f"Invalid Parquet file {key}, missing 'id' or 'review' columns")
+    for batch in parquet_file.iter_batches(batch_size=RECORD_BATCH_SIZE, columns=["id", "review"]):
+        for record_id, review in zip(batch.column("id").to_pylist(), batch.column("review").to_pylist()):
+            yield {"id": str(record_id), "review": review or ""}
+
+
+def iter_file_records(s3_client, bucket, key):
+    """Yield the records of one CSV, gzip-compressed CSV or Parquet object."""
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    except Exception as e:
+        raise Exception(f"Error retrieving object from S3: {e}")
+
+    if key.endswith(".parquet"):
+        yield from _iter_parquet_records(body, key)
+    elif key.endswith(".csv.gz"):
+        yield from _iter_csv_records(iter_gzip_lines(body), key)
+    else:
+        yield from _iter_csv_records(iter_csv_lines(body), key)
+
+
+def resolve_source_keys(s3_client, bucket, source_key):
+    """Return the objects to read for `source_key`, which is either a single
+    supported file or a prefix holding any number of them."""
+    if source_key.endswith(SUPPORTED_SUFFIXES):
+        return [source_key]
+
+    prefix = source_key if source_key.endswith("/") else f"{source_key}/"
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(SUPPORTED_SUFFIXES) and obj["Size"] > 0:
+                keys.append(obj["Key"])
+    if not keys:
+        raise Exception(f"No CSV, CSV.GZ or Parquet files found under {prefix}")
+    return sorted(keys)
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def read_sources(s3_client, bucket, keys, max_workers, max_pending_batches=16):
+    """Yield the records of every object in `keys`.
+
+    Up to `max_workers` objects are read and decoded concurrently. Reader
+    threads hand record batches to the caller through a bounded queue, so at
+    most `max_pending_batches` batches are held in memory however far the
+    readers get ahead of the consumer. Records of different files are
+    interleaved; the first reader error is raised in the caller."""
+    if len(keys) == 1:
+        yield from iter_file_records(s3_client, bucket, keys[0])
+        return
+
+    queue = Queue(max_pending_batches)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def read(key):
+        if stopped.is_set():
+            return
+        try:
+            for batch in batched(iter_file_records(s3_client, bucket, key), RECORD_BATCH_SIZE):
+                if not put(batch):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(_Failed(e))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        for key in keys:
+            executor.submit(read, key)
+        try:
+            remaining = len(keys)
+            while remaining:
+                item = queue.get()
+                if item is _DONE:
+                    remaining -= 1
+                elif isinstance(item, _Failed):
+                    raise item.error
+                else:
+                    yield from item
+        finally:
+            # lets blocked readers give up if the caller stops early or fails
+            stopped.set()
@@ -0,0 +1,112 @@
+import math
+from common.review_chunks import chunk_record_id
+
+# Average characters per token for English text with Claude tokenizers
+CHARS_PER_TOKEN = 4
+
+# Skipped records logged per job; the rest are only counted
+MAX_LOGGED_SKIPS = 10
+
+OVERLENGTH_POLICIES = ("none", "truncate", "split")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _cut(text, max_chars):
+    """Cut text to at most max_chars, preferring the last whitespace so that
+    words are not broken in half."""
+    if len(text) <= max_chars:
+        return text, ""
+    boundary = text.rfind(" ", max_chars // 2, max_chars + 1)
+    if boundary == -1:
+        boundary = max_chars
+    return text[:boundary], text[boundary:].lstrip()
+
+
+class ReviewBudget:
+    """Applies the over-length policy to reviews before they become requests."""
+
+    def __init__(self, max_review_tokens, policy):
+        if policy not in OVERLENGTH_POLICIES:
+            raise ValueError(f"Invalid over-length policy: {policy}")
+        # a review could never be cut to fit a budget of nothing
+        if max_review_tokens <= 0:
+            raise ValueError(f"Invalid max review tokens: {max_review_tokens}")
+        self.max_chars = max_review_tokens * CHARS_PER_TOKEN
+        self.policy = policy
+        self.truncated = 0
+        self.split = 0
+
+    def apply(self, record_id, review):
+        """Return the (record_id, review) pairs to send for one review."""
+        if self.policy == "none" or len(review) <= self.max_chars:
+            return [(record_id, review)]
+
+        if self.policy == "truncate":
+            self.truncated += 1
+            return [(record_id, _cut(review, self.max_chars)[0])]
+
+        chunks = []
+        remaining = review
+        while remaining:
+            chunk, remaining = _cut(remaining, self.max_chars)
+            chunks.append(chunk)
+        self.split += 1
+        return [
+            (chunk_record_id(record_id, index, len(chunks)), chunk)
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+
+
+class JobManifest:
+    """Running totals of what a job will send to Bedrock."""
+
+    def __init__(self, prompt, output_tokens_per_record, max_output_tokens, input_price_per_1k, output_price_per_1k):
+        self.prompt_tokens = estimate_tokens(prompt)
+        self.output_tokens_per_record = min(output_tokens_per_record, max_output_tokens)
+        self.input_price_per_1k = input_price_per_1k
+        self.output_price_per_1k = output_price_per_1k
+        self.source_files = []
+        self.watermark = None
+        self.source_records = 0
+        self.skipped_records = 0
+        self.cached_requests = 0
+        self.requests = 0
+        self.input_tokens = 0
+
+    def request_tokens(self, review):
+        return self.prompt_tokens + estimate_tokens(review)
+
+    def skip_record(self, record, error):
+        self.skipped_records += 1
+        if self.skipped_records <= MAX_LOGGED_SKIPS:
+            record_id = record.get("id") if isinstance(record, dict) else None
+            print(f"Skipped record {record_id}: {type(error).__name__}: {error}")
+
+    def add_request(self, input_tokens):
+        self.requests += 1
+        self.input_tokens += input_tokens
+
+    def to_dict(self, budget, review_filter, shards):
+        output_tokens = self.requests * self.output_tokens_per_record
+        return {
+            "source_files": self.source_files,
+            "source_records": self.source_records,
+            "skipped_records": self.skipped_records,
+            "watermark": self.watermark.to_dict() if self.watermark else None,
+            "filter": dict(review_filter.stats),
+            "truncated_reviews": budget.truncated,
+            "split_reviews": budget.split,
+            "cached_requests": self.cached_requests,
+            "requests": self.requests,
+            "estimated_input_tokens": self.input_tokens,
+            "estimated_output_tokens": output_tokens,
+            "estimated_cost_usd": round(
+                self.input_tokens / 1000 * self.input_price_per_1k
+                + output_tokens / 1000 * self.output_price_per_1k,
+                4,
+            ),
+            "shards": shards,
+        }
@@ -3,7 +3,7 @@ import { DropZone, Text, Flex, Button, VisuallyHidden } from '@aws-amplify/ui-re
 import { useTranslation } from 'react-i18next';
 
 export default function CSVUpload({files, setFiles}) {
-    const acceptedFileTypes = ['text/csv'];
+    const acceptedFileTypes = ['text/csv', '.csv', '.gz', '.parquet'];
     const hiddenInput = React.useRef(null);
 
     const onFilePickerChange = (event) => {
@@ -20,7 +20,7 @@ export default function CSVUpload({files, setFiles}) {
         <>
             <Flex direction="column">
             <DropZone
-                acceptedFileTypes={['text/csv']}
+                acceptedFileTypes={acceptedFileTypes}
                 onDropComplete={({ acceptedFiles, rejectedFiles }) => {
                     setFiles(acceptedFiles);
                 }}
@@ -23,8 +23,10 @@ export default function Uploader({gameId, jobId, fetchGames}) {
         const filename = files[0].name
 
         try {
-            await checkCSVColumns(files[0], ['id', 'review'])
-            
+            // compressed and Parquet files are validated when the job runs
+            if (filename.endsWith('.csv')) {
+                await checkCSVColumns(files[0], ['id', 'review'])
+            }
         } catch (err) {
             setError(err.message)
             return
@@ -38,7 +40,7 @@ export default function Uploader({gameId, jobId, fetchGames}) {
                     method: 'PUT',
                     body: file,
                     headers: {
-                        'Content-Type': file.type
+                        'Content-Type': data.content_type
                     }
                 })
                     .then(response => {
@@ -79,7 +81,7 @@ export default function Uploader({gameId, jobId, fetchGames}) {
                 </Message>
             )}
             <Message>
-                CSV files must have an "id" and "review" column
+                CSV, CSV.GZ and Parquet files must have an "id" and "review" column
             </Message>
             <CSVUpload files={files} setFiles={setFiles} />
             {hasUploaded && (<Text>File uploaded</Text>)}
@@ -45,6 +45,7 @@ if should_create_layers "$1"; then
     create_layer "functions/lambda_layers/boto3-layer" "boto3-layer" ""
     create_layer "functions/lambda_layers/gamescrud" "gamescrud-layer" "--platform manylinux2014_x86_64 --implementation cp --python-version 3.12 --only-binary=:all: --upgrade"
     create_layer "functions/lambda_layers/converse" "converse-layer" "--platform manylinux2014_x86_64 --implementation cp --python-version 3.12 --only-binary=:all: --upgrade"
+    create_layer "functions/lambda_layers/parquet" "parquet-layer" "--platform manylinux2014_x86_64 --implementation cp --python-version 3.12 --only-binary=:all: --upgrade"
 else
     echo "Skipping layer creation. Use --create-layers to create layers."
 fi
@@ -0,0 +1,99 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "functions", "lambda_layers", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT, "functions", "prepareforinference"))
+
+from common import review_duplicates
+from common.review_duplicates import Duplicates, resolve_representatives
+from utils.ReviewFilter import ReviewFilter
+
+REVIEW = "the combat is tight and the boss fights are great but the story drags on far too long in the middle chapters"
+
+
+def near_filter():
+    return ReviewFilter(
+        min_chars=1, max_chars=0, min_words=1, min_alpha_ratio=0, min_latin_ratio=0, dedupe="near", near_dup_threshold=0.5
+    )
+
+
+class ReviewFilterTest(unittest.TestCase):
+    def test_exact_copy_of_near_duplicate_names_the_classified_review(self):
+        review_filter = near_filter()
+        near_copy = REVIEW.replace("great", "superb")
+        self.assertEqual(review_filter.check("A", REVIEW), (True, None))
+        self.assertEqual(review_filter.check("B", near_copy), (False, "A"))
+        self.assertEqual(review_filter.check("C", near_copy.upper()), (False, "A"))
+
+
+class ResolveRepresentativesTest(unittest.TestCase):
+    def test_chain_resolves_to_classified_review(self):
+        # A was classified, B was collapsed onto A and C onto B
+        self.assertEqual(resolve_representatives({"B": "A", "C": "B"}), {"B": "A", "C": "A"})
+
+    def test_chain_listed_in_any_order(self):
+        self.assertEqual(
+            resolve_representatives({"D": "C", "C": "B", "B": "A", "E": "A"}),
+            {"D": "A", "C": "A", "B": "A", "E": "A"},
+        )
+
+    def test_cycle_ends(self):
+        self.assertEqual(set(resolve_representatives({"A": "B", "B": "A"})), {"A", "B"})
+
+
+class _Body(io.BytesIO):
+    def iter_chunks(self, chunk_size):
+        while chunk := self.read(chunk_size):
+            yield chunk
+
+
+class _S3:
+    """get_object of a single in-memory object, with byte ranges."""
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = 0
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.requests += 1
+        data = self.data
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": _Body(data)}
+
+
+def duplicates_file(pairs):
+    lines = (
+        json.dumps({"recordId": record_id, "representativeId": representative, "review": f"text of {record_id}"})
+        for record_id, representative in pairs
+    )
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class DuplicatesTest(unittest.TestCase):
+    def test_chain_fans_out_from_classified_review(self):
+        s3 = _S3(duplicates_file([("B", "A"), ("C", "B"), ("E", "X")]))
+        duplicates = Duplicates(s3, "bucket", "key")
+        self.assertEqual(sorted(duplicates.get("A")), [("B", "text of B"), ("C", "text of C")])
+        self.assertEqual(list(duplicates.get("B", [])), [])
+        self.assertEqual(list(duplicates.get("X")), [("E", "text of E")])
+
+    def test_distant_lines_are_read_separately(self):
+        s3 = _S3(duplicates_file([("B", "A")] + [(f"F{index}", "Z") for index in range(50)] + [("C", "A")]))
+        duplicates = Duplicates(s3, "bucket", "key")
+        original_gap = review_duplicates.MAX_RANGE_GAP
+        review_duplicates.MAX_RANGE_GAP = 100
+        try:
+            self.assertEqual(list(duplicates.get("A")), [("B", "text of B"), ("C", "text of C")])
+        finally:
+            review_duplicates.MAX_RANGE_GAP = original_gap
+        self.assertEqual(s3.requests, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()